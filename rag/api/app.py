@@ -1,19 +1,35 @@
 # api/app.py
 from __future__ import annotations
 import os
+import json
+import shutil
+import tempfile
+import threading
+import time
 from typing import List, Dict, Any
 import uuid
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from langchain_core.documents import Document
 from pathlib import Path
 import csv
 
-from rag.chains import make_qa_chain, make_classify_chain
-from rag.retrieval import get_hybrid_retriever, rerank_docs, rerank_with_info
-from rag.heuristics import auto_rule_hits, infer_regions
+from rag.chains import get_qa_chain, get_classify_chain
+from rag.retrieval import get_hybrid_retriever, retrieve_with_fallback
+from rag.heuristics import auto_rule_hits, infer_regions, match_rules
+from rag.batch import classify_batch, classify_stream
+from rag.embed_cache import get_embedding_cache
+from rag.reranker import get_reranker
+from rag.result_cache import get_result_cache, make_result_key
+from rag.utils import few_shot_version, parse_json_safe
+from rag.executors import run_in, shutdown_executors
+from rag.jobs import submit_job, get_job_store
+from rag.feedback_store import get_feedback_store
+from rag.metrics import REQUEST_SECONDS, render_prometheus, request_metrics, timed
 from api.schemas import (
     AskRequest, AskResponse,
     SearchRequest, SearchResponse, SearchDoc,
@@ -23,15 +39,22 @@ from api.schemas import (
     BatchClassifyAutoRequest,
     FeedbackRequest, FeedbackResponse,
 )
-from api.utils import rows_to_csv, append_jsonl, utc_now_iso, jsonl_has_record, write_json
+from api.utils import (
+    rows_to_csv, append_jsonl, utc_now_iso, write_json, stream_event, STREAM_MEDIA_TYPES,
+    iter_upload_rows, csv_line, batch_stream_csv_row, BATCH_STREAM_CSV_FIELDS,
+)
 from rag.config import get_config
 from rag.chunking import header_first_then_recursive
-from rag.qdrant_store import add_documents, delete_by_source_path, delete_by_source_paths
+from rag.qdrant_store import add_documents, delete_by_source_path, delete_by_source_paths, kb_version, bump_kb_version
 
 load_dotenv()
 
 app = FastAPI(title="Geo-Reg Compliance API", version="0.1.0")
 
+@app.on_event("shutdown")
+def _shutdown_executors():
+    shutdown_executors()
+
 # --- CORS for Next.js localhost ---
 origins = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
 app.add_middleware(
@@ -43,30 +66,55 @@ app.add_middleware(
 )
 
 # --- Chains ---
-# Groq-backed chains (Step 3)
-QA_CHAIN = make_qa_chain(k=5, mmr=False)
-CLASSIFY_CHAIN = make_classify_chain(k=5, mmr=False)
+# Groq-backed chains (Step 3), served from the chain cache; these warm the default entries
+QA_CHAIN = get_qa_chain(k=5, mmr=False)
+CLASSIFY_CHAIN = get_classify_chain(k=5, mmr=False)
+
+# --- Per-route latency (streaming routes: time until the response starts) ---
+@app.middleware("http")
+async def _route_latency(request, call_next):
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(getattr(route, "path", "unmatched"), time.perf_counter() - t0)
+    return response
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: stage latency histograms, route latency, LLM token counters."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache/stats")
+def cache_stats():
+    emb = get_embedding_cache()
+    res = get_result_cache()
+    rr = get_reranker()
+    return {
+        "embeddings": emb.stats() if emb is not None else {"enabled": False},
+        "classify_results": res.stats() if res is not None else {"enabled": False},
+        "rerank": rr.stats() if rr is not None else {"enabled": False},
+    }
+
 # ---------- Ask (RAG QA) ----------
 @app.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest):
+async def ask(req: AskRequest):
     try:
-        chain = make_qa_chain(k=req.k, mmr=req.mmr)
-        answer: str = chain.invoke(req.question)
+        chain = get_qa_chain(k=req.k, mmr=req.mmr)
+        answer: str = await chain.ainvoke(req.question)
         return AskResponse(answer=answer)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # ---------- Search (raw retrieval preview) ----------
 @app.post("/search", response_model=SearchResponse)
-def search(req: SearchRequest):
+async def search(req: SearchRequest):
     try:
         retriever = get_hybrid_retriever(k=req.k, mmr=req.mmr)
-        docs: List[Document] = retriever.invoke(req.query)
+        docs: List[Document] = await run_in("retrieval", retriever.invoke, req.query)
         return SearchResponse(
             docs=[SearchDoc(content=d.page_content, metadata=d.metadata) for d in docs]
         )
@@ -99,7 +147,111 @@ def list_laws():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _clear_result_cache() -> None:
+    cache = get_result_cache()
+    if cache is not None:
+        cache.clear()
+
 # ---------- Laws upload (PDF → txt → manifest → chunk + index) ----------
+def _ingest_pdf(pdf_path: Path, filename: str, law_name: str, region: str, source: str, article_or_section: str,
+                progress=None) -> Dict[str, Any]:
+    """Background part of /laws/upload: PDF → txt → manifest → chunk + index.
+    `progress(stage, **info)` (from rag.jobs) is called as each stage starts.
+    """
+    progress = progress or (lambda stage, **info: None)
+    cfg = get_config()
+    # 2) Extract text using docling if available, else fallback to pypdf
+    progress("parsing")
+    text = ""
+    try:
+        from docling.document_converter import DocumentConverter  # type: ignore
+        conv = DocumentConverter()
+        res = conv.convert(str(pdf_path))
+        text = getattr(res, "text", None) or getattr(res, "plaintext", None) or ""
+        if not text and hasattr(res, "document"):
+            try:
+                text = res.document.export_to_text()
+            except Exception:
+                pass
+    except Exception:
+        text = ""
+    if not text:
+        try:
+            from pypdf import PdfReader  # type: ignore
+            reader = PdfReader(str(pdf_path))
+            parts = []
+            for p in reader.pages:
+                try:
+                    parts.append(p.extract_text() or "")
+                except Exception:
+                    continue
+            text = "\n\n".join(parts).strip()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to extract text: {e}")
+    if len(text.strip()) < 50:
+        raise HTTPException(status_code=400, detail="Parsed text seems empty or too short")
+
+    # 3) Save txt into kb_raw
+    progress("saving", text_chars=len(text))
+    safe_base = "".join(c if c.isalnum() or c in ("-","_"," ") else "_" for c in law_name).strip().replace(" ", "_")
+    if not safe_base:
+        safe_base = Path(filename).stem
+    txt_name = f"{safe_base}.txt"
+    kb_dir = (Path(__file__).resolve().parents[1] / cfg.raw_dir).resolve()
+    kb_dir.mkdir(parents=True, exist_ok=True)
+    txt_path = kb_dir / txt_name
+    txt_path.write_text(text, encoding="utf-8")
+
+    # 4) Update manifest CSV
+    progress("manifest", txt_file=txt_name)
+    manifest = os.getenv("MANIFEST_CSV", "data/laws_manifest.csv")
+    man_path = Path(manifest)
+    if not man_path.exists():
+        man_path = (Path(__file__).resolve().parents[1] / manifest).resolve()
+    write_header = not man_path.exists()
+    man_path.parent.mkdir(parents=True, exist_ok=True)
+    with man_path.open("a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["file_path","law_name","region","source","article_or_section"])
+        if write_header:
+            writer.writeheader()
+        writer.writerow({
+            "file_path": txt_name,
+            "law_name": law_name,
+            "region": region,
+            "source": source,
+            "article_or_section": article_or_section,
+        })
+
+    # 5) Chunk the text and index into Qdrant (only the new law)
+    progress("chunking")
+    content_with_header = f"## {law_name}\n\n{text.strip()}"
+    docs = header_first_then_recursive(
+        text=content_with_header,
+        source_path=str(txt_path),
+        headers=[("#","h1"),("##","h2"),("###","h3")],
+        max_header_chunk_chars=cfg.max_header_chunk_chars,
+        recursive_chunk_chars=cfg.recursive_chunk_chars,
+        recursive_overlap_chars=cfg.recursive_overlap_chars,
+        skip_reference_sections=cfg.skip_reference_sections,
+    )
+    for d in docs:
+        m = d.metadata
+        m.setdefault("law_name", law_name)
+        m.setdefault("region", region)
+        m.setdefault("source", source)
+        if article_or_section:
+            m.setdefault("article_or_section", article_or_section)
+    progress("indexing", chunks=len(docs))
+    added = add_documents(docs)  # bumps the KB version
+    _clear_result_cache()
+
+    return {
+        "ok": True,
+        "txt_file": str(txt_path.name),
+        "manifest": str(man_path),
+        "indexed_chunks": added,
+    }
+
 @app.post("/laws/upload")
 async def upload_law(
     file: UploadFile = File(...),
@@ -113,103 +265,37 @@ async def upload_law(
             raise HTTPException(status_code=400, detail="Only PDF uploads are supported")
 
         # 1) Save uploaded PDF to tmp
-        cfg = get_config()
         tmp_dir = (Path(__file__).resolve().parents[1] / "data/tmp_uploads").resolve()
         tmp_dir.mkdir(parents=True, exist_ok=True)
         pdf_path = tmp_dir / file.filename
         content = await file.read()
         pdf_path.write_bytes(content)
 
-        # 2) Extract text using docling if available, else fallback to pypdf
-        text = ""
-        try:
-            from docling.document_converter import DocumentConverter  # type: ignore
-            conv = DocumentConverter()
-            res = conv.convert(str(pdf_path))
-            text = getattr(res, "text", None) or getattr(res, "plaintext", None) or ""
-            if not text and hasattr(res, "document"):
-                try:
-                    text = res.document.export_to_text()
-                except Exception:
-                    pass
-        except Exception:
-            text = ""
-        if not text:
-            try:
-                from pypdf import PdfReader  # type: ignore
-                reader = PdfReader(str(pdf_path))
-                parts = []
-                for p in reader.pages:
-                    try:
-                        parts.append(p.extract_text() or "")
-                    except Exception:
-                        continue
-                text = "\n\n".join(parts).strip()
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Failed to extract text: {e}")
-        if len(text.strip()) < 50:
-            raise HTTPException(status_code=400, detail="Parsed text seems empty or too short")
-
-        # 3) Save txt into kb_raw
-        safe_base = "".join(c if c.isalnum() or c in ("-","_"," ") else "_" for c in law_name).strip().replace(" ", "_")
-        if not safe_base:
-            safe_base = Path(file.filename).stem
-        txt_name = f"{safe_base}.txt"
-        kb_dir = (Path(__file__).resolve().parents[1] / cfg.raw_dir).resolve()
-        kb_dir.mkdir(parents=True, exist_ok=True)
-        txt_path = kb_dir / txt_name
-        txt_path.write_text(text, encoding="utf-8")
-
-        # 4) Update manifest CSV
-        manifest = os.getenv("MANIFEST_CSV", "data/laws_manifest.csv")
-        man_path = Path(manifest)
-        if not man_path.exists():
-            man_path = (Path(__file__).resolve().parents[1] / manifest).resolve()
-        write_header = not man_path.exists()
-        man_path.parent.mkdir(parents=True, exist_ok=True)
-        with man_path.open("a", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=["file_path","law_name","region","source","article_or_section"])
-            if write_header:
-                writer.writeheader()
-            writer.writerow({
-                "file_path": txt_name,
-                "law_name": law_name,
-                "region": region,
-                "source": source,
-                "article_or_section": article_or_section,
-            })
-
-        # 5) Chunk the text and index into Qdrant (only the new law)
-        content_with_header = f"## {law_name}\n\n{text.strip()}"
-        docs = header_first_then_recursive(
-            text=content_with_header,
-            source_path=str(txt_path),
-            headers=[("#","h1"),("##","h2"),("###","h3")],
-            max_header_chunk_chars=cfg.max_header_chunk_chars,
-            recursive_chunk_chars=cfg.recursive_chunk_chars,
-            recursive_overlap_chars=cfg.recursive_overlap_chars,
-            skip_reference_sections=cfg.skip_reference_sections,
-        )
-        for d in docs:
-            m = d.metadata
-            m.setdefault("law_name", law_name)
-            m.setdefault("region", region)
-            m.setdefault("source", source)
-            if article_or_section:
-                m.setdefault("article_or_section", article_or_section)
-        added = add_documents(docs)
-
-        return {
-            "ok": True,
-            "txt_file": str(txt_path.name),
-            "manifest": str(man_path),
-            "indexed_chunks": added,
-        }
+        # 2-5) Parse, chunk and index as a background job; poll /laws/jobs/{job_id}
+        params = {"filename": file.filename, "law_name": law_name, "region": region,
+                  "source": source, "article_or_section": article_or_section}
+        job_id = submit_job("law_upload", _ingest_pdf, params, pdf_path=pdf_path, **params)
+        return {"ok": True, "job_id": job_id, "status": "queued"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Ingestion jobs ----------
+@app.get("/laws/jobs")
+def list_jobs(limit: int = 50):
+    try:
+        return {"jobs": get_job_store().list(limit=limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/laws/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # ---------- Laws delete (remove txt + manifest row + index) ----------
 @app.post("/laws/delete")
 def delete_law(body: Dict[str, Any]):
@@ -231,6 +317,9 @@ def delete_law(body: Dict[str, Any]):
         v3 = str((Path("rag") / Path(cfg.raw_dir) / file_path))  # e.g., rag/data/kb_raw/file.txt
         variants = [v1, v2, v3]
         deleted = delete_by_source_paths(variants)
+        # KB changed: cached classify answers keyed on the old version are now stale
+        bump_kb_version()
+        _clear_result_cache()
 
         # 2) Remove from manifest
         manifest = os.getenv("MANIFEST_CSV", "data/laws_manifest.csv")
@@ -266,108 +355,110 @@ def delete_law(body: Dict[str, Any]):
         raise HTTPException(status_code=500, detail=str(e))
 
 # ---------- Classify (single) ----------
-@app.post("/classify", response_model=ClassifyResponse)
-def classify(req: ClassifyRequest):
-    try:
-        req_id = str(uuid.uuid4())
-        import time
-        t0 = time.perf_counter()
-        # Use override regions if provided, else infer from text
-        regions = req.regions if getattr(req, "regions", None) else infer_regions(req.feature_text)
-        # Build provenance from retrieval (law snippets surfaced)
-        filtered_used = bool(regions)
-        retriever = get_hybrid_retriever(k=req.k, mmr=req.mmr, regions=regions if regions else None)
-        docs: List[Document] = retriever.invoke(req.feature_text)
-        rerank_info: Dict[str, Any] = {"method": "disabled"}
-        try:
-            docs, rerank_info = rerank_with_info(req.feature_text, docs, top_k=req.k)
-        except Exception:
-            rerank_info = {"method": "error"}
-        # Fallbacks: try each region solo, then drop filter entirely
-        if not docs and regions:
-            for r in regions:
-                retriever_single = get_hybrid_retriever(k=req.k, mmr=req.mmr, regions=[r])
-                docs = retriever_single.invoke(req.feature_text)
-                if docs:
-                    filtered_used = True
-                    break
-        if not docs:
-            retriever_any = get_hybrid_retriever(k=req.k, mmr=req.mmr, regions=None)
-            docs = retriever_any.invoke(req.feature_text)
-            if docs:
-                filtered_used = False
-        # Final rerank on the chosen set (capture info if earlier failed)
-        if docs and (rerank_info.get("method") in {"disabled", "error"}):
-            try:
-                docs, rerank_info = rerank_with_info(req.feature_text, docs, top_k=req.k)
-            except Exception:
-                rerank_info = {"method": "error"}
-        t1 = time.perf_counter()
-
-        # Post-filter safeguard: if we inferred regions but had to drop the store filter,
-        # keep only matching regions from retrieved docs when possible.
-        if docs and regions and not filtered_used:
-            docs_filtered = [d for d in docs if (d.metadata or {}).get("region") in regions]
-            if docs_filtered:
-                docs = docs_filtered[: req.k]
-                filtered_used = True
-        retrieved = []
-        for d in docs:
-            m = d.metadata or {}
-            retrieved.append({
-                "law_name": m.get("law_name"),
-                "region": m.get("region"),
-                "article_or_section": m.get("article_or_section"),
-                "source": m.get("source"),
-                "h1": m.get("h1"),
-                "h2": m.get("h2"),
-                "h3": m.get("h3"),
-                "source_path": m.get("source_path"),
-            })
-
-        # If region-filtered retrieval wasn’t used (or failed), build unfiltered chain for answer quality
-        use_regions = regions if filtered_used else None
-        chain = make_classify_chain(k=req.k, mmr=req.mmr, regions=use_regions)
-        out: Dict[str, Any] = chain.invoke({"feature_text": req.feature_text, "rule_hits": req.rule_hits})
-        # Merge/ensure provenance
-        prov = out.get("provenance", {}) or {}
-        input_rules = req.rule_hits or []
-        llm_rules = prov.get("rules_hit", []) or []
-        # keep both: 'rules_input' = provided; 'rules_hit' = union for audit
-        prov["rules_input"] = input_rules
-        prov["rules_hit"] = sorted(set(llm_rules + input_rules))
-        prov.setdefault("retrieved", retrieved)
-        # Fill retrieved_law_ids if missing, e.g., ["US-UT:Utah Social Media Regulation Act"]
-        if not prov.get("retrieved_law_ids"):
-            ids = []
-            for r in retrieved:
-                rgn = (r.get("region") or "").strip()
-                name = (r.get("law_name") or "").strip()
-                if rgn or name:
-                    ids.append(f"{rgn}:{name}".strip(":"))
-            prov["retrieved_law_ids"] = ids
-        prov.setdefault("regions_inferred", regions)
-        prov.setdefault("region_filter_used", filtered_used)
-        # Metrics
-        metrics = prov.get("metrics", {}) or {}
-        metrics.update({
-            "elapsed_ms": int((t1 - t0) * 1000),
-            "k": req.k,
-            "mmr": bool(req.mmr),
-            "retrieved_count": len(docs),
-            "model": os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
-            "rerank": rerank_info,
-            "request_id": req_id,
+def _retrieved_meta(docs: List[Document]) -> List[Dict[str, Any]]:
+    retrieved = []
+    for d in docs:
+        m = d.metadata or {}
+        retrieved.append({
+            "law_name": m.get("law_name"),
+            "region": m.get("region"),
+            "article_or_section": m.get("article_or_section"),
+            "source": m.get("source"),
+            "h1": m.get("h1"),
+            "h2": m.get("h2"),
+            "h3": m.get("h3"),
+            "source_path": m.get("source_path"),
         })
-        prov["metrics"] = metrics
-        # Confidence calibration
-        out_conf = float(out.get("confidence", 0.5))
-        rules_combined = prov.get("rules_hit", [])
-        out["confidence"] = _calibrate_confidence(out_conf, rules_combined, regions, filtered_used)
-        out["provenance"] = prov
-        # Append server-side inference log (best-effort)
-        try:
-            log_path = os.getenv("CLASSIFY_LOG_JSONL", "data/classify_log.jsonl")
+    return retrieved
+
+def _classify_cache_key(req: ClassifyRequest, regions: List[str]) -> str:
+    return make_result_key(
+        feature_text=req.feature_text,
+        rule_hits=req.rule_hits,
+        regions=regions,
+        k=req.k,
+        mmr=bool(req.mmr),
+        kb_version=kb_version(),
+        few_shot_version=few_shot_version(),
+        model=os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
+    )
+
+def _finalize_classify(
+    out: Dict[str, Any],
+    req: ClassifyRequest,
+    regions: List[str],
+    docs: List[Document],
+    rerank_info: Dict[str, Any],
+    filtered_used: bool,
+    req_id: str,
+    t0: float,
+    t1: float,
+) -> Dict[str, Any]:
+    retrieved = _retrieved_meta(docs)
+    # Merge/ensure provenance
+    prov = out.get("provenance", {}) or {}
+    input_rules = req.rule_hits or []
+    llm_rules = prov.get("rules_hit", []) or []
+    # keep both: 'rules_input' = provided; 'rules_hit' = union for audit
+    prov["rules_input"] = input_rules
+    prov["rules_hit"] = sorted(set(llm_rules + input_rules))
+    # Where each heuristic rule matched in the feature text: tag → [start, end, matched text]
+    prov["rule_spans"] = match_rules(req.feature_text).provenance()
+    prov.setdefault("retrieved", retrieved)
+    # Fill retrieved_law_ids if missing, e.g., ["US-UT:Utah Social Media Regulation Act"]
+    if not prov.get("retrieved_law_ids"):
+        ids = []
+        for r in retrieved:
+            rgn = (r.get("region") or "").strip()
+            name = (r.get("law_name") or "").strip()
+            if rgn or name:
+                ids.append(f"{rgn}:{name}".strip(":"))
+        prov["retrieved_law_ids"] = ids
+    prov.setdefault("regions_inferred", regions)
+    prov.setdefault("region_filter_used", filtered_used)
+    # Metrics
+    metrics = prov.get("metrics", {}) or {}
+    metrics.update({
+        # elapsed_ms: retrieval through LLM + parse; retrieval_ms: retrieval + rerank only
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+        "retrieval_ms": int((t1 - t0) * 1000),
+        "k": req.k,
+        "mmr": bool(req.mmr),
+        "retrieved_count": len(docs),
+        "model": os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
+        "rerank": rerank_info,
+        "request_id": req_id,
+        "cache_hit": False,
+    })
+    prov["metrics"] = metrics
+    # Confidence calibration
+    out_conf = float(out.get("confidence", 0.5))
+    rules_combined = prov.get("rules_hit", [])
+    out["confidence"] = _calibrate_confidence(out_conf, rules_combined, regions, filtered_used)
+    out["provenance"] = prov
+    return out
+
+async def _classify_uncached(req: ClassifyRequest, regions: List[str], req_id: str, t0: float) -> Dict[str, Any]:
+    # Retrieve + rerank once (on the retrieval executor); the same docs feed the LLM context and the provenance
+    docs, rerank_info, filtered_used = await run_in(
+        "retrieval", retrieve_with_fallback,
+        req.feature_text, k=req.k, mmr=req.mmr, regions=regions if regions else None,
+    )
+    t1 = time.perf_counter()
+    # Chain lookup refreshes the few-shot index (file tail), so it runs off the event loop too.
+    # Docs are passed in, so regions play no part in the chain (and stay out of its cache key)
+    chain = await run_in("retrieval", get_classify_chain, k=req.k, mmr=req.mmr)
+    out: Dict[str, Any] = await chain.ainvoke({"feature_text": req.feature_text, "rule_hits": req.rule_hits, "docs": docs})
+    return _finalize_classify(out, req, regions, docs, rerank_info, filtered_used, req_id, t0, t1)
+
+_LOG_LOCK = threading.Lock()
+
+def _log_classification(req_id: str, req: ClassifyRequest, regions: List[str], out: Dict[str, Any]) -> None:
+    # Append server-side inference log (best-effort). Blocking file I/O: callers run it via run_in,
+    # and the lock keeps concurrent appends from interleaving within a line.
+    try:
+        log_path = os.getenv("CLASSIFY_LOG_JSONL", "data/classify_log.jsonl")
+        with timed("log_write"), _LOG_LOCK:
             append_jsonl(log_path, {
                 "ts": utc_now_iso(),
                 "request_id": req_id,
@@ -376,32 +467,175 @@ def classify(req: ClassifyRequest):
                 "regions": regions,
                 "response": out,
             })
-        except Exception:
-            pass
-        return ClassifyResponse(**out)
+        few_shot_version()  # keep the few-shot index current (tails only the new line)
+    except Exception:
+        pass
+
+def _mark_cache_hit(out: Dict[str, Any], req_id: str, t0: float) -> None:
+    metrics = out["provenance"].setdefault("metrics", {})
+    metrics.update({
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+        "request_id": req_id,
+        "cache_hit": True,
+    })
+
+def _attach_stage_metrics(out: Dict[str, Any], rm) -> None:
+    # This request's stage timings (ms), stage call counts and LLM token counts
+    out["provenance"].setdefault("metrics", {}).update(rm.as_dict())
+
+@app.post("/classify", response_model=ClassifyResponse)
+async def classify(req: ClassifyRequest):
+    try:
+        with request_metrics() as rm:
+            req_id = str(uuid.uuid4())
+            t0 = time.perf_counter()
+            # Use override regions if provided, else infer from text
+            regions = req.regions if getattr(req, "regions", None) else infer_regions(req.feature_text)
+            # Response cache: same inputs on an unchanged KB + few-shot snapshot reuse the last answer
+            cache = get_result_cache()
+            # kb_version()/few_shot_version() read files: keep them off the event loop
+            cache_key = await run_in("retrieval", _classify_cache_key, req, regions)
+            out = cache.get(cache_key) if cache is not None else None
+            if out is not None:
+                _mark_cache_hit(out, req_id, t0)
+            else:
+                out = await _classify_uncached(req, regions, req_id, t0)
+                # Validate before caching: a malformed LLM answer fails this request, not every repeat of it
+                ClassifyResponse(**out)
+                if cache is not None:
+                    cache.put(cache_key, out)
+            await run_in("retrieval", _log_classification, req_id, req, regions, out)
+            _attach_stage_metrics(out, rm)
+            return ClassifyResponse(**out)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _auto_request(req: ClassifyAutoRequest) -> ClassifyRequest:
+    # One pass gives both the rule hits and the regions classify() would otherwise re-infer
+    m = match_rules(req.feature_text)
+    regions = getattr(req, "regions", None) or list(m.regions)
+    return ClassifyRequest(feature_text=req.feature_text, rule_hits=list(m.tags), k=req.k, mmr=req.mmr, regions=regions)
+
 # ---------- Classify (auto rules) ----------
 @app.post("/classify_auto", response_model=ClassifyResponse)
-def classify_auto(req: ClassifyAutoRequest):
+async def classify_auto(req: ClassifyAutoRequest):
     try:
-        rules = auto_rule_hits(req.feature_text)
-        return classify(ClassifyRequest(feature_text=req.feature_text, rule_hits=rules, k=req.k, mmr=req.mmr, regions=getattr(req, "regions", None)))
+        return await classify(_auto_request(req))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Streaming variants (SSE by default, ?format=ndjson for NDJSON) ----------
+# Events, in order:
+#   sources  retrieved chunks (same fields as provenance.retrieved), sent before the LLM call
+#   token    {"text": ...} model output as it is generated (classify: the raw JSON text)
+#   final    the complete response (/ask: {"answer", "sources"}; /classify: same body as /classify)
+#   error    {"detail": ...} if something fails after the stream has started
+def _stream_response(events, fmt: str) -> StreamingResponse:
+    fmt = fmt if fmt in STREAM_MEDIA_TYPES else "sse"
+
+    async def _body():
+        try:
+            async for event, data in events:
+                yield stream_event(fmt, event, data)
+        except Exception as e:
+            yield stream_event(fmt, "error", {"detail": str(e)})
+
+    return StreamingResponse(
+        _body(),
+        media_type=STREAM_MEDIA_TYPES[fmt],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _ask_events(req: AskRequest):
+    with request_metrics() as rm:
+        t0 = time.perf_counter()
+        docs, rerank_info, _ = await run_in("retrieval", retrieve_with_fallback, req.question, k=req.k, mmr=req.mmr, regions=None)
+        sources = _retrieved_meta(docs)
+        yield "sources", sources
+        chain = get_qa_chain(k=req.k, mmr=req.mmr)
+        parts: List[str] = []
+        first_token_ms = None
+        async for tok in chain.astream({"question": req.question, "docs": docs}):
+            if not tok:
+                continue
+            if first_token_ms is None:
+                first_token_ms = int((time.perf_counter() - t0) * 1000)
+            parts.append(tok)
+            yield "token", {"text": tok}
+        yield "final", {
+            "answer": "".join(parts),
+            "sources": sources,
+            "metrics": {
+                "first_token_ms": first_token_ms,
+                "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+                "rerank": rerank_info,
+                **rm.as_dict(),
+            },
+        }
+
+async def _classify_events(req: ClassifyRequest):
+    with request_metrics() as rm:
+        req_id = str(uuid.uuid4())
+        t0 = time.perf_counter()
+        regions = req.regions if getattr(req, "regions", None) else infer_regions(req.feature_text)
+        cache = get_result_cache()
+        cache_key = await run_in("retrieval", _classify_cache_key, req, regions)
+        out = cache.get(cache_key) if cache is not None else None
+        if out is not None:
+            _mark_cache_hit(out, req_id, t0)
+            yield "sources", out["provenance"].get("retrieved", [])
+        else:
+            docs, rerank_info, filtered_used = await run_in(
+                "retrieval", retrieve_with_fallback,
+                req.feature_text, k=req.k, mmr=req.mmr, regions=regions if regions else None,
+            )
+            t1 = time.perf_counter()
+            yield "sources", _retrieved_meta(docs)
+            chain = await run_in(
+                "retrieval", get_classify_chain,
+                k=req.k, mmr=req.mmr, parse_output=False, json_mode=False,
+            )
+            parts: List[str] = []
+            first_token_ms = None
+            async for tok in chain.astream({"feature_text": req.feature_text, "rule_hits": req.rule_hits, "docs": docs}):
+                if not tok:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = int((time.perf_counter() - t0) * 1000)
+                parts.append(tok)
+                yield "token", {"text": tok}
+            out = _finalize_classify(parse_json_safe("".join(parts)), req, regions, docs, rerank_info, filtered_used, req_id, t0, t1)
+            # No JSON mode here: prose or malformed output fails validation and is never cached
+            ClassifyResponse(**out)
+            if cache is not None:
+                cache.put(cache_key, out)  # deep copy, without this stream's timing
+            # Per-stream timing goes on the live response only, never into the shared cache
+            out["provenance"]["metrics"]["first_token_ms"] = first_token_ms
+        await run_in("retrieval", _log_classification, req_id, req, regions, out)
+        _attach_stage_metrics(out, rm)
+        yield "final", jsonable_encoder(ClassifyResponse(**out))
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest, format: str = "sse"):
+    return _stream_response(_ask_events(req), format)
+
+@app.post("/classify/stream")
+async def classify_stream(req: ClassifyRequest, format: str = "sse"):
+    return _stream_response(_classify_events(req), format)
+
+@app.post("/classify_auto/stream")
+async def classify_auto_stream(req: ClassifyAutoRequest, format: str = "sse"):
+    return _stream_response(_classify_events(_auto_request(req)), format)
+
 # ---------- Feedback (review + logging) ----------
 @app.post("/feedback", response_model=FeedbackResponse)
 def feedback(req: FeedbackRequest):
     try:
-        path = os.getenv("FEEDBACK_LOG_JSONL", "data/feedback.jsonl")
         # Enforce one feedback per classification request
         if not req.request_id:
             raise HTTPException(status_code=400, detail="request_id is required for feedback")
-        if jsonl_has_record(path, "request_id", req.request_id):
-            raise HTTPException(status_code=409, detail="Feedback already recorded for this request_id")
-        saved = append_jsonl(path, {
+        store = get_feedback_store()
+        added = store.add({
             "ts": utc_now_iso(),
             "request_id": req.request_id,
             "feature_text": req.feature_text,
@@ -413,62 +647,55 @@ def feedback(req: FeedbackRequest):
             "rules_input": req.rules_input,
             "regions": req.regions,
         })
-        return FeedbackResponse(ok=True, saved_path=saved)
+        if not added:
+            raise HTTPException(status_code=409, detail="Feedback already recorded for this request_id")
+        # New feedback may change the few-shot examples baked into classify prompts:
+        # fold it into the index now so the next classify sees the new version
+        few_shot_version()
+        return FeedbackResponse(ok=True, saved_path=str(store.jsonl_path))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/feedback/stats")
 def feedback_stats():
     try:
-        import json
-        from pathlib import Path
-        path = os.getenv("FEEDBACK_LOG_JSONL", "data/feedback.jsonl")
-        p = Path(path)
-        if not p.exists():
-            p = (Path(__file__).resolve().parents[1] / path).resolve()
-        if not p.exists():
-            return {"total": 0, "by_vote": {}, "by_correction": {}}
-        by_vote: Dict[str, int] = {}
-        by_corr: Dict[str, int] = {}
-        total = 0
-        with p.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                total += 1
-                try:
-                    rec = json.loads(line)
-                except Exception:
-                    continue
-                v = (rec.get("vote") or "").lower() or "unknown"
-                by_vote[v] = by_vote.get(v, 0) + 1
-                corr = (rec.get("correction_needs_geo_logic") or "none").lower()
-                by_corr[corr] = by_corr.get(corr, 0) + 1
-        return {"total": total, "by_vote": by_vote, "by_correction": by_corr}
+        store = get_feedback_store()
+        store.sync()  # pick up lines appended outside the API (cheap: reads only the new tail)
+        return store.stats()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # ---------- Batch Classify ----------
+def _batch_rows(items: List[Dict[str, Any]], req) -> List[BatchClassifyRow]:
+    results = classify_batch(
+        items,
+        k=req.k,
+        mmr=req.mmr,
+        regions=req.regions if getattr(req, "regions", None) else None,
+    )
+    return [_batch_row(item, res) for item, res in zip(items, results)]
+
+def _batch_row(item: Dict[str, Any], res: Dict[str, Any]) -> BatchClassifyRow:
+    out: Dict[str, Any] = res["out"]
+    # Calibrate confidence per row
+    rules_combined = item["rule_hits"] or []
+    calibrated = _calibrate_confidence(float(out.get("confidence", 0.5)), rules_combined, res["regions"], res["filtered_used"])
+    return BatchClassifyRow(
+        feature_text=item["feature_text"],
+        needs_geo_logic=out.get("needs_geo_logic","unclear"),
+        reasoning=out.get("reasoning",""),
+        laws=out.get("laws",[]),
+        confidence=calibrated,
+        rule_hits=item["rule_hits"],
+    )
+
 @app.post("/batch_classify", response_model=BatchClassifyResponse)
 def batch_classify(req: BatchClassifyRequest):
     try:
-        rows: List[BatchClassifyRow] = []
-        for item in req.rows:
-            regions = req.regions if getattr(req, "regions", None) else infer_regions(item.feature_text)
-            chain = make_classify_chain(k=req.k, mmr=req.mmr, regions=regions)
-            out: Dict[str, Any] = chain.invoke({"feature_text": item.feature_text, "rule_hits": item.rule_hits})
-            # Calibrate confidence per row
-            rules_combined = item.rule_hits or []
-            calibrated = _calibrate_confidence(float(out.get("confidence", 0.5)), rules_combined, regions, bool(regions))
-            rows.append(BatchClassifyRow(
-                feature_text=item.feature_text,
-                needs_geo_logic=out.get("needs_geo_logic","unclear"),
-                reasoning=out.get("reasoning",""),
-                laws=out.get("laws",[]),
-                confidence=calibrated,
-                rule_hits=item.rule_hits,
-            ))
+        items = [{"feature_text": it.feature_text, "rule_hits": it.rule_hits} for it in req.rows]
+        rows = _batch_rows(items, req)
         payload = {"rows": rows}
         if req.csv:
             # Build CSV string (for downloads)
@@ -482,21 +709,8 @@ def batch_classify(req: BatchClassifyRequest):
 @app.post("/batch_classify_auto", response_model=BatchClassifyResponse)
 def batch_classify_auto(req: BatchClassifyAutoRequest):
     try:
-        rows: List[BatchClassifyRow] = []
-        for item in req.rows:
-            rules = auto_rule_hits(item.feature_text)
-            regions = req.regions if getattr(req, "regions", None) else infer_regions(item.feature_text)
-            chain = make_classify_chain(k=req.k, mmr=req.mmr, regions=regions)
-            out: Dict[str, Any] = chain.invoke({"feature_text": item.feature_text, "rule_hits": rules})
-            calibrated = _calibrate_confidence(float(out.get("confidence", 0.5)), rules, regions, bool(regions))
-            rows.append(BatchClassifyRow(
-                feature_text=item.feature_text,
-                needs_geo_logic=out.get("needs_geo_logic","unclear"),
-                reasoning=out.get("reasoning",""),
-                laws=out.get("laws",[]),
-                confidence=calibrated,
-                rule_hits=rules,
-            ))
+        items = [{"feature_text": it.feature_text, "rule_hits": auto_rule_hits(it.feature_text)} for it in req.rows]
+        rows = _batch_rows(items, req)
         payload = {"rows": rows}
         if req.csv:
             flat_rows = [r.model_dump() for r in rows]
@@ -505,6 +719,69 @@ def batch_classify_auto(req: BatchClassifyAutoRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Batch Classify (streaming upload) ----------
+@app.post("/batch_classify/stream")
+def batch_classify_stream(
+    file: UploadFile = File(...),
+    k: int = Form(5),
+    mmr: bool = Form(False),
+    regions: str = Form(""),
+    auto_rules: bool = Form(True),
+    start: int = Form(0),
+    output: str = Form("ndjson"),
+    ordered: bool = Form(True),
+):
+    """Classify an uploaded CSV or NDJSON file (.jsonl/.ndjson), streaming each row back as it completes.
+    - Input rows: feature_text (or feature_name + feature_description), optional rule_hits / regions.
+      Rows without rule_hits get heuristic hits when auto_rules is set.
+    - output: "ndjson" (one BatchClassifyRow + "index" per line, or {"index", "error"}) or "csv"
+      (header, then one line per row; columns in api.utils.BATCH_STREAM_CSV_FIELDS).
+    - Resume: rows are numbered from 0 in upload order; start=N skips rows before N.
+      With ordered=true (default) rows come back in index order, so N = last index received + 1.
+    - Memory stays bounded: the upload is read lazily and only a small window of rows is in flight.
+    """
+    fmt = "ndjson" if Path(file.filename or "").suffix.lower() in {".jsonl", ".ndjson"} else "csv"
+    if output not in {"ndjson", "csv"}:
+        raise HTTPException(status_code=400, detail="output must be 'ndjson' or 'csv'")
+    override = [r.strip() for r in regions.split(",") if r.strip()] or None
+    # FastAPI closes the upload once this handler returns, before the body streams: keep our own copy (on disk)
+    upload = tempfile.TemporaryFile()
+    shutil.copyfileobj(file.file, upload)
+    upload.seek(0)
+
+    def _items():
+        for i, row in enumerate(iter_upload_rows(upload, fmt)):
+            if i < start:
+                continue
+            if auto_rules and not row.get("rule_hits") and row.get("feature_text"):
+                row["rule_hits"] = auto_rule_hits(row["feature_text"])
+            row.setdefault("rule_hits", [])
+            yield i, row
+
+    def _body():
+        try:
+            if output == "csv":
+                yield csv_line(BATCH_STREAM_CSV_FIELDS)
+            for i, item, res in classify_stream(_items(), k=k, mmr=mmr, regions=override, ordered=ordered):
+                try:
+                    if res.get("error"):
+                        raise ValueError(res["error"])
+                    row = {"index": i, **_batch_row(item, res).model_dump()}
+                except Exception as e:
+                    row = {"index": i, "feature_text": item.get("feature_text", ""), "error": str(e)}
+                if output == "csv":
+                    yield csv_line(BATCH_STREAM_CSV_FIELDS, batch_stream_csv_row(i, row))
+                else:
+                    yield json.dumps(row, ensure_ascii=False) + "\n"
+        finally:
+            upload.close()
+
+    return StreamingResponse(
+        _body(),
+        media_type="text/csv" if output == "csv" else STREAM_MEDIA_TYPES["ndjson"],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ---------- Confidence calibration ----------
 def _calibrate_confidence(base: float, rules: List[str], regions: List[str], filter_used: bool) -> float:
     base = max(0.0, min(1.0, float(base)))
@@ -1,31 +1,98 @@
 from __future__ import annotations
 import csv
 import io
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, BinaryIO, Iterator
 from pathlib import Path
 import json
 from datetime import datetime, timezone
 
-def rows_to_csv(rows: List[Dict[str, Any]]) -> str:
+CSV_FIELDS = ["feature_text", "needs_geo_logic", "reasoning", "laws", "confidence", "rule_hits"]
+
+def _csv_row(r: Dict[str, Any]) -> Dict[str, Any]:
     # Flatten laws as compact strings for CSV
     def law_str(l):
         parts = [l.get("name",""), l.get("region",""), l.get("article_or_section",""), l.get("source","")]
         return " | ".join([p for p in parts if p])
+    return {
+        "feature_text": r["feature_text"],
+        "needs_geo_logic": r["needs_geo_logic"],
+        "reasoning": r["reasoning"],
+        "laws": "; ".join([law_str(l) for l in r["laws"]]),
+        "confidence": r["confidence"],
+        "rule_hits": ";".join(r.get("rule_hits", [])),
+    }
+
+def rows_to_csv(rows: List[Dict[str, Any]]) -> str:
     buf = io.StringIO()
-    fieldnames = ["feature_text", "needs_geo_logic", "reasoning", "laws", "confidence", "rule_hits"]
-    writer = csv.DictWriter(buf, fieldnames=fieldnames)
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS)
     writer.writeheader()
     for r in rows:
-        writer.writerow({
-            "feature_text": r["feature_text"],
-            "needs_geo_logic": r["needs_geo_logic"],
-            "reasoning": r["reasoning"],
-            "laws": "; ".join([law_str(l) for l in r["laws"]]),
-            "confidence": r["confidence"],
-            "rule_hits": ";".join(r.get("rule_hits", [])),
-        })
+        writer.writerow(_csv_row(r))
+    return buf.getvalue()
+
+def csv_line(fieldnames: List[str], row: Dict[str, Any] | None = None) -> str:
+    """One CSV line: the header if row is None, else the row (missing fields left empty)."""
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction="ignore")
+    if row is None:
+        writer.writeheader()
+    else:
+        writer.writerow(row)
     return buf.getvalue()
 
+# Streamed batch output: row index first (resume with start=<last index + 1>), error last
+BATCH_STREAM_CSV_FIELDS = ["index"] + CSV_FIELDS + ["error"]
+
+def batch_stream_csv_row(index: int, r: Dict[str, Any]) -> Dict[str, Any]:
+    if r.get("error"):
+        return {"index": index, "feature_text": r.get("feature_text", ""), "error": r["error"]}
+    return {"index": index, **_csv_row(r)}
+
+
+# ---- Batch uploads (CSV / NDJSON) ----
+def _split_list(v: Any) -> List[str]:
+    if isinstance(v, list):
+        return [str(x).strip() for x in v if str(x).strip()]
+    return [x.strip() for x in re.split(r"[;,]", v or "") if x.strip()]
+
+def _upload_row(rec: Dict[str, Any]) -> Dict[str, Any]:
+    text = (rec.get("feature_text") or "").strip()
+    if not text:
+        # data/test_dataset.csv layout
+        text = f"{(rec.get('feature_name') or '').strip()}\n\n{(rec.get('feature_description') or '').strip()}".strip()
+    row: Dict[str, Any] = {"feature_text": text}
+    if rec.get("rule_hits"):
+        row["rule_hits"] = _split_list(rec["rule_hits"])
+    if rec.get("regions"):
+        row["regions"] = _split_list(rec["regions"])
+    return row
+
+def iter_upload_rows(fileobj: BinaryIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Rows of an uploaded batch, read lazily from a binary file object.
+    fmt "csv": header with feature_text (or feature_name + feature_description), optional
+    rule_hits / regions columns (";"-separated). fmt "ndjson": one object per line, same keys
+    (lists allowed). Blank NDJSON lines are skipped; a bad line yields {"error": ...}.
+    """
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "ndjson":
+            for line in text:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError as e:
+                    yield {"feature_text": "", "error": f"invalid JSON: {e}"}
+                    continue
+                yield _upload_row(rec) if isinstance(rec, dict) else {"feature_text": "", "error": "expected a JSON object"}
+        else:
+            for rec in csv.DictReader(text):
+                yield _upload_row(rec)
+    finally:
+        text.detach()
+
 
 # ---- Lightweight JSONL logging helpers ----
 def _resolve_rel_path(rel: str) -> Path:
@@ -76,3 +143,13 @@ def write_json(rel_path: str, obj: Any) -> str:
     with p.open("w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
     return str(p)
+
+
+# ---- Streaming event framing (SSE / NDJSON) ----
+STREAM_MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+def stream_event(fmt: str, event: str, data: Any) -> str:
+    """One event as an SSE frame (`event:` + `data:` lines) or an NDJSON line {"event", "data"}."""
+    if fmt == "ndjson":
+        return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
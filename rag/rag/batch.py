@@ -0,0 +1,265 @@
+# rag/batch.py
+from __future__ import annotations
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, Future, wait
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from rag.chains import get_classify_chain
+from rag.heuristics import infer_regions
+from rag.retrieval import retrieve_many
+from rag.utils import parse_json_safe
+
+# ---------- Provider rate limiting ----------
+
+class RateLimiter:
+    """Sliding 60s window over requests and (estimated) tokens, shared by all workers.
+    rpm/tpm <= 0 disables that limit.
+    """
+    def __init__(self, rpm: int = 0, tpm: int = 0, window_s: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._events: deque[tuple[float, int]] = deque()  # (ts, tokens)
+        self._tokens = 0
+
+    def _prune(self, now: float) -> None:
+        while self._events and now - self._events[0][0] >= self.window_s:
+            _, t = self._events.popleft()
+            self._tokens -= t
+
+    def acquire(self, tokens: int = 0) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                req_ok = self.rpm <= 0 or len(self._events) < self.rpm
+                # A single oversized request is let through once the window is empty
+                tok_ok = self.tpm <= 0 or not self._events or self._tokens + tokens <= self.tpm
+                if req_ok and tok_ok:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = self._events[0][0] + self.window_s - now
+            time.sleep(max(0.05, min(wait, 1.0)))
+
+@lru_cache(maxsize=1)
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter for Groq calls (GROQ_RPM / GROQ_TPM, 0 = unlimited)."""
+    return RateLimiter(
+        rpm=int(os.getenv("GROQ_RPM", "30")),
+        tpm=int(os.getenv("GROQ_TPM", "0")),
+    )
+
+def _is_rate_limit(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    msg = str(e).lower()
+    return "rate limit" in msg or "rate_limit" in msg or "429" in msg
+
+def _retry_after(e: Exception) -> float | None:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def call_with_backoff(
+    fn: Callable[[], Any],
+    retries: int | None = None,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    on_retry: Callable[[Exception], None] | None = None,
+) -> Any:
+    """Call fn, retrying rate-limit errors with exponential backoff + jitter (honours Retry-After).
+    on_retry(e) runs only when another attempt will actually be made.
+    """
+    retries = int(os.getenv("GROQ_MAX_RETRIES", "5")) if retries is None else retries
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not _is_rate_limit(e):
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            delay = _retry_after(e) or min(max_delay, base_delay * (2 ** attempt))
+            time.sleep(delay + random.uniform(0, delay / 4))
+            attempt += 1
+
+def _estimate_tokens(feature_text: str, docs) -> int:
+    # ~4 chars/token for inputs, plus a flat allowance for system prompt, few-shot examples and output
+    chars = len(feature_text) + sum(len(d.page_content) for d in docs)
+    return chars // 4 + 1500
+
+# ---------- Batch engine ----------
+
+def _row_regions(row: Dict[str, Any], regions: list[str] | None, infer: bool) -> list[str] | None:
+    # Region precedence: row["regions"] → regions override → infer_regions (if infer)
+    if row.get("regions"):
+        return list(row["regions"])
+    if regions:
+        return list(regions)
+    return infer_regions(row["feature_text"]) if infer else None
+
+def _retrieve_timed(texts: List[str], k: int, mmr: bool, regions_list: List[list[str] | None]) -> List[tuple]:
+    """retrieve_many, with each row's share of the chunk's wall time appended to its tuple."""
+    t0 = time.perf_counter()
+    results = retrieve_many(texts, k, mmr, regions_list)
+    per_row_ms = (time.perf_counter() - t0) * 1000 / max(1, len(texts))
+    return [(*r, per_row_ms) for r in results]
+
+def _classify_row(row: Dict[str, Any], regs: list[str] | None, retrieved, k: int, mmr: bool, limiter: RateLimiter) -> Dict[str, Any]:
+    """LLM stage for one row, given its (docs, rerank_info, filtered_used, retrieval_ms) from _retrieve_timed.
+    timings (ms): retrieval (amortized over the chunk, rerank excluded), rerank, rate_wait, llm, parse.
+    """
+    docs, rerank_info, filtered_used, retrieval_ms = retrieved
+    # Raw text out of the chain (still JSON mode) so the LLM call and the parse are timed apart
+    # Docs are passed in, so regions play no part in the chain (and stay out of its cache key)
+    chain = get_classify_chain(k=k, mmr=mmr, parse_output=False)
+    payload = {"feature_text": row["feature_text"], "rule_hits": row.get("rule_hits", []), "docs": docs}
+    timings = {"rate_wait_ms": 0.0, "retries": 0}
+
+    def _invoke():
+        t0 = time.perf_counter()
+        limiter.acquire(_estimate_tokens(row["feature_text"], docs))
+        t1 = time.perf_counter()
+        timings["rate_wait_ms"] += (t1 - t0) * 1000
+        text = chain.invoke(payload)
+        timings["llm_ms"] = (time.perf_counter() - t1) * 1000
+        return text
+
+    def _count_retry(e: Exception) -> None:
+        timings["retries"] += 1
+
+    text = call_with_backoff(_invoke, on_retry=_count_retry)
+    t0 = time.perf_counter()
+    out = parse_json_safe(text)
+    timings["parse_ms"] = (time.perf_counter() - t0) * 1000
+    rerank_ms = float(rerank_info.get("elapsed_ms", 0.0))
+    timings["rerank_ms"] = rerank_ms
+    timings["retrieval_ms"] = max(0.0, retrieval_ms - rerank_ms)
+    return {"out": out, "regions": regs, "filtered_used": filtered_used, "docs": docs, "rerank": rerank_info, "timings": timings}
+
+def classify_batch(
+    rows: List[Dict[str, Any]],
+    k: int = 5,
+    mmr: bool = False,
+    regions: list[str] | None = None,
+    infer: bool = True,
+    max_workers: int | None = None,
+    retrieval_batch: int | None = None,
+) -> List[Dict[str, Any]]:
+    """Classify many rows concurrently; output order matches input order.
+    Each row: {"feature_text": str, "rule_hits": list[str], "regions"?: list[str]}.
+    Region precedence: row["regions"] → regions override → infer_regions (if infer).
+    Retrieval runs in chunks of `retrieval_batch` rows on its own thread while up to
+    `max_workers` LLM calls run under the shared rate limiter, so the two stages overlap.
+    Returns per row: {"out", "regions", "filtered_used", "docs", "rerank", "timings"}.
+    Raises the first row error (in row order), like the sequential loop did.
+    """
+    if not rows:
+        return []
+    max_workers = max_workers or int(os.getenv("BATCH_WORKERS", "4"))
+    retrieval_batch = retrieval_batch or int(os.getenv("BATCH_RETRIEVAL_SIZE", "16"))
+    limiter = get_rate_limiter()
+
+    texts = [r["feature_text"] for r in rows]
+    row_regions = [_row_regions(r, regions, infer) for r in rows]
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-retrieve") as ret_pool, \
+         ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-llm") as llm_pool:
+        # Stage 1: retrieval + rerank, chunked so LLM calls can start on early rows
+        chunk_futs: List[Future] = []
+        for i in range(0, len(rows), retrieval_batch):
+            chunk_futs.append(ret_pool.submit(
+                _retrieve_timed, texts[i:i+retrieval_batch], k, mmr, row_regions[i:i+retrieval_batch]
+            ))
+
+        # Stage 2: LLM per row
+        def _classify_one(i: int) -> Dict[str, Any]:
+            retrieved = chunk_futs[i // retrieval_batch].result()[i % retrieval_batch]
+            return _classify_row(rows[i], row_regions[i], retrieved, k, mmr, limiter)
+
+        futs = [llm_pool.submit(_classify_one, i) for i in range(len(rows))]
+        return [f.result() for f in futs]
+
+def classify_stream(
+    rows: Iterable[Tuple[int, Dict[str, Any]]],
+    k: int = 5,
+    mmr: bool = False,
+    regions: list[str] | None = None,
+    infer: bool = True,
+    max_workers: int | None = None,
+    retrieval_batch: int | None = None,
+    ordered: bool = True,
+) -> Iterator[Tuple[int, Dict[str, Any], Dict[str, Any]]]:
+    """Streaming counterpart of classify_batch for inputs of any size.
+    Consumes (index, row) pairs lazily and yields (index, row, result) as rows finish: in input
+    order if `ordered`, else in completion order. At most max_workers * 2 + retrieval_batch
+    rows are in flight (read but not yet yielded), so memory does not grow with the input.
+    A failed row (or an input row that is empty or carries an "error") yields {"error": str}
+    instead of stopping the stream.
+    """
+    max_workers = max_workers or int(os.getenv("BATCH_WORKERS", "4"))
+    retrieval_batch = retrieval_batch or int(os.getenv("BATCH_RETRIEVAL_SIZE", "16"))
+    window = max_workers * 2 + retrieval_batch
+    limiter = get_rate_limiter()
+    pending: deque[Tuple[int, Dict[str, Any], Future]] = deque()
+
+    def _result(i: int, row: Dict[str, Any], fut: Future) -> Tuple[int, Dict[str, Any], Dict[str, Any]]:
+        try:
+            return i, row, fut.result()
+        except Exception as e:
+            return i, row, {"error": str(e)}
+
+    def _drain(limit: int) -> Iterator[Tuple[int, Dict[str, Any], Dict[str, Any]]]:
+        # Yield finished rows until at most `limit` remain in flight
+        while len(pending) > limit:
+            if ordered:
+                yield _result(*pending.popleft())
+                continue
+            done, _ = wait([f for _, _, f in pending], return_when=FIRST_COMPLETED)
+            for item in [p for p in pending if p[2] in done]:
+                pending.remove(item)
+                yield _result(*item)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-retrieve") as ret_pool, \
+         ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-llm") as llm_pool:
+        try:
+            it = iter(rows)
+            while True:
+                chunk = list(islice(it, retrieval_batch))
+                if not chunk:
+                    break
+                valid = [r for _, r in chunk if r.get("feature_text") and not r.get("error")]
+                regs = [_row_regions(r, regions, infer) for r in valid]
+                ret_fut = ret_pool.submit(_retrieve_timed, [r["feature_text"] for r in valid], k, mmr, regs) if valid else None
+
+                def _classify_one(j: int, row: Dict[str, Any], ret_fut: Future = ret_fut, regs=regs) -> Dict[str, Any]:
+                    return _classify_row(row, regs[j], ret_fut.result()[j], k, mmr, limiter)
+
+                j = 0
+                for i, row in chunk:
+                    if row.get("feature_text") and not row.get("error"):
+                        pending.append((i, row, llm_pool.submit(_classify_one, j, row)))
+                        j += 1
+                    else:
+                        # Unparseable/empty input rows pass straight through, in order
+                        fut: Future = Future()
+                        fut.set_result({"error": row.get("error") or "empty feature_text"})
+                        pending.append((i, row, fut))
+                yield from _drain(window - retrieval_batch)
+            yield from _drain(0)
+        finally:
+            # Client went away mid-stream: don't run LLM calls nobody will read
+            for _, _, f in pending:
+                f.cancel()
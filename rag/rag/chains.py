@@ -1,22 +1,82 @@
 from __future__ import annotations
 import os
+import time
+import threading
+from functools import lru_cache
 from typing import Dict, Any
+from uuid import UUID
 
 from dotenv import load_dotenv
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import ChatPromptTemplate
 
-from rag.utils import format_docs_for_context, parse_json_safe, get_few_shot_examples
+from rag.utils import format_docs_for_context, parse_json_safe, get_few_shot_examples, few_shot_version
 from rag.retrieval import get_hybrid_retriever, rerank_docs
 from rag.prompts import QA_SYSTEM, QA_USER, CLASSIFY_SYSTEM, CLASSIFY_USER
+from rag.executors import run_in
+from rag.metrics import add_tokens, observe, timed
 
 # --- LLM: Groq ---
 from langchain_groq import ChatGroq
 
 load_dotenv()
 
+class _LLMMetrics(BaseCallbackHandler):
+    """Times every chat completion ("llm" stage) and counts the tokens Groq reports."""
+    run_inline = True  # run in the caller's context so per-request metrics see it
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._starts: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._starts[run_id] = time.perf_counter()
+
+    def _finish(self, run_id: UUID) -> None:
+        with self._lock:
+            t0 = self._starts.pop(run_id, None)
+        if t0 is not None:
+            observe("llm", time.perf_counter() - t0)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+        if prompt_tokens is None:
+            # Streamed completions carry usage on the aggregated message instead
+            try:
+                meta = response.generations[0][0].message.usage_metadata or {}
+            except (AttributeError, IndexError):
+                meta = {}
+            prompt_tokens, completion_tokens = meta.get("input_tokens"), meta.get("output_tokens")
+        add_tokens("prompt", int(prompt_tokens or 0))
+        add_tokens("completion", int(completion_tokens or 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+_LLM_METRICS = _LLMMetrics()
+
+def _prompt_step(prompt: ChatPromptTemplate, extra: Dict[str, Any] | None = None) -> RunnableLambda:
+    """Context formatting + template rendering, timed as the "prompt" stage.
+    Input: the chain's fields with docs (list[Document]) in place of context."""
+    def _build(inputs: Dict[str, Any]) -> Any:
+        with timed("prompt"):
+            values = {**inputs, **(extra or {})}
+            values["context"] = format_docs_for_context(values.pop("docs"))
+            return prompt.invoke(values)
+
+    async def _abuild(inputs: Dict[str, Any]) -> Any:
+        return _build(inputs)  # cheap: stay on the event loop
+
+    return RunnableLambda(_build, afunc=_abuild)
+
 # Use GROQ_* vars; fall back to your previous OLLAMA_TEMPERATURE if present
+# One client per mode per process (ChatGroq holds its own HTTP pool)
+@lru_cache(maxsize=2)
 def _chat(json_mode: bool = False):
     kwargs = {
         "model": os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
@@ -26,11 +86,13 @@ def _chat(json_mode: bool = False):
     if json_mode:
         # Strongly nudge strict JSON on Groq (OpenAI-compatible param)
         kwargs["model_kwargs"] = {"response_format": {"type": "json_object"}}
-    return ChatGroq(**kwargs)
+    return ChatGroq(callbacks=[_LLM_METRICS], **kwargs)
 
 # ---------- QA CHAIN ----------
 def make_qa_chain(k: int = 5, mmr: bool = False, regions: list[str] | None = None):
-    """Input: a plain string question. Optionally filter retrieval by regions."""
+    """Input: a plain string question, or a dict with keys question (str) and docs (list[Document])
+    when the caller has already retrieved + reranked. Optionally filter retrieval by regions.
+    Output is the answer text, so astream() yields answer tokens."""
     retriever = get_hybrid_retriever(k=k, mmr=mmr, regions=regions)
     prompt = ChatPromptTemplate.from_messages([
         ("system", QA_SYSTEM),
@@ -39,28 +101,49 @@ def make_qa_chain(k: int = 5, mmr: bool = False, regions: list[str] | None = Non
     llm = _chat(json_mode=False)
     parser = StrOutputParser()
 
+    def _inputs(x: Any) -> Dict[str, Any]:
+        return x if isinstance(x, dict) else {"question": x}
+
     def _gather(inputs: Dict[str, Any]) -> Dict[str, Any]:
         q = inputs["question"]
-        docs = retriever.invoke(q)
-        try:
-            docs = rerank_docs(q, docs, top_k=k)
-        except Exception:
-            pass
-        return {"question": q, "context": format_docs_for_context(docs)}
+        docs = inputs.get("docs")
+        if docs is None:
+            docs = retriever.invoke(q)
+            try:
+                docs = rerank_docs(q, docs, top_k=k)
+            except Exception:
+                pass
+        return {"question": q, "docs": docs}
+
+    async def _agather(inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if inputs.get("docs") is not None:
+            return _gather(inputs)
+        # ainvoke path: retrieval + rerank on the dedicated executor, not the event loop
+        return await run_in("retrieval", _gather, inputs)
 
     chain = (
-        {"question": RunnablePassthrough()}
-        | RunnableLambda(_gather)
-        | prompt
+        RunnableLambda(_inputs)
+        | RunnableLambda(_gather, afunc=_agather)
+        | _prompt_step(prompt)
         | llm
         | parser
     )
     return chain
 
 # ---------- CLASSIFY CHAIN ----------
-def make_classify_chain(k: int = 5, mmr: bool = False, regions: list[str] | None = None, use_few_shot: bool = True, max_positive: int = 3, max_negative: int = 2):
-    """Input: dict with keys: feature_text (str), rule_hits (list[str]). Optionally filter retrieval by regions."""
-    retriever = get_hybrid_retriever(k=k, mmr=mmr, regions=regions)
+def make_classify_chain(k: int = 5, mmr: bool = False, regions: list[str] | None = None, use_few_shot: bool = True, max_positive: int = 3, max_negative: int = 2, parse_output: bool = True, json_mode: bool = True):
+    """Input: dict with keys: feature_text (str), rule_hits (list[str]) and optionally docs (list[Document]).
+    If docs are given (already retrieved + reranked by the caller) they are used as-is for the context;
+    otherwise retrieval runs here, optionally filtered by regions.
+    parse_output=False ends the chain at the raw model text (the caller runs parse_json_safe on it);
+    with json_mode=False as well, astream() yields tokens."""
+    # Built lazily: callers that pass docs never need a vector store
+    _retriever: list = []
+
+    def _get_retriever():
+        if not _retriever:
+            _retriever.append(get_hybrid_retriever(k=k, mmr=mmr, regions=regions))
+        return _retriever[0]
     
     # Get few-shot examples text with both positive and negative examples
     examples_text = get_few_shot_examples(
@@ -73,26 +156,60 @@ def make_classify_chain(k: int = 5, mmr: bool = False, regions: list[str] | None
         ("system", CLASSIFY_SYSTEM),
         ("user", CLASSIFY_USER),
     ])
-    llm = _chat(json_mode=True)  # JSON mode ON for strict output
+    # JSON mode ON for strict output; streamed completions can't use it, so the streaming
+    # variant relies on the prompt's JSON instructions and parse_json_safe's block extraction
+    llm = _chat(json_mode=json_mode)
     parser = StrOutputParser()
 
     def _prep(inputs: Dict[str, Any]) -> Dict[str, Any]:
         ft = inputs["feature_text"]
         rh = inputs.get("rule_hits", [])
-        docs = retriever.invoke(ft)
-        try:
-            docs = rerank_docs(ft, docs, top_k=k)
-        except Exception:
-            pass
-        ctx = format_docs_for_context(docs)
-        return {"feature_text": ft, "rule_hits": rh, "context": ctx, "examples": examples_text}
+        docs = inputs.get("docs")
+        if docs is None:
+            docs = _get_retriever().invoke(ft)
+            try:
+                docs = rerank_docs(ft, docs, top_k=k)
+            except Exception:
+                pass
+        return {"feature_text": ft, "rule_hits": rh, "docs": docs}
+
+    async def _aprep(inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if inputs.get("docs") is not None:
+            return _prep(inputs)  # nothing heavy left to do
+        return await run_in("retrieval", _prep, inputs)
 
     chain = (
         RunnableLambda(lambda x: x)  # passthrough
-        | RunnableLambda(_prep)
-        | prompt
+        | RunnableLambda(_prep, afunc=_aprep)
+        | _prompt_step(prompt, {"examples": examples_text})
         | llm
         | parser
-        | parse_json_safe
     )
-    return chain
+    return chain | parse_json_safe if parse_output else chain
+
+
+# ---------- Chain cache ----------
+CHAIN_CACHE_SIZE = int(os.getenv("CHAIN_CACHE_SIZE", "64"))
+
+def _regions_key(regions: list[str] | None) -> tuple:
+    return tuple(sorted(set(regions))) if regions else ()
+
+@lru_cache(maxsize=CHAIN_CACHE_SIZE)
+def _cached_qa_chain(k: int, mmr: bool, regions: tuple):
+    return make_qa_chain(k=k, mmr=mmr, regions=list(regions) or None)
+
+@lru_cache(maxsize=CHAIN_CACHE_SIZE)
+def _cached_classify_chain(k: int, mmr: bool, regions: tuple, use_few_shot: bool, fs_version: int, parse_output: bool = True, json_mode: bool = True):
+    # fs_version is only part of the key: a new few-shot index version yields a new chain
+    return make_classify_chain(k=k, mmr=mmr, regions=list(regions) or None, use_few_shot=use_few_shot, parse_output=parse_output, json_mode=json_mode)
+
+def get_qa_chain(k: int = 5, mmr: bool = False, regions: list[str] | None = None):
+    """Cached make_qa_chain keyed by (k, mmr, regions)."""
+    return _cached_qa_chain(int(k), bool(mmr), _regions_key(regions))
+
+def get_classify_chain(k: int = 5, mmr: bool = False, regions: list[str] | None = None, use_few_shot: bool = True, parse_output: bool = True, json_mode: bool = True):
+    """Cached make_classify_chain keyed by (k, mmr, regions, few-shot index version, parse_output, json_mode).
+    regions only steer the chain's own retrieval: callers that pass "docs" at invoke time leave them unset.
+    """
+    fs_version = few_shot_version() if use_few_shot else 0
+    return _cached_classify_chain(int(k), bool(mmr), _regions_key(regions), bool(use_few_shot), fs_version, bool(parse_output), bool(json_mode))
@@ -1,7 +1,10 @@
 from __future__ import annotations
-import os, re, uuid, csv, json
+import os, re, uuid, csv, json, hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
 
 from langchain_core.documents import Document
 from langchain_text_splitters import (
@@ -54,6 +57,54 @@ def _guess_meta_from_filename(name: str) -> Dict[str, str]:
         "source": "",
     }
 
+# --------- Deterministic chunk IDs ---------
+
+# Fixed namespace so IDs are stable across machines and runs
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c3a52-9a0e-4d4e-8a43-2b7f0c6d9e11")
+
+# IDs hash the source path relative to the project root (the folder holding data/), so the
+# upload path (absolute) and build_chunks (relative to the cwd) agree, on any machine
+KB_ROOT = Path(__file__).resolve().parents[1]
+
+@lru_cache(maxsize=4096)
+def _norm_source_path(source_path: str) -> str:
+    if not source_path:
+        return ""
+    p = Path(source_path.replace("\\", "/")).resolve()
+    try:
+        return p.relative_to(KB_ROOT).as_posix()
+    except ValueError:
+        return p.as_posix()  # outside the project: best effort, absolute
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or "").strip().encode("utf-8")).hexdigest()
+
+def _id_from_hash(src: str, h: str, dup: int) -> str:
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{src}\0{h}\0{dup}"))
+
+def chunk_id(source_path: str, text: str, dup: int = 0) -> str:
+    """UUIDv5 from (source path, content hash, duplicate ordinal) — valid as a Qdrant point ID.
+    Unchanged chunks keep their ID when other parts of the file change.
+    """
+    return _id_from_hash(_norm_source_path(source_path), content_hash(text), dup)
+
+def assign_chunk_ids(docs: List[Document]) -> List[str]:
+    """Set metadata['chunk_id'] (and 'content_hash') on each doc; returns the IDs in order.
+    Identical chunks within one file get increasing duplicate ordinals.
+    """
+    seen: Dict[Tuple[str, str], int] = {}
+    ids: List[str] = []
+    for d in docs:
+        src = _norm_source_path(d.metadata.get("source_path", ""))
+        h = content_hash(d.page_content)
+        dup = seen.get((src, h), 0)
+        seen[(src, h)] = dup + 1
+        cid = _id_from_hash(src, h, dup)
+        d.metadata["chunk_id"] = cid
+        d.metadata["content_hash"] = h
+        ids.append(cid)
+    return ids
+
 # --------- Core splitters ---------
 
 def _is_reference_header(meta: dict) -> bool:
@@ -120,75 +171,128 @@ def header_first_then_recursive(
 
 # --------- Pipeline ---------
 
-def chunk_directory(
-    raw_dir: str,
+_CHUNK_SUFFIXES = (".txt", ".md", ".markdown")
+
+def _iter_source_files(raw_dir: str) -> Iterator[Path]:
+    raw_path = Path(raw_dir)
+    assert raw_path.exists(), f"raw_dir not found: {raw_dir}"
+    for p in sorted(raw_path.glob("**/*")):
+        if p.is_file() and p.suffix.lower() in _CHUNK_SUFFIXES:
+            yield p
+
+def _chunk_file(
+    p: Path,
     headers: List[Tuple[str, str]],
     max_header_chunk_chars: int,
     recursive_chunk_chars: int,
     recursive_overlap_chars: int,
-    manifest_csv: Optional[str] = None,
-    skip_reference_sections: bool = True,
+    manifest: Dict[str, Dict[str, str]],
+    skip_reference_sections: bool,
 ) -> List[Document]:
-    raw_path = Path(raw_dir)
-    assert raw_path.exists(), f"raw_dir not found: {raw_dir}"
+    """Chunk one file (runs in a worker process). IDs are assigned here since dup ordinals are per file."""
+    text = _normalize_text(_read_text_file(p))
+    if not text:
+        return []
 
-    manifest = _load_manifest(manifest_csv)
+    docs = header_first_then_recursive(
+        text=text,
+        source_path=str(p),
+        headers=headers,
+        max_header_chunk_chars=max_header_chunk_chars,
+        recursive_chunk_chars=recursive_chunk_chars,
+        recursive_overlap_chars=recursive_overlap_chars,
+        skip_reference_sections=skip_reference_sections,
+    )
 
-    all_docs: List[Document] = []
-    for p in sorted(raw_path.glob("**/*")):
-        if not p.is_file():
-            continue
-        if p.suffix.lower() not in (".txt", ".md", ".markdown"):
-            continue
-
-        text = _normalize_text(_read_text_file(p))
-        if not text:
-            continue
+    base = p.name
+    inferred = manifest.get(base, _guess_meta_from_filename(base))
+    for d in docs:
+        d.metadata.setdefault("law_name", inferred.get("law_name", ""))
+        d.metadata.setdefault("region", inferred.get("region", ""))
+        d.metadata.setdefault("article_or_section", inferred.get("article_or_section", ""))
+        d.metadata.setdefault("source", inferred.get("source", ""))
+    assign_chunk_ids(docs)
+    return docs
 
-        docs = header_first_then_recursive(
-            text=text,
-            source_path=str(p),
-            headers=headers,
-            max_header_chunk_chars=max_header_chunk_chars,
-            recursive_chunk_chars=recursive_chunk_chars,
-            recursive_overlap_chars=recursive_overlap_chars,
-            skip_reference_sections=skip_reference_sections,
-        )
+def iter_chunk_directory(
+    raw_dir: str,
+    headers: List[Tuple[str, str]],
+    max_header_chunk_chars: int,
+    recursive_chunk_chars: int,
+    recursive_overlap_chars: int,
+    manifest_csv: Optional[str] = None,
+    skip_reference_sections: bool = True,
+    workers: Optional[int] = None,
+) -> Iterator[Document]:
+    """Stream chunks file by file, in sorted-path order, chunking files across a process pool.
+    At most 2×workers files are in flight, so memory stays bounded regardless of corpus size.
+    workers<=1 chunks in-process.
+    """
+    manifest = _load_manifest(manifest_csv)
+    workers = workers if workers is not None else int(os.getenv("CHUNK_WORKERS", str(os.cpu_count() or 1)))
+    args = (headers, max_header_chunk_chars, recursive_chunk_chars, recursive_overlap_chars, manifest, skip_reference_sections)
+    files = _iter_source_files(raw_dir)
 
-        base = p.name
-        inferred = manifest.get(base, _guess_meta_from_filename(base))
-        for d in docs:
-            d.metadata.setdefault("law_name", inferred.get("law_name", ""))
-            d.metadata.setdefault("region", inferred.get("region", ""))
-            d.metadata.setdefault("article_or_section", inferred.get("article_or_section", ""))
-            d.metadata.setdefault("source", inferred.get("source", ""))
+    if workers <= 1:
+        for p in files:
+            yield from _chunk_file(p, *args)
+        return
 
-        all_docs.extend(docs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        inflight: deque = deque()
+        for p in files:
+            inflight.append(pool.submit(_chunk_file, p, *args))
+            if len(inflight) >= 2 * workers:
+                yield from inflight.popleft().result()
+        while inflight:
+            yield from inflight.popleft().result()
 
-    return all_docs
+def chunk_directory(
+    raw_dir: str,
+    headers: List[Tuple[str, str]],
+    max_header_chunk_chars: int,
+    recursive_chunk_chars: int,
+    recursive_overlap_chars: int,
+    manifest_csv: Optional[str] = None,
+    skip_reference_sections: bool = True,
+    workers: Optional[int] = None,
+) -> List[Document]:
+    return list(iter_chunk_directory(
+        raw_dir,
+        headers=headers,
+        max_header_chunk_chars=max_header_chunk_chars,
+        recursive_chunk_chars=recursive_chunk_chars,
+        recursive_overlap_chars=recursive_overlap_chars,
+        manifest_csv=manifest_csv,
+        skip_reference_sections=skip_reference_sections,
+        workers=workers,
+    ))
 
-def export_jsonl_and_meta(docs: List[Document], out_jsonl: str, out_meta_csv: str) -> None:
+def export_jsonl_and_meta(docs: Iterable[Document], out_jsonl: str, out_meta_csv: str) -> int:
+    """Stream docs to the JSONL and meta CSV in one pass (same ID in both). Returns the chunk count.
+    Accepts a generator (e.g. iter_chunk_directory) so the corpus never sits in memory.
+    """
     Path(out_jsonl).parent.mkdir(parents=True, exist_ok=True)
     Path(out_meta_csv).parent.mkdir(parents=True, exist_ok=True)
 
-    with open(out_jsonl, "w", encoding="utf-8") as jf:
+    n = 0
+    with open(out_jsonl, "w", encoding="utf-8") as jf, open(out_meta_csv, "w", newline="", encoding="utf-8") as cf:
+        writer = csv.writer(cf)
+        writer.writerow(["id","chars","source_path","h1","h2","h3","law_name","region","article_or_section","source"])
         for d in docs:
+            m = d.metadata
+            rid = m.get("chunk_id") or assign_chunk_ids([d])[0]
             rec = {
-                "id": str(uuid.uuid4()),
+                "id": rid,
                 "text": d.page_content,
-                "metadata": d.metadata,
+                "metadata": m,
             }
             jf.write(json.dumps(rec, ensure_ascii=False) + "\n")
-
-    with open(out_meta_csv, "w", newline="", encoding="utf-8") as cf:
-        writer = csv.writer(cf)
-        writer.writerow(["id","chars","source_path","h1","h2","h3","law_name","region","article_or_section","source"])
-        for d in docs:
-            rid = str(uuid.uuid4())
-            m = d.metadata
             writer.writerow([
                 rid, len(d.page_content),
                 m.get("source_path",""), m.get("h1",""), m.get("h2",""), m.get("h3",""),
                 m.get("law_name",""), m.get("region",""),
                 m.get("article_or_section",""), m.get("source",""),
             ])
+            n += 1
+    return n
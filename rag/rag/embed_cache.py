@@ -0,0 +1,154 @@
+# rag/embed_cache.py
+from __future__ import annotations
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Entry value: (a, b) numpy arrays. Dense → (vec float32, None); sparse → (indices int32, values float32).
+Entry = Tuple[np.ndarray, "np.ndarray | None"]
+
+
+def _nbytes(entry: Entry) -> int:
+    a, b = entry
+    return int(a.nbytes) + (int(b.nbytes) if b is not None else 0)
+
+
+class EmbeddingCache:
+    """Content-hashed LRU cache for embedding vectors.
+    - Bounded by entries and bytes (in memory), least-recently-used evicted first.
+    - Optional SQLite file (WAL) so entries survive restarts; memory misses fall back to disk.
+    - Thread-safe; hit/miss counters via stats().
+    """
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024, path: str | None = None, disk_max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_max_entries = disk_max_entries
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db: sqlite3.Connection | None = None
+        if path:
+            self._open_db(path)
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    # ---- disk ----
+    def _open_db(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, a BLOB NOT NULL, a_dtype TEXT NOT NULL, b BLOB, b_dtype TEXT)"
+        )
+        # Keep the file bounded: drop the oldest rows beyond the cap
+        db.execute(
+            "DELETE FROM embeddings WHERE rowid IN ("
+            " SELECT rowid FROM embeddings ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+        self._db = db
+
+    def _disk_get(self, key: str) -> Entry | None:
+        row = self._db.execute("SELECT a, a_dtype, b, b_dtype FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        a = np.frombuffer(row[0], dtype=row[1]).copy()
+        b = np.frombuffer(row[2], dtype=row[3]).copy() if row[2] is not None else None
+        return a, b
+
+    def _disk_put(self, key: str, entry: Entry) -> None:
+        a, b = entry
+        self._db.execute(
+            "INSERT OR REPLACE INTO embeddings (key, a, a_dtype, b, b_dtype) VALUES (?, ?, ?, ?, ?)",
+            (key, a.tobytes(), a.dtype.str, b.tobytes() if b is not None else None, b.dtype.str if b is not None else None),
+        )
+
+    # ---- memory ----
+    def _mem_put(self, key: str, entry: Entry) -> None:
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._bytes -= _nbytes(old)
+        self._mem[key] = entry
+        self._bytes += _nbytes(entry)
+        while self._mem and (len(self._mem) > self.max_entries or self._bytes > self.max_bytes):
+            _, ev = self._mem.popitem(last=False)
+            self._bytes -= _nbytes(ev)
+
+    def get(self, key: str) -> Entry | None:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return entry
+            if self._db is not None:
+                entry = self._disk_get(key)
+                if entry is not None:
+                    self._mem_put(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key: str, entry: Entry) -> None:
+        with self._lock:
+            self._mem_put(key, entry)
+            if self._db is not None:
+                try:
+                    self._disk_put(key, entry)
+                except sqlite3.Error:
+                    pass  # disk is best-effort
+
+    def get_many(self, keys: List[str]) -> List[Entry | None]:
+        return [self.get(k) for k in keys]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "persistent": self._db is not None,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache | None:
+    """Process-wide cache, configured by env:
+      - EMBED_CACHE=true|false (default true)
+      - EMBED_CACHE_MAX_ENTRIES (default 10000), EMBED_CACHE_MAX_MB (default 256)
+      - EMBED_CACHE_PATH=data/embed_cache.sqlite (optional; empty = memory only)
+    """
+    enabled = str(os.getenv("EMBED_CACHE", "true")).lower() in {"1", "true", "yes"}
+    if not enabled:
+        return None
+    return EmbeddingCache(
+        max_entries=int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "10000")),
+        max_bytes=int(float(os.getenv("EMBED_CACHE_MAX_MB", "256")) * 1024 * 1024),
+        path=os.getenv("EMBED_CACHE_PATH") or None,
+    )
@@ -1,13 +1,28 @@
 # rag/embeddings.py
 from __future__ import annotations
-from typing import List
+from typing import List, Tuple
+import os
+import logging
 import threading
+from collections import OrderedDict
 import numpy as np
 import torch
 
 from langchain_core.embeddings import Embeddings
+from langchain_qdrant.sparse_embeddings import SparseEmbeddings, SparseVector
 from FlagEmbedding import BGEM3FlagModel
 
+try:
+    from rag.embed_cache import get_embedding_cache
+    from rag.metrics import timed
+    from rag.onnx_backend import ONNX_QUANTIZE, backend_for, load_onnx_sentence_model
+except ImportError:
+    from .embed_cache import get_embedding_cache
+    from .metrics import timed
+    from .onnx_backend import ONNX_QUANTIZE, backend_for, load_onnx_sentence_model
+
+logger = logging.getLogger(__name__)
+
 # Thread-safe singleton loader for BGEM3
 __BGE_LOCK = threading.Lock()
 __BGE_MODEL = None
@@ -29,43 +44,209 @@ def _load_bge(model_name: str = "BAAI/bge-m3", use_fp16: bool | None = None):
             )
     return __BGE_MODEL
 
-def _l2_normalize(vecs: List[List[float]]) -> List[List[float]]:
-    arr = np.asarray(vecs, dtype=np.float32)
-    norms = np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12
-    arr = arr / norms
-    return arr.tolist()
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_QUERY_MAX_LENGTH = int(os.getenv("EMBED_QUERY_MAX_LENGTH", "512"))
+EMBED_DOC_MAX_LENGTH = int(os.getenv("EMBED_DOC_MAX_LENGTH", "512"))  # FlagEmbedding's passage default
+# Sparse side of hybrid search: "bm25" (FastEmbed, separate model) or "bge_m3"
+# (learned lexical weights from the same BGE-M3 forward pass as the dense vector)
+SPARSE_MODE = os.getenv("SPARSE_MODE", "bm25").strip().lower()
+
+SparsePair = Tuple[np.ndarray, np.ndarray]  # (indices int32, values float32)
+
+def _lexical_to_pair(weights: dict) -> SparsePair:
+    idx = np.fromiter((int(t) for t in weights.keys()), dtype=np.int32, count=len(weights))
+    val = np.fromiter((float(w) for w in weights.values()), dtype=np.float32, count=len(weights))
+    return idx, val
+
+class _SparseStash:
+    """Holds BGE-M3 sparse outputs produced alongside dense ones until the sparse side asks.
+    Uses the shared embedding cache when enabled, else a small local LRU.
+    """
+    def __init__(self, max_entries: int = 1024):
+        self._lock = threading.Lock()
+        self._local: "OrderedDict[str, SparsePair]" = OrderedDict()
+        self._max = max_entries
+
+    def put(self, ns: str, text: str, pair: SparsePair) -> None:
+        cache = get_embedding_cache()
+        if cache is not None:
+            cache.put(cache.make_key(ns, text), pair)
+            return
+        with self._lock:
+            self._local[f"{ns}\0{text}"] = pair
+            while len(self._local) > self._max:
+                self._local.popitem(last=False)
+
+    def get(self, ns: str, text: str) -> SparsePair | None:
+        cache = get_embedding_cache()
+        if cache is not None:
+            return cache.get(cache.make_key(ns, text))
+        with self._lock:
+            return self._local.get(f"{ns}\0{text}")
+
+def _l2_normalize(vecs) -> np.ndarray:
+    """Row-wise L2 normalization, float32 in/out (no list round trips)."""
+    arr = np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+    arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12
+    return arr
+
+def _with_cache(texts: List[str], namespace: str, compute) -> np.ndarray:
+    """Look texts up in the embedding cache; run compute() only on the misses (one call)."""
+    cache = get_embedding_cache()
+    if cache is None:
+        return compute(texts)
+    keys = [cache.make_key(namespace, t) for t in texts]
+    hits = cache.get_many(keys)
+    miss_idx = [i for i, h in enumerate(hits) if h is None]
+    fresh = compute([texts[i] for i in miss_idx]) if miss_idx else None
+    out = np.empty((len(texts), fresh.shape[1] if fresh is not None else hits[0][0].shape[0]), dtype=np.float32)
+    for i, h in enumerate(hits):
+        if h is not None:
+            out[i] = h[0]
+    for j, i in enumerate(miss_idx):
+        out[i] = fresh[j]
+        cache.put(keys[i], (out[i].copy(), None))
+    return out
 
 class BGEM3DenseEmbeddings(Embeddings):
     """
-    Dense embeddings using BGE-M3 via FlagEmbedding.
+    Dense embeddings using BGE-M3 via FlagEmbedding (backend="torch") or an
+    ONNX Runtime export of the dense head, optionally int8-quantized (backend="onnx", CPU).
     Output dim = 1024.
     """
-    def __init__(self, model_name: str = "BAAI/bge-m3", use_fp16: bool | None = None, do_normalize: bool = True):
+    def __init__(self, model_name: str = "BAAI/bge-m3", use_fp16: bool | None = None, do_normalize: bool = True,
+                 with_sparse: bool = False, backend: str | None = None):
         self.model_name = model_name
         self.use_fp16 = _auto_use_fp16() if use_fp16 is None else use_fp16
         self.do_normalize = do_normalize
-        self.model = _load_bge(model_name, self.use_fp16)
+        # with_sparse: every encode() also returns lexical weights, stashed for BGEM3SparseEmbeddings
+        self.with_sparse = with_sparse
+        self.sparse_stash = _SparseStash()
+        self.backend = backend or backend_for("embed")
+        self.model = None
+        self.onnx_model = None
+        self._onnx_lock = threading.Lock()
+        if self.backend == "onnx" and with_sparse:
+            raise ValueError("SPARSE_MODE=bge_m3 needs the torch backend (the ONNX export has no lexical head)")
+        if self.backend == "onnx":
+            try:
+                self.onnx_model = load_onnx_sentence_model(model_name)
+            except Exception as e:
+                # Same fallback as the reranker: a missing optimum/onnxruntime must not take down retrieval
+                logger.warning("ONNX embedding backend unavailable (%s); falling back to torch", e)
+                self.backend = "torch"
+        if self.backend == "torch":
+            self.model = _load_bge(model_name, self.use_fp16)
+
+    def _encode_onnx(self, texts: List[str], batch_size: int | None, max_length: int) -> np.ndarray:
+        # max_seq_length is model state; serialize so concurrent callers don't see each other's value
+        with self._onnx_lock:
+            self.onnx_model.max_seq_length = max_length
+            return self.onnx_model.encode(
+                texts,
+                batch_size=batch_size or EMBED_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=False,
+                show_progress_bar=False,
+            )
+
+    def _finish(self, vecs) -> np.ndarray:
+        return _l2_normalize(vecs) if self.do_normalize else np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+
+    def _stash_sparse(self, kind: str, texts: List[str], enc) -> None:
+        if self.with_sparse and enc.get("lexical_weights") is not None:
+            for t, w in zip(texts, enc["lexical_weights"]):
+                self.sparse_stash.put(self._ns(f"sparse-{kind}"), t, _lexical_to_pair(w))
+
+    def _ns(self, kind: str) -> str:
+        ns = f"{self.model_name}|{kind}|norm={int(self.do_normalize)}"
+        # ONNX/int8 vectors differ slightly from torch ones; keep them apart in the shared cache
+        return f"{ns}|onnx-{ONNX_QUANTIZE}" if self.backend == "onnx" else ns
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return _with_cache(texts, self._ns("doc"), self._encode_documents).tolist()
+
+    def _encode_documents(self, texts: List[str]) -> np.ndarray:
+        if self.onnx_model is not None:
+            return self._finish(self._encode_onnx(texts, None, EMBED_DOC_MAX_LENGTH))
         # NOTE: Do NOT pass normalize_embeddings to encode(); normalize ourselves.
         enc = self.model.encode(
             texts,
+            max_length=EMBED_DOC_MAX_LENGTH,
             return_dense=True,
-            return_sparse=False,
+            return_sparse=self.with_sparse,
             return_colbert_vecs=False,
         )
-        vecs = enc["dense_vecs"]  # List[List[float]]
-        return _l2_normalize(vecs) if self.do_normalize else vecs
+        self._stash_sparse("doc", texts, enc)
+        vecs = enc["dense_vecs"]  # np.ndarray (N, 1024)
+        return self._finish(vecs)
+
+    def embed_queries(self, texts: List[str], batch_size: int | None = None, max_length: int | None = None) -> np.ndarray:
+        """Batched query path: one encode() call for all texts.
+        Returns a float32 array of shape (len(texts), 1024).
+        """
+        if not texts:
+            return np.zeros((0, 1024), dtype=np.float32)
+        max_length = max_length or EMBED_QUERY_MAX_LENGTH
+
+        def _encode(batch: List[str]) -> np.ndarray:
+            if self.onnx_model is not None:
+                return self._finish(self._encode_onnx(batch, batch_size, max_length))
+            enc = self.model.encode(
+                batch,
+                batch_size=batch_size or EMBED_BATCH_SIZE,
+                max_length=max_length,
+                return_dense=True,
+                return_sparse=self.with_sparse,
+                return_colbert_vecs=False,
+            )
+            self._stash_sparse("query", batch, enc)
+            return self._finish(enc["dense_vecs"])
+
+        with timed("embed"):
+            return _with_cache(texts, self._ns(f"query:{max_length}"), _encode)
 
     def embed_query(self, text: str) -> List[float]:
-        enc = self.model.encode(
-            [text],
-            return_dense=True,
-            return_sparse=False,
-            return_colbert_vecs=False,
-        )
-        vec = enc["dense_vecs"][0]
-        if self.do_normalize:
-            n = float(np.linalg.norm(vec) + 1e-12)
-            vec = [v / n for v in vec]
-        return vec
+        return self.embed_queries([text])[0].tolist()
+
+
+class BGEM3SparseEmbeddings(SparseEmbeddings):
+    """Learned sparse (lexical) vectors from BGE-M3, sharing the dense model's forward pass.
+    When the dense side already encoded a text (the usual hybrid order), this is a stash lookup;
+    otherwise one encode() fills both and the dense vector is cached for later.
+    """
+    def __init__(self, dense: BGEM3DenseEmbeddings):
+        if not dense.with_sparse:
+            raise ValueError("BGEM3SparseEmbeddings needs a BGEM3DenseEmbeddings(with_sparse=True)")
+        self.dense = dense
+
+    def _get(self, kind: str, texts: List[str], fill) -> List[SparseVector]:
+        ns = self.dense._ns(f"sparse-{kind}")
+        pairs = [self.dense.sparse_stash.get(ns, t) for t in texts]
+        missing = [t for t, p in zip(texts, pairs) if p is None]
+        if missing:
+            fill(missing)
+            pairs = [p if p is not None else self.dense.sparse_stash.get(ns, t) for t, p in zip(texts, pairs)]
+        return [
+            SparseVector(indices=p[0].tolist(), values=p[1].tolist()) if p is not None else SparseVector(indices=[], values=[])
+            for p in pairs
+        ]
+
+    def embed_documents(self, texts: List[str]) -> List[SparseVector]:
+        return self._get("doc", texts, self.dense._encode_documents)
+
+    def embed_query(self, text: str) -> SparseVector:
+        # Bypass the dense cache so the encode really runs and stashes the sparse side
+        def _fill(batch: List[str]) -> None:
+            enc = self.dense.model.encode(
+                batch,
+                max_length=EMBED_QUERY_MAX_LENGTH,
+                return_dense=False,
+                return_sparse=True,
+                return_colbert_vecs=False,
+            )
+            self.dense._stash_sparse("query", batch, enc)
+        with timed("sparse"):
+            return self._get("query", [text], _fill)[0]
@@ -0,0 +1,43 @@
+# rag/executors.py
+from __future__ import annotations
+import os
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# Dedicated pools so CPU-heavy work cannot starve each other or the event loop:
+#   - "retrieval": query embedding, Qdrant search, cross-encoder rerank
+#   - "ingest":    PDF parsing, chunking and indexing of uploaded laws
+# Torch/ONNX release the GIL in their kernels, so threads give real parallelism here.
+_POOL_SIZES = {
+    "retrieval": lambda: int(os.getenv("RETRIEVAL_WORKERS", "4")),
+    "ingest": lambda: int(os.getenv("INGEST_WORKERS", "2")),
+}
+_POOLS: Dict[str, ThreadPoolExecutor] = {}
+_LOCK = threading.Lock()
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    pool = _POOLS.get(name)
+    if pool is None:
+        with _LOCK:
+            pool = _POOLS.get(name)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=_POOL_SIZES[name](), thread_name_prefix=name)
+                _POOLS[name] = pool
+    return pool
+
+async def run_in(name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Await fn(*args, **kwargs) on the named executor (in a copy of the caller's context,
+    so per-request metrics collected there land on the calling request)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(name), functools.partial(ctx.run, fn, *args, **kwargs))
+
+def shutdown_executors() -> None:
+    with _LOCK:
+        for pool in _POOLS.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _POOLS.clear()
@@ -0,0 +1,151 @@
+# rag/feedback_store.py
+from __future__ import annotations
+import os
+import json
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+# The JSONL stays the human-readable log (and what older tooling reads); SQLite indexes it:
+#   feedback(request_id PK) → O(1) duplicate check, counters(kind, key, n) → O(1) stats.
+# Both are written inside one IMMEDIATE transaction, so concurrent API workers serialize cleanly.
+
+
+def _vote_key(rec: Dict[str, Any]) -> str:
+    return (rec.get("vote") or "").lower() or "unknown"
+
+def _correction_key(rec: Dict[str, Any]) -> str:
+    return (rec.get("correction_needs_geo_logic") or "none").lower()
+
+
+class FeedbackStore:
+    def __init__(self, db_path: str, jsonl_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.jsonl_path = Path(jsonl_path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS feedback (request_id TEXT PRIMARY KEY, ts TEXT, vote TEXT, correction TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (kind TEXT NOT NULL, key TEXT NOT NULL, n INTEGER NOT NULL, PRIMARY KEY (kind, key))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.sync()
+
+    # ---- internals (caller holds the write transaction) ----
+    def _insert(self, key: str, rec: Dict[str, Any]) -> bool:
+        cur = self._db.execute(
+            "INSERT OR IGNORE INTO feedback (request_id, ts, vote, correction) VALUES (?, ?, ?, ?)",
+            (key, rec.get("ts"), _vote_key(rec), _correction_key(rec)),
+        )
+        if cur.rowcount == 0:
+            return False
+        for kind, k in (("total", ""), ("vote", _vote_key(rec)), ("correction", _correction_key(rec))):
+            self._db.execute(
+                "INSERT INTO counters (kind, key, n) VALUES (?, ?, 1) ON CONFLICT(kind, key) DO UPDATE SET n = n + 1",
+                (kind, k),
+            )
+        return True
+
+    def _offset(self) -> int:
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'jsonl_offset'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _set_offset(self, offset: int) -> None:
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('jsonl_offset', ?)", (str(offset),))
+
+    # ---- public ----
+    def sync(self) -> int:
+        """Index JSONL lines appended since the last sync (first run: the whole existing file)."""
+        if not self.jsonl_path.exists():
+            return 0
+        n = 0
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                offset = self._offset()
+                if offset > self.jsonl_path.stat().st_size:
+                    offset = 0  # file was replaced/truncated; counters are rebuilt from it
+                    self._db.execute("DELETE FROM feedback")
+                    self._db.execute("DELETE FROM counters")
+                with self.jsonl_path.open("rb") as f:
+                    f.seek(offset)
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break  # partial line still being written
+                        line_at = offset
+                        offset += len(raw)
+                        line = raw.strip()
+                        if not line:
+                            continue
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            rec = {}
+                        n += self._insert(rec.get("request_id") or f"_line:{line_at}", rec)
+                self._set_offset(offset)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return n
+
+    def has(self, request_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM feedback WHERE request_id = ?", (request_id,)).fetchone() is not None
+
+    def add(self, rec: Dict[str, Any]) -> bool:
+        """Record feedback once per request_id: index row, counters and JSONL line together.
+        Returns False (nothing written) if this request_id already has feedback.
+        """
+        key = rec["request_id"]
+        line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if not self._insert(key, rec):
+                    self._db.execute("ROLLBACK")
+                    return False
+                self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.jsonl_path.open("ab") as f:
+                    f.write(line)
+                    end = f.tell()
+                # Only advance past our own line if nothing else appended in between
+                if end - len(line) == self._offset():
+                    self._set_offset(end)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._db.execute("SELECT kind, key, n FROM counters").fetchall()
+        out: Dict[str, Any] = {"total": 0, "by_vote": {}, "by_correction": {}}
+        for kind, key, n in rows:
+            if kind == "total":
+                out["total"] = n
+            elif kind == "vote":
+                out["by_vote"][key] = n
+            elif kind == "correction":
+                out["by_correction"][key] = n
+        return out
+
+
+def _resolve(path: str) -> str:
+    p = Path(path)
+    if p.is_absolute():
+        return str(p)
+    return str(Path(__file__).resolve().parents[1] / p)
+
+
+@lru_cache(maxsize=1)
+def get_feedback_store() -> FeedbackStore:
+    """Process-wide store. Env: FEEDBACK_LOG_JSONL (default data/feedback.jsonl),
+    FEEDBACK_DB (default data/feedback.sqlite).
+    """
+    return FeedbackStore(
+        _resolve(os.getenv("FEEDBACK_DB", "data/feedback.sqlite")),
+        _resolve(os.getenv("FEEDBACK_LOG_JSONL", "data/feedback.jsonl")),
+    )
@@ -0,0 +1,153 @@
+# rag/few_shot.py
+from __future__ import annotations
+import os
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+
+def _compact(log_entry: Dict[str, Any]) -> Dict[str, Any]:
+    # Only what a few-shot example needs (the classify log also carries provenance/metrics)
+    full_response = log_entry.get("response", {}) or {}
+    return {
+        "feature_text": log_entry.get("feature_text", ""),
+        "rule_hits": log_entry.get("rule_hits", []) or [],
+        "response": {
+            "needs_geo_logic": full_response.get("needs_geo_logic"),
+            "reasoning": full_response.get("reasoning"),
+            "confidence": full_response.get("confidence"),
+            "laws": full_response.get("laws", [])[:2],  # Limit to first 2 laws to keep concise
+        },
+        "confidence": full_response.get("confidence", 0.0),
+        "timestamp": log_entry.get("ts", ""),
+    }
+
+
+class _Tail:
+    """Reads only the complete lines appended to a JSONL file since the last call."""
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.seq = 0
+
+    def read(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self.offset:  # truncated/replaced
+            self.offset = 0
+        if size == self.offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # partial line still being written
+                self.offset += len(raw)
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                self.seq += 1
+                yield self.seq, rec
+
+
+class FewShotIndex:
+    """In-memory few-shot candidates, kept current by tailing the feedback and classify logs.
+    - votes: request_id → (seq, "up"|"down"), latest feedback wins
+    - labeled: classify entries (compact) that have feedback; recent: bounded LRU of the rest,
+      so feedback arriving after its classification finds the entry without a rescan
+    - version: bumps only when the selectable examples can change (new feedback, or a classify
+      entry for an already-voted request), so prompt/result caches keyed on it stay warm
+    """
+    def __init__(self, feedback_path: str, classify_path: str, recent_max: int = 10000):
+        self._lock = threading.Lock()
+        self._feedback = _Tail(feedback_path)
+        self._classify = _Tail(classify_path)
+        self.recent_max = recent_max
+        self.votes: Dict[str, Tuple[int, str]] = {}
+        self.labeled: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self.recent: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        self.version = 0
+        self._selected: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+
+    def refresh(self) -> int:
+        """Apply lines appended to either log since the last refresh; returns the version."""
+        with self._lock:
+            changed = False
+            for seq, rec in self._classify.read():
+                rid = rec.get("request_id")
+                if not rid:
+                    continue
+                entry = (seq, _compact(rec))
+                if rid in self.votes:
+                    self.labeled[rid] = entry
+                    changed = True
+                else:
+                    self.recent[rid] = entry
+                    self.recent.move_to_end(rid)
+                    while len(self.recent) > self.recent_max:
+                        self.recent.popitem(last=False)
+            for seq, rec in self._feedback.read():
+                rid = rec.get("request_id")
+                vote = rec.get("vote")
+                if not rid or vote not in {"up", "down"}:
+                    continue
+                self.votes[rid] = (seq, vote)
+                if rid in self.recent:
+                    self.labeled[rid] = self.recent.pop(rid)
+                changed = True
+            if changed:
+                self.version += 1
+                self._selected.clear()
+            return self.version
+
+    def examples(self, max_positive: int = 2, max_negative: int = 1) -> List[Dict[str, Any]]:
+        """Latest voted examples (positive first), at most one per rule combination."""
+        self.refresh()
+        with self._lock:
+            key = (max_positive, max_negative)
+            if key not in self._selected:
+                self._selected[key] = self._select(max_positive, max_negative)
+            return [dict(e) for e in self._selected[key]]
+
+    def _select(self, max_positive: int, max_negative: int) -> List[Dict[str, Any]]:
+        if max_positive == 0 and max_negative == 0:
+            return []
+        # Latest feedback first; look a bit past the quota since some may lack a log entry
+        by_recency = sorted(self.votes.items(), key=lambda kv: kv[1][0], reverse=True)
+        up = set([rid for rid, (_, v) in by_recency if v == "up"][: max_positive * 2])
+        down = set([rid for rid, (_, v) in by_recency if v == "down"][: max_negative * 2])
+
+        positive, negative = [], []
+        seen_rule_combinations = set()
+        # Classify log from latest to oldest
+        for rid, (_, entry) in sorted(self.labeled.items(), key=lambda kv: kv[1][0], reverse=True):
+            if len(positive) >= max_positive and len(negative) >= max_negative:
+                break
+            rule_hits = tuple(sorted(entry["rule_hits"]))
+            if rule_hits in seen_rule_combinations:
+                continue
+            if rid in up and len(positive) < max_positive:
+                positive.append({"type": "positive", **entry,
+                                 "feedback_note": "GOOD classification (upvoted by user) should increase confidence"})
+                seen_rule_combinations.add(rule_hits)
+            elif rid in down and len(negative) < max_negative:
+                negative.append({"type": "negative", **entry,
+                                 "feedback_note": "Poor classification (downvoted by user) should decrease confidence"})
+                seen_rule_combinations.add(rule_hits)
+        return positive + negative
+
+
+@lru_cache(maxsize=4)
+def get_few_shot_index(feedback_path: str, classify_path: str) -> FewShotIndex:
+    """One index per (feedback, classify) log pair; the first call reads both logs once.
+    FEW_SHOT_RECENT_MAX (default 10000) bounds classify entries kept while awaiting feedback.
+    """
+    return FewShotIndex(feedback_path, classify_path, recent_max=int(os.getenv("FEW_SHOT_RECENT_MAX", "10000")))
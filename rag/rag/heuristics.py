@@ -1,6 +1,8 @@
 from __future__ import annotations
 import re
-from typing import List, Set
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple
 
 _RULES = [
     # Age-sensitive logic (expanded)
@@ -40,27 +42,63 @@ _RULES = [
 
 _COMPILED = [(re.compile(pat, re.I), tag) for pat, tag in _RULES]
 
-def auto_rule_hits(text: str, max_rules: int | None = None) -> List[str]:
-    hits: Set[str] = set()
-    for rx, tag in _COMPILED:
-        if rx.search(text or ""):
-            hits.add(tag)
-            # Promote a generic legal cue if we see region/law keywords
-            if tag in {"utah", "florida", "california", "eu", "us_federal"}:
-                hits.add("legal_cue")
-        if max_rules and len(hits) >= max_rules:
-            break
-    return sorted(hits)
+# Literal keywords, one of which (casefolded) occurs in every match of the rule's pattern.
+# A rule's regex only runs when one of its keywords is in the text, so most rules cost a
+# substring check. Keep in sync with _RULES; scripts/bench_heuristics.py checks parity.
+_KEYWORDS = {
+    "asl": ("asl", "age", "parental", "curfew", "night", "after", "before", "under", "minor"),
+    "gh": ("gh", "geo", "region", "eea", "eu"),
+    "nsp": ("nsp", "non"),
+    "lcp": ("lcp", "local"),
+    "echotrace": ("echotrace",),
+    "redline": ("redline",),
+    "cds": ("cds", "compliance"),
+    "drt": ("drt", "retention"),
+    "spanner": ("spanner",),
+    "snowcap": ("snowcap",),
+    "jellybean": ("jellybean",),
+    "imt": ("imt", "internal"),
+    "fr": ("fr", "rollout"),
+    "t5": ("t5", "risk", "reports", "abuse", "ncmec"),
+    "pf": ("pf", "feed"),
+    "nr": ("nr", "recommended"),
+    "softblock": ("block",),
+    "shadowmode": ("shadow",),
+    "glow": ("glow",),
+    "bb": ("bb", "baseline"),
+    "utah": ("utah", "us-ut", "us ut"),
+    "florida": ("florida", "us-fl", "us fl", "protections"),
+    "california": ("california", "us-ca", "us ca", "976", "protecting"),
+    "eu": ("eu", "eea", "dsa", "digital"),
+    "us_federal": ("us", "federal", "2258a", "ncmec", "provider"),
+}
+# keyword → indexes into _COMPILED, each keyword checked once per text
+_KEYWORD_RULES: Dict[str, Tuple[int, ...]] = {}
+for _i, (_, _tag) in enumerate(_COMPILED):
+    for _kw in _KEYWORDS[_tag]:
+        _KEYWORD_RULES[_kw] = _KEYWORD_RULES.get(_kw, ()) + (_i,)
 
+_REGION_TAGS = {"utah", "florida", "california", "eu", "us_federal"}
 
-def infer_regions(text: str) -> List[str]:
-    """Infer region codes from text using rule hits.
-    - US state hits include that state and US federal ("US").
-    - EU/EEA maps to "EU".
-    - Explicit federal cues add "US".
-    Order is preserved and duplicates removed.
+
+@dataclass(frozen=True)
+class RuleMatch:
+    """Result of one pass of the rule set over a text.
+    - hits: matched tags in rule order (no legal_cue)
+    - tags: sorted tags plus "legal_cue" if any region/law rule matched (what auto_rule_hits returns)
+    - regions: region codes (what infer_regions returns)
+    - spans: tag → (start, end, matched text) of the first match, for provenance
     """
-    tags = set(auto_rule_hits(text))
+    hits: Tuple[str, ...]
+    tags: Tuple[str, ...]
+    regions: Tuple[str, ...]
+    spans: Dict[str, Tuple[int, int, str]]
+
+    def provenance(self) -> Dict[str, List]:
+        return {tag: [start, end, text] for tag, (start, end, text) in self.spans.items()}
+
+
+def _regions_for(tags: Set[str]) -> List[str]:
     regions: List[str] = []
     state_hit = False
     if "utah" in tags:
@@ -80,3 +118,56 @@ def infer_regions(text: str) -> List[str]:
         if r not in seen:
             seen.add(r); out.append(r)
     return out
+
+
+@lru_cache(maxsize=4096)
+def match_rules(text: str) -> RuleMatch:
+    """Tags, regions and match spans from a single pass over `text` (cached per text, so
+    /classify_auto → /classify and batch paths don't rescan the same feature text).
+    """
+    text = text or ""
+    folded = text.casefold()
+    candidates = sorted({i for kw, rules in _KEYWORD_RULES.items() if kw in folded for i in rules})
+    hits: List[str] = []
+    spans: Dict[str, Tuple[int, int, str]] = {}
+    for i in candidates:
+        rx, tag = _COMPILED[i]
+        m = rx.search(text)
+        if m:
+            hits.append(tag)
+            spans[tag] = (m.start(), m.end(), m.group(0))
+    tags = set(hits)
+    if tags & _REGION_TAGS:
+        tags.add("legal_cue")
+    return RuleMatch(
+        hits=tuple(hits),
+        tags=tuple(sorted(tags)),
+        regions=tuple(_regions_for(tags)),
+        spans=spans,
+    )
+
+
+def auto_rule_hits(text: str, max_rules: int | None = None) -> List[str]:
+    m = match_rules(text)
+    if not max_rules:
+        return list(m.tags)
+    # Same cut-off as scanning the rules in order and stopping once max_rules tags are collected
+    hits: Set[str] = set()
+    for tag in m.hits:
+        hits.add(tag)
+        # Promote a generic legal cue if we see region/law keywords
+        if tag in _REGION_TAGS:
+            hits.add("legal_cue")
+        if len(hits) >= max_rules:
+            break
+    return sorted(hits)
+
+
+def infer_regions(text: str) -> List[str]:
+    """Infer region codes from text using rule hits.
+    - US state hits include that state and US federal ("US").
+    - EU/EEA maps to "EU".
+    - Explicit federal cues add "US".
+    Order is preserved and duplicates removed.
+    """
+    return list(match_rules(text).regions)
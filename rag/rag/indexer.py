@@ -0,0 +1,182 @@
+# rag/indexer.py
+from __future__ import annotations
+import os
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client.http.models import PointStruct, SparseVector
+
+from rag.chunking import assign_chunk_ids, chunk_id, content_hash
+from rag.qdrant_store import (
+    COLLECTION, DENSE_NAME, SPARSE_NAME,
+    get_qdrant_client, get_dense_embeddings, get_sparse_embeddings, bump_kb_version,
+)
+
+
+def iter_chunks(jsonl_path: str, skip: int = 0) -> Iterator[Document]:
+    """Stream Documents from a chunks JSONL (one line at a time), skipping the first `skip` records.
+    Records from older exports (random IDs, no metadata.chunk_id) get their deterministic ID here.
+    """
+    dups: Dict[tuple, int] = {}
+    n = 0
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            text = rec["text"].strip()
+            meta = rec.get("metadata", {})
+            if not meta.get("chunk_id"):
+                src = meta.get("source_path", "")
+                key = (src, content_hash(text))
+                meta["chunk_id"] = chunk_id(src, text, dups.get(key, 0))
+                meta["content_hash"] = key[1]
+                dups[key] = dups.get(key, 0) + 1
+            n += 1
+            if n <= skip:
+                continue
+            yield Document(page_content=text, metadata=meta)
+
+
+# ---------- Checkpoint ----------
+
+def file_signature(path: str) -> Dict[str, Any]:
+    st = os.stat(path)
+    return {"path": str(Path(path).resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def load_checkpoint(checkpoint_path: str, jsonl_path: str, collection: str) -> int:
+    """Records already upserted by a previous run of the same JSONL/collection (0 if none/stale)."""
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            ck = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if ck.get("source") != file_signature(jsonl_path) or ck.get("collection") != collection:
+        return 0
+    return int(ck.get("done", 0))
+
+def _save_checkpoint(checkpoint_path: str, source: Dict[str, Any], collection: str, done: int) -> None:
+    tmp = f"{checkpoint_path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "collection": collection, "done": done}, f)
+    os.replace(tmp, checkpoint_path)
+
+
+# ---------- Pipeline ----------
+
+def _to_points(batch: List[Document], ids: List[str], dense: List[List[float]], sparse: list) -> List[PointStruct]:
+    # Same payload layout QdrantVectorStore writes, so retrieval reads these points unchanged
+    return [
+        PointStruct(
+            id=pid,
+            vector={
+                DENSE_NAME: dv,
+                SPARSE_NAME: SparseVector(indices=list(sv.indices), values=list(sv.values)),
+            },
+            payload={QdrantVectorStore.CONTENT_KEY: d.page_content, QdrantVectorStore.METADATA_KEY: d.metadata},
+        )
+        for d, pid, dv, sv in zip(batch, ids, dense, sparse)
+    ]
+
+def index_stream(
+    docs: Iterable[Document],
+    collection_name: str = COLLECTION,
+    batch_size: int = 128,
+    queue_size: int = 4,
+    checkpoint: Optional[Dict[str, Any]] = None,
+    start: int = 0,
+) -> Dict[str, Any]:
+    """Two-stage indexer: this thread embeds (dense + sparse) batch N+1 while an upsert thread
+    writes batch N; a bounded queue between them caps memory.
+    Upserts use wait=True, so a batch is applied (and searchable) before it is checkpointed and
+    before the KB version is bumped; the wait overlaps with embedding in the other thread.
+    `checkpoint` = {"path", "source", "collection"}; progress (records done, counting `start`)
+    is saved after every applied upsert so a failed run can resume.
+    Returns a throughput report.
+    """
+    client = get_qdrant_client()
+    dense_enc = get_dense_embeddings()
+    sparse_enc = get_sparse_embeddings()
+    q: "queue.Queue[Optional[tuple[List[PointStruct], int]]]" = queue.Queue(maxsize=queue_size)
+    stats: Dict[str, Any] = {"chunks": 0, "batches": 0, "dense_s": 0.0, "sparse_s": 0.0, "upsert_s": 0.0}
+    errors: List[BaseException] = []
+
+    def _upserter() -> None:
+        done = start
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            points, n = item
+            if errors:
+                continue  # drain after a failure
+            t = time.perf_counter()
+            try:
+                # wait=True: the checkpoint below must never run ahead of points Qdrant has applied
+                client.upsert(collection_name=collection_name, points=points, wait=True)
+            except BaseException as e:
+                errors.append(e)
+                continue
+            stats["upsert_s"] += time.perf_counter() - t
+            done += n
+            if checkpoint:
+                _save_checkpoint(checkpoint["path"], checkpoint["source"], checkpoint["collection"], done)
+
+    worker = threading.Thread(target=_upserter, name="index-upsert", daemon=True)
+    worker.start()
+    t0 = time.perf_counter()
+
+    def _flush(batch: List[Document]) -> None:
+        if all(d.metadata.get("chunk_id") for d in batch):
+            ids = [d.metadata["chunk_id"] for d in batch]
+        else:
+            ids = assign_chunk_ids(batch)
+        texts = [d.page_content for d in batch]
+        t = time.perf_counter()
+        dense = dense_enc.embed_documents(texts)
+        stats["dense_s"] += time.perf_counter() - t
+        t = time.perf_counter()
+        sparse = sparse_enc.embed_documents(texts)
+        stats["sparse_s"] += time.perf_counter() - t
+        q.put((_to_points(batch, ids, dense, sparse), len(batch)))
+        stats["chunks"] += len(batch)
+        stats["batches"] += 1
+
+    try:
+        batch: List[Document] = []
+        for d in docs:
+            if errors:
+                break
+            batch.append(d)
+            if len(batch) >= batch_size:
+                _flush(batch)
+                batch = []
+        if batch and not errors:
+            _flush(batch)
+    finally:
+        q.put(None)
+        worker.join()
+    if errors:
+        raise errors[0]
+
+    if stats["chunks"]:
+        bump_kb_version()
+    wall = time.perf_counter() - t0
+    embed_s = stats["dense_s"] + stats["sparse_s"]
+    stats.update({
+        "wall_s": round(wall, 3),
+        "chunks_per_s": round(stats["chunks"] / wall, 2) if wall > 0 else 0.0,
+        "embed_s": round(embed_s, 3),
+        "dense_s": round(stats["dense_s"], 3),
+        "sparse_s": round(stats["sparse_s"], 3),
+        "upsert_s": round(stats["upsert_s"], 3),
+        # >0 means upserts were hidden behind embedding
+        "overlap_s": round(max(0.0, embed_s + stats["upsert_s"] - wall), 3),
+    })
+    return stats
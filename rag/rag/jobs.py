@@ -0,0 +1,188 @@
+# rag/jobs.py
+from __future__ import annotations
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+from rag.executors import get_executor
+
+# Job lifecycle: queued → running (stage: parsing → saving → manifest → chunking → indexing) → done | error
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _boot_id() -> str:
+    # Changes on every machine boot, so a pid recorded before a reboot never looks alive
+    try:
+        with open("/proc/sys/kernel/random/boot_id", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return socket.gethostname()
+
+
+_BOOT_ID = _boot_id()
+
+
+def _owner() -> str:
+    """Identity of the process running a job: "<boot id>:<pid>"."""
+    return f"{_BOOT_ID}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    boot, _, pid = (owner or "").rpartition(":")
+    if boot != _BOOT_ID or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return False  # an earlier process that had our pid; this one has no jobs yet when it reaps
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """SQLite-backed job table (WAL). Each job records the process that owns it (boot id + pid),
+    so a worker starting up only reaps jobs whose owner is gone, not those of live sibling workers.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT,"
+            " params TEXT, result TEXT, error TEXT, timings TEXT,"
+            " created_at TEXT, started_at TEXT, finished_at TEXT, owner TEXT)"
+        )
+        cols = {r["name"] for r in self._db.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in cols:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def mark_interrupted(self) -> None:
+        """Jobs left queued/running by a process that no longer exists will never finish; say so.
+        Jobs owned by other live workers (same boot, pid still running) are left alone.
+        """
+        with self._lock:
+            owners = [r["owner"] for r in self._db.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN ('queued', 'running')"
+            )]
+            dead = [o for o in owners if not _owner_alive(o)]
+            for o in dead:
+                self._db.execute(
+                    "UPDATE jobs SET status='error', error='interrupted (server restarted)', finished_at=?"
+                    " WHERE status IN ('queued', 'running') AND owner IS ?",
+                    (_now_iso(), o),
+                )
+
+    def create(self, kind: str, params: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, stage, params, timings, created_at, owner)"
+                " VALUES (?, ?, 'queued', 'queued', ?, '{}', ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), _now_iso(), _owner()),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        if not fields:
+            return
+        cols, vals = [], []
+        for k, v in fields.items():
+            cols.append(f"{k} = ?")
+            vals.append(json.dumps(v, ensure_ascii=False) if k in {"params", "result", "timings"} else v)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {', '.join(cols)} WHERE id = ?", (*vals, job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        rec = dict(row)
+        for k in ("params", "result", "timings"):
+            rec[k] = json.loads(rec[k]) if rec.get(k) else None
+        return rec
+
+    def list(self, limit: int = 50) -> list[Dict[str, Any]]:
+        with self._lock:
+            ids = [r["id"] for r in self._db.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))]
+        return [j for j in (self.get(i) for i in ids) if j is not None]
+
+
+@lru_cache(maxsize=1)
+def get_job_store() -> JobStore:
+    path = os.getenv("JOBS_DB", "data/ingest_jobs.sqlite")
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), path)
+    store = JobStore(path)
+    store.mark_interrupted()
+    return store
+
+
+class JobProgress:
+    """Callback handed to the job function: progress("stage", chunks=12, ...).
+    Records per-stage wall time and merges extra fields into the job result.
+    """
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.timings: Dict[str, float] = {}
+        self.info: Dict[str, Any] = {}
+        self._stage: str | None = None
+        self._t = time.perf_counter()
+
+    def _close_stage(self) -> None:
+        now = time.perf_counter()
+        if self._stage:
+            self.timings[self._stage] = round((now - self._t) * 1000, 1)
+        self._t = now
+
+    def __call__(self, stage: str, **info: Any) -> None:
+        self._close_stage()
+        self._stage = stage
+        self.info.update(info)
+        self.store.update(self.job_id, stage=stage, timings=self.timings, result=self.info)
+
+    def finish(self) -> None:
+        self._close_stage()
+        self._stage = None
+
+
+def submit_job(kind: str, fn: Callable[..., Dict[str, Any]], params: Dict[str, Any], **kwargs: Any) -> str:
+    """Queue fn(progress=..., **kwargs) on the ingest executor; returns the job id at once.
+    Concurrency is bounded by INGEST_WORKERS, separate from the retrieval pool.
+    """
+    store = get_job_store()
+    job_id = store.create(kind, params)
+
+    def _run() -> None:
+        progress = JobProgress(store, job_id)
+        store.update(job_id, status="running", started_at=_now_iso())
+        try:
+            result = fn(progress=progress, **kwargs) or {}
+            progress.finish()
+            store.update(job_id, status="done", stage="done", result={**progress.info, **result},
+                         timings=progress.timings, finished_at=_now_iso())
+        except Exception as e:
+            progress.finish()
+            detail = getattr(e, "detail", None) or str(e)
+            store.update(job_id, status="error", error=str(detail), timings=progress.timings,
+                         result=progress.info, finished_at=_now_iso())
+
+    get_executor("ingest").submit(_run)
+    return job_id
@@ -0,0 +1,216 @@
+# rag/local_index.py
+from __future__ import annotations
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from rag.embeddings import SPARSE_MODE
+from rag.metrics import timed
+from rag.qdrant_store import get_dense_embeddings, get_sparse_embeddings
+
+# In-process alternative to the Qdrant server for a KB that fits in RAM.
+#   VECTOR_BACKEND=qdrant|local (default qdrant)
+#   LOCAL_INDEX_DIR=data/kb_chunks/local_index (built by scripts/build_local_index.py)
+# Layout of LOCAL_INDEX_DIR:
+#   dense.npy   float32 (N, dim), L2-normalized, memory-mapped at load
+#   sparse.npz  inverted index: terms (sorted), indptr, postings (row ids), weights
+#   docs.jsonl  one {"text", "metadata"} per row, same order as dense.npy
+#   meta.json   sparse mode, dims, row count
+
+# Same constant Qdrant's RRF fusion uses: score = sum(1 / (rank + RRF_K))
+RRF_K = 2
+
+
+def vector_backend() -> str:
+    return "local" if os.getenv("VECTOR_BACKEND", "qdrant").strip().lower() == "local" else "qdrant"
+
+
+def _index_dir() -> Path:
+    path = os.getenv("LOCAL_INDEX_DIR", "data/kb_chunks/local_index")
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), path)
+    return Path(path)
+
+
+class LocalHybridIndex:
+    """Dense (brute-force dot product over a mmap'd matrix) + sparse (inverted index) search,
+    fused with RRF like the Qdrant collection. Region filters are a boolean row mask.
+    """
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        with open(path / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.dense = np.load(path / "dense.npy", mmap_mode="r")
+        z = np.load(path / "sparse.npz")
+        self.terms, self.indptr, self.postings, self.weights = z["terms"], z["indptr"], z["postings"], z["weights"]
+        self.docs: List[Document] = []
+        with open(path / "docs.jsonl", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                rec = json.loads(line)
+                meta = dict(rec.get("metadata") or {})
+                meta["_id"] = meta.get("chunk_id") or row
+                meta["_collection_name"] = "local"
+                self.docs.append(Document(page_content=rec["text"], metadata=meta))
+        self.regions = np.array([d.metadata.get("region") or "" for d in self.docs], dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _mask(self, regions: list[str] | None) -> Optional[np.ndarray]:
+        return np.isin(self.regions, regions) if regions else None
+
+    def _sparse_scores(self, sv) -> np.ndarray:
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        q_idx = np.asarray(list(sv.indices), dtype=self.terms.dtype)
+        q_val = np.asarray(list(sv.values), dtype=np.float32)
+        if not len(q_idx) or not len(self.terms):
+            return scores
+        pos = np.searchsorted(self.terms, q_idx)
+        pos_c = np.minimum(pos, len(self.terms) - 1)
+        found = self.terms[pos_c] == q_idx
+        for p, v in zip(pos_c[found], q_val[found]):
+            lo, hi = self.indptr[p], self.indptr[p + 1]
+            np.add.at(scores, self.postings[lo:hi], v * self.weights[lo:hi])
+        return scores
+
+    @staticmethod
+    def _top(scores: np.ndarray, mask: Optional[np.ndarray], limit: int, positive_only: bool = False) -> np.ndarray:
+        s = np.where(mask, scores, -np.inf) if mask is not None else scores
+        if positive_only:
+            s = np.where(s > 0, s, -np.inf)
+        limit = min(limit, len(s))
+        if limit <= 0:
+            return np.zeros(0, dtype=np.int64)
+        cand = np.argpartition(-s, limit - 1)[:limit]
+        cand = cand[np.argsort(-s[cand], kind="stable")]
+        return cand[np.isfinite(s[cand])]
+
+    def _fuse(self, ranked_lists: Iterable[np.ndarray], k: int) -> List[int]:
+        fused: Dict[int, float] = {}
+        for ranked in ranked_lists:
+            for rank, row in enumerate(ranked.tolist()):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (rank + RRF_K)
+        return [row for row, _ in sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]]
+
+    def search_rows(self, dense_scores: np.ndarray, sv, k: int, regions: list[str] | None, prefetch: int | None = None) -> List[int]:
+        mask = self._mask(regions)
+        limit = prefetch or k
+        return self._fuse([
+            self._top(dense_scores, mask, limit),
+            self._top(self._sparse_scores(sv), mask, limit, positive_only=True),
+        ], k)
+
+    def search_batch(self, dense_vecs, sparse_vecs: list, k: int, regions_list: List[list[str] | None]) -> List[List[Document]]:
+        """Same contract as qdrant_store.hybrid_search_batch, with region lists instead of Filters."""
+        if not len(regions_list):
+            return []
+        with timed("local_search"):
+            dense_scores = np.asarray(dense_vecs, dtype=np.float32) @ self.dense.T  # (Q, N)
+            out = []
+            for i, (sv, regions) in enumerate(zip(sparse_vecs, regions_list)):
+                out.append([self.docs[r] for r in self.search_rows(dense_scores[i], sv, k, regions)])
+        return out
+
+
+class LocalHybridRetriever(BaseRetriever):
+    """Drop-in for the Qdrant retriever returned by get_hybrid_retriever()."""
+    index: Any
+    k: int = 5
+    mmr: bool = False
+    regions: Optional[List[str]] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        qv = get_dense_embeddings().embed_queries([query])
+        sv = get_sparse_embeddings().embed_query(query)
+        with timed("local_search"):
+            dense_scores = (qv @ self.index.dense.T)[0]
+            if not self.mmr:
+                return [self.index.docs[r] for r in self.index.search_rows(dense_scores, sv, self.k, self.regions)]
+            # MMR over the dense vectors of a larger fused candidate set (fetch_k as in the Qdrant path)
+            fetch_k = max(2 * self.k, 20)
+            rows = self.index.search_rows(dense_scores, sv, fetch_k, self.regions, prefetch=fetch_k)
+        if not rows:
+            return []
+        picked = maximal_marginal_relevance(qv[0], np.asarray(self.index.dense[rows]), k=self.k)
+        return [self.index.docs[rows[j]] for j in picked]
+
+
+__LOCK = threading.Lock()
+__INDEX: LocalHybridIndex | None = None
+
+
+def get_local_index() -> LocalHybridIndex:
+    global __INDEX
+    with __LOCK:
+        if __INDEX is None:
+            path = _index_dir()
+            if not (path / "meta.json").exists():
+                raise FileNotFoundError(f"Local index not found at {path}; run scripts/build_local_index.py")
+            __INDEX = LocalHybridIndex(path)
+            if __INDEX.meta.get("sparse_mode") != SPARSE_MODE:
+                raise ValueError(
+                    f"Local index was built with SPARSE_MODE={__INDEX.meta.get('sparse_mode')}, current is {SPARSE_MODE}"
+                )
+    return __INDEX
+
+
+def reset_local_index() -> None:
+    global __INDEX
+    with __LOCK:
+        __INDEX = None
+
+
+def build_local_index(docs: Iterable[Document], out_dir: str | Path | None = None, batch_size: int = 128) -> Dict[str, Any]:
+    """Embed docs (dense + sparse, same encoders as the Qdrant path) and write the index files."""
+    out = Path(out_dir) if out_dir else _index_dir()
+    out.mkdir(parents=True, exist_ok=True)
+    dense_enc = get_dense_embeddings()
+    sparse_enc = get_sparse_embeddings()
+    dense_parts: List[np.ndarray] = []
+    post: Dict[int, List[tuple[int, float]]] = {}
+    n = 0
+    with open(out / "docs.jsonl.tmp", "w", encoding="utf-8") as f:
+        batch: List[Document] = []
+
+        def _flush(batch: List[Document]) -> None:
+            nonlocal n
+            texts = [d.page_content for d in batch]
+            dense_parts.append(np.asarray(dense_enc.embed_documents(texts), dtype=np.float32))
+            for sv in sparse_enc.embed_documents(texts):
+                for t, w in zip(sv.indices, sv.values):
+                    post.setdefault(int(t), []).append((n, float(w)))
+                n += 1
+            for d in batch:
+                f.write(json.dumps({"text": d.page_content, "metadata": d.metadata}, ensure_ascii=False) + "\n")
+
+        for d in docs:
+            batch.append(d)
+            if len(batch) >= batch_size:
+                _flush(batch)
+                batch = []
+        if batch:
+            _flush(batch)
+
+    dense = np.concatenate(dense_parts) if dense_parts else np.zeros((0, 1024), dtype=np.float32)
+    terms = np.array(sorted(post), dtype=np.int64)
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(post[t]) for t in terms.tolist()], out=indptr[1:])
+    postings = np.fromiter((r for t in terms.tolist() for r, _ in post[t]), dtype=np.int32, count=int(indptr[-1]))
+    weights = np.fromiter((w for t in terms.tolist() for _, w in post[t]), dtype=np.float32, count=int(indptr[-1]))
+
+    np.save(out / "dense.npy", dense)
+    np.savez(out / "sparse.npz", terms=terms, indptr=indptr, postings=postings, weights=weights)
+    os.replace(out / "docs.jsonl.tmp", out / "docs.jsonl")
+    meta = {"rows": n, "dim": int(dense.shape[1]) if dense.ndim == 2 else 0, "terms": int(len(terms)), "sparse_mode": SPARSE_MODE}
+    with open(out / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    reset_local_index()
+    return {**meta, "path": str(out)}
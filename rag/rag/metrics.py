@@ -0,0 +1,149 @@
+# rag/metrics.py
+from __future__ import annotations
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Process-wide latency histograms and token counters, rendered in the Prometheus text format
+# on GET /metrics (no client library needed). Stages recorded on the hot path:
+#   embed, sparse, qdrant | local_search, rerank, prompt, llm, parse, log_write
+# While a request_metrics() block is active, the same observations are also summed per request
+# (the classify endpoints put them in provenance.metrics). run_in() copies the context into
+# executor threads, so stages timed there count toward the request that scheduled them.
+
+# Seconds, like Prometheus conventions; spans cache hits (sub-ms) to slow LLM calls
+BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}  # label value → (bucket counts, [sum, count])
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts, totals = self._series.setdefault(label_value, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[i] += 1
+            totals[0] += seconds
+            totals[1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(c), list(t)) for k, (c, t) in self._series.items()}
+        for value, (counts, (total, n)) in sorted(series.items()):
+            cum = 0
+            for le, c in zip(self.buckets, counts):
+                cum += c
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{le}"}} {cum}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="+Inf"}} {n}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {n}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, label_value: str, n: float = 1) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + n
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for value, n in sorted(values.items()):
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {n:g}')
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Latency of a pipeline stage.", "stage")
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "End-to-end latency per API route.", "route")
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens reported by the provider.", "kind")
+_ALL = (STAGE_SECONDS, REQUEST_SECONDS, LLM_TOKENS)
+
+
+class RequestMetrics:
+    """Per-request sums: stage → ms (and call count), token kind → count."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages_ms: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.tokens: Dict[str, int] = {}
+
+    def add_stage(self, stage: str, ms: float) -> None:
+        with self._lock:
+            self.stages_ms[stage] = self.stages_ms.get(stage, 0.0) + ms
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def add_tokens(self, kind: str, n: int) -> None:
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + n
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stages_ms": {k: round(v, 2) for k, v in self.stages_ms.items()},
+                "stage_calls": dict(self.calls),
+                "tokens": dict(self.tokens),
+            }
+
+
+_CURRENT: ContextVar[Optional[RequestMetrics]] = ContextVar("rag_request_metrics", default=None)
+
+
+@contextmanager
+def request_metrics() -> Iterator[RequestMetrics]:
+    """Collect the stages observed in this context (and executor work it schedules via run_in)."""
+    rm = RequestMetrics()
+    token = _CURRENT.set(rm)
+    try:
+        yield rm
+    finally:
+        _CURRENT.reset(token)
+
+
+def observe(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(stage, seconds)
+    rm = _CURRENT.get()
+    if rm is not None:
+        rm.add_stage(stage, seconds * 1000)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+
+def add_tokens(kind: str, n: int) -> None:
+    if not n:
+        return
+    LLM_TOKENS.inc(kind, n)
+    rm = _CURRENT.get()
+    if rm is not None:
+        rm.add_tokens(kind, n)
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in _ALL:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
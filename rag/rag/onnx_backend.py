@@ -0,0 +1,79 @@
+# rag/onnx_backend.py
+from __future__ import annotations
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict
+
+# CPU inference through ONNX Runtime (sentence-transformers' ONNX backend; needs
+# `pip install "optimum[onnxruntime]"`). Optional: callers fall back to torch when unavailable.
+#   - EMBED_BACKEND=torch|onnx   (BGE-M3 dense; default torch)
+#   - RERANK_BACKEND=torch|onnx  (cross-encoder; default torch)
+#   - ONNX_QUANTIZE=int8|none    (dynamic int8 weights; default int8)
+#   - ONNX_QUANT_CONFIG=avx2|avx512|avx512_vnni|arm64 (default avx2)
+#   - ONNX_THREADS=<n>           (intra-op threads; default 0 = ORT decides)
+#   - ONNX_CACHE_DIR=data/onnx_models (exported/quantized models are written here once)
+
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "int8").strip().lower()
+ONNX_QUANT_CONFIG = os.getenv("ONNX_QUANT_CONFIG", "avx2").strip().lower()
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+_EXPORT_LOCK = threading.Lock()
+
+
+def backend_for(kind: str) -> str:
+    """Configured backend for "embed" or "rerank": "torch" or "onnx"."""
+    value = os.getenv(f"{kind.upper()}_BACKEND", "torch").strip().lower()
+    return "onnx" if value == "onnx" else "torch"
+
+
+def _cache_dir(model_name: str) -> Path:
+    root = os.getenv("ONNX_CACHE_DIR", "data/onnx_models")
+    if not os.path.isabs(root):
+        root = os.path.join(os.path.dirname(os.path.dirname(__file__)), root)
+    return Path(root) / model_name.replace("/", "__")
+
+
+def _model_kwargs(file_name: str | None) -> Dict[str, Any]:
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    if ONNX_THREADS > 0:
+        so.intra_op_num_threads = ONNX_THREADS
+        so.inter_op_num_threads = 1
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    kw: Dict[str, Any] = {"provider": "CPUExecutionProvider", "session_options": so}
+    if file_name:
+        kw["file_name"] = file_name
+    return kw
+
+
+def _load(cls, model_name: str, quantize: str | None, **kwargs: Any):
+    """Export `model_name` to ONNX (and int8-quantize it) on first use, then load from the local copy."""
+    quantize = ONNX_QUANTIZE if quantize is None else quantize
+    local = _cache_dir(model_name)
+    qfile = f"onnx/model_qint8_{ONNX_QUANT_CONFIG}.onnx"
+    with _EXPORT_LOCK:
+        if not (local / "onnx" / "model.onnx").exists():
+            model = cls(model_name, backend="onnx", model_kwargs=_model_kwargs(None), **kwargs)
+            model.save_pretrained(str(local))
+        if quantize == "int8" and not (local / qfile).exists():
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            base = cls(str(local), backend="onnx", model_kwargs=_model_kwargs(None), **kwargs)
+            export_dynamic_quantized_onnx_model(base, ONNX_QUANT_CONFIG, str(local))
+    return cls(str(local), backend="onnx", model_kwargs=_model_kwargs(qfile if quantize == "int8" else None), **kwargs)
+
+
+def load_onnx_sentence_model(model_name: str = "BAAI/bge-m3", quantize: str | None = None, max_length: int | None = None):
+    """SentenceTransformer on ONNX Runtime. For BGE-M3 this is the dense head only
+    (CLS pooling); the learned lexical weights are not part of the exported graph.
+    """
+    from sentence_transformers import SentenceTransformer
+    model = _load(SentenceTransformer, model_name, quantize, device="cpu")
+    if max_length:
+        model.max_seq_length = max_length
+    return model
+
+
+def load_onnx_cross_encoder(model_name: str, quantize: str | None = None):
+    from sentence_transformers import CrossEncoder
+    return _load(CrossEncoder, model_name, quantize, device="cpu")
@@ -1,17 +1,32 @@
 # rag/qdrant_store.py
 from __future__ import annotations
 import os
-from typing import List
+import uuid
+import threading
+from typing import Dict, List, Tuple
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue, FilterSelector
+from qdrant_client.http.models import (
+    Filter, FieldCondition, MatchValue, FilterSelector, PointIdsList,
+    QueryRequest, Prefetch, FusionQuery, Fusion, SparseVector,
+)
 from langchain_qdrant import QdrantVectorStore, RetrievalMode, FastEmbedSparse
+from langchain_qdrant.sparse_embeddings import SparseVector as LCSparseVector
 from langchain_core.documents import Document
+import numpy as np
 
 try:
-    from rag.embeddings import BGEM3DenseEmbeddings
+    from rag.embeddings import BGEM3DenseEmbeddings, BGEM3SparseEmbeddings, SPARSE_MODE
+    from rag.embed_cache import get_embedding_cache
+    from rag.metrics import timed
+    from rag.chunking import assign_chunk_ids
+    from rag.token_index import get_token_index, save_token_index
 except ImportError:
-    from .embeddings import BGEM3DenseEmbeddings
+    from .embeddings import BGEM3DenseEmbeddings, BGEM3SparseEmbeddings, SPARSE_MODE
+    from .embed_cache import get_embedding_cache
+    from .metrics import timed
+    from .chunking import assign_chunk_ids
+    from .token_index import get_token_index, save_token_index
 
 load_dotenv()
 
@@ -21,47 +36,272 @@ COLLECTION = os.getenv("QDRANT_COLLECTION", "laws")
 
 DENSE_NAME = "dense"
 SPARSE_NAME = "sparse"
+# Filter keys: LangChain nests chunk metadata under the "metadata" payload key
+REGION_KEY = f"{QdrantVectorStore.METADATA_KEY}.region"
+SOURCE_PATH_KEY = f"{QdrantVectorStore.METADATA_KEY}.source_path"
+
+QDRANT_PREFER_GRPC = str(os.getenv("QDRANT_PREFER_GRPC", "false")).lower() in {"1", "true", "yes"}
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))
+
+class CachedFastEmbedSparse(FastEmbedSparse):
+    """FastEmbed BM25 with the shared embedding cache in front (query and document vectors kept apart)."""
+
+    def __init__(self, model_name: str = "Qdrant/bm25", **kwargs):
+        super().__init__(model_name=model_name, **kwargs)
+        self._cache_ns = model_name
+
+    def _cached(self, texts: List[str], kind: str, compute) -> List[LCSparseVector]:
+        cache = get_embedding_cache()
+        if cache is None:
+            return compute(texts)
+        keys = [cache.make_key(f"{self._cache_ns}|sparse-{kind}", t) for t in texts]
+        hits = cache.get_many(keys)
+        miss_idx = [i for i, h in enumerate(hits) if h is None]
+        fresh = compute([texts[i] for i in miss_idx]) if miss_idx else []
+        out: List[LCSparseVector | None] = [
+            LCSparseVector(indices=h[0].tolist(), values=h[1].tolist()) if h is not None else None for h in hits
+        ]
+        for j, i in enumerate(miss_idx):
+            sv = fresh[j]
+            out[i] = sv
+            cache.put(keys[i], (np.asarray(sv.indices, dtype=np.int32), np.asarray(sv.values, dtype=np.float32)))
+        return out  # type: ignore[return-value]
+
+    def embed_documents(self, texts: List[str]) -> List[LCSparseVector]:
+        return self._cached(texts, "doc", super().embed_documents)
+
+    def embed_query(self, text: str) -> LCSparseVector:
+        with timed("sparse"):
+            return self._cached([text], "query", lambda ts: [super(CachedFastEmbedSparse, self).embed_query(t) for t in ts])[0]
+
+class _TimedQdrantClient(QdrantClient):
+    """Records every search round trip as the "qdrant" stage, whoever issues it: the batched
+    hybrid search here, and LangChain retrievers (similarity / MMR) over the shared client.
+    """
+
+    def query_points(self, *args, **kwargs):
+        with timed("qdrant"):
+            return super().query_points(*args, **kwargs)
+
+    def query_batch_points(self, *args, **kwargs):
+        with timed("qdrant"):
+            return super().query_batch_points(*args, **kwargs)
+
+# Process-wide registry: one pooled client, one dense + one sparse model and one
+# vector store per collection. Retrievers built via as_retriever() are cheap views.
+__STORE_LOCK = threading.Lock()
+__CLIENT: QdrantClient | None = None
+__DENSE: BGEM3DenseEmbeddings | None = None
+__SPARSE: CachedFastEmbedSparse | BGEM3SparseEmbeddings | None = None
+__STORES: Dict[Tuple[str, bool], QdrantVectorStore] = {}
 
 def get_qdrant_client() -> QdrantClient:
-    return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+    """Shared client (httpx keeps a connection pool; gRPC if QDRANT_PREFER_GRPC=true)."""
+    global __CLIENT
+    if __CLIENT is None:
+        with __STORE_LOCK:
+            if __CLIENT is None:
+                __CLIENT = _TimedQdrantClient(
+                    url=QDRANT_URL,
+                    api_key=QDRANT_API_KEY,
+                    prefer_grpc=QDRANT_PREFER_GRPC,
+                    timeout=QDRANT_TIMEOUT,
+                )
+    return __CLIENT
+
+def get_dense_embeddings() -> BGEM3DenseEmbeddings:
+    global __DENSE
+    if __DENSE is None:
+        with __STORE_LOCK:
+            if __DENSE is None:
+                # bge_m3 sparse mode: one forward pass yields dense + lexical weights
+                __DENSE = BGEM3DenseEmbeddings(with_sparse=(SPARSE_MODE == "bge_m3"))
+    return __DENSE
+
+def get_sparse_embeddings() -> CachedFastEmbedSparse | BGEM3SparseEmbeddings:
+    """Sparse encoder per SPARSE_MODE: FastEmbed BM25 (default) or BGE-M3 lexical weights."""
+    global __SPARSE
+    if __SPARSE is None:
+        dense = get_dense_embeddings() if SPARSE_MODE == "bge_m3" else None
+        with __STORE_LOCK:
+            if __SPARSE is None:
+                if dense is not None:
+                    __SPARSE = BGEM3SparseEmbeddings(dense)
+                else:
+                    __SPARSE = CachedFastEmbedSparse(model_name="Qdrant/bm25")
+    return __SPARSE
 
 def get_vectorstore(collection_name: str = COLLECTION, use_fastembed_sparse: bool = True) -> QdrantVectorStore:
+    key = (collection_name, use_fastembed_sparse)
+    vs = __STORES.get(key)
+    if vs is not None:
+        return vs
     client = get_qdrant_client()
-    dense = BGEM3DenseEmbeddings()
-    sparse = FastEmbedSparse(model="Qdrant/bm25") if use_fastembed_sparse else None
-
-    return QdrantVectorStore(
-        client=client,
-        collection_name=collection_name,
-        embedding=dense,
-        sparse_embedding=sparse,
-        retrieval_mode=RetrievalMode.HYBRID,
-        vector_name=DENSE_NAME,            # <-- tell LC which dense vector to use
-        sparse_vector_name=SPARSE_NAME,    # <-- and which sparse vector
-        # force_recreate=True,             # only if you want to wipe & recreate
-    )
+    dense = get_dense_embeddings()
+    sparse = get_sparse_embeddings() if use_fastembed_sparse else None
+    with __STORE_LOCK:
+        vs = __STORES.get(key)
+        if vs is None:
+            vs = QdrantVectorStore(
+                client=client,
+                collection_name=collection_name,
+                embedding=dense,
+                sparse_embedding=sparse,
+                retrieval_mode=RetrievalMode.HYBRID,
+                vector_name=DENSE_NAME,            # <-- tell LC which dense vector to use
+                sparse_vector_name=SPARSE_NAME,    # <-- and which sparse vector
+                # force_recreate=True,             # only if you want to wipe & recreate
+            )
+            __STORES[key] = vs
+    return vs
+
+def reset_vectorstores() -> None:
+    """Drop cached vector stores (e.g. after a collection is recreated). Client and models are kept."""
+    with __STORE_LOCK:
+        __STORES.clear()
+
+# ---------- KB version stamp ----------
+# Bumped on every index write/delete so result caches keyed on it go stale.
+# File-backed so the API and the indexing scripts (separate processes) agree.
+KB_VERSION_FILE = os.getenv("KB_VERSION_FILE", "data/kb_version.txt")
+
+def _kb_version_path() -> str:
+    if os.path.isabs(KB_VERSION_FILE):
+        return KB_VERSION_FILE
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), KB_VERSION_FILE)
+
+def kb_version() -> str:
+    try:
+        with open(_kb_version_path(), "r", encoding="utf-8") as f:
+            return f.read().strip() or "0"
+    except OSError:
+        return "0"
+
+def bump_kb_version() -> str:
+    v = uuid.uuid4().hex
+    p = _kb_version_path()
+    os.makedirs(os.path.dirname(p), exist_ok=True)
+    with open(p, "w", encoding="utf-8") as f:
+        f.write(v)
+    return v
+
+def _doc_from_point(point, collection_name: str) -> Document:
+    # Same shape QdrantVectorStore returns (page_content/metadata payload keys)
+    payload = point.payload or {}
+    meta = dict(payload.get(QdrantVectorStore.METADATA_KEY) or {})
+    meta["_id"] = point.id
+    meta["_collection_name"] = collection_name
+    return Document(page_content=payload.get(QdrantVectorStore.CONTENT_KEY) or "", metadata=meta)
+
+def hybrid_search_batch(
+    dense_vecs,
+    sparse_vecs: list,
+    k: int,
+    filters: list[Filter | None],
+    collection_name: str = COLLECTION,
+) -> List[List[Document]]:
+    """N hybrid (dense + sparse, RRF-fused) searches in one query_batch_points round trip.
+    dense_vecs: float32 array (N, dim); sparse_vecs: objects with .indices/.values.
+    """
+    if len(filters) == 0:
+        return []
+    requests = []
+    for dv, sv, flt in zip(dense_vecs, sparse_vecs, filters):
+        requests.append(QueryRequest(
+            prefetch=[
+                Prefetch(query=dv.tolist(), using=DENSE_NAME, limit=k, filter=flt),
+                Prefetch(query=SparseVector(indices=list(sv.indices), values=list(sv.values)), using=SPARSE_NAME, limit=k, filter=flt),
+            ],
+            query=FusionQuery(fusion=Fusion.RRF),
+            limit=k,
+            with_payload=True,
+        ))
+    responses = get_qdrant_client().query_batch_points(collection_name=collection_name, requests=requests)  # timed as "qdrant"
+    return [[_doc_from_point(p, collection_name) for p in r.points] for r in responses]
 
 def add_documents(docs: List[Document], batch_size: int = 128, collection_name: str = COLLECTION) -> int:
+    """Upsert docs under deterministic chunk IDs (source path + content hash),
+    so re-adding the same chunk overwrites instead of duplicating.
+    """
     vs = get_vectorstore(collection_name=collection_name)
+    if all(d.metadata.get("chunk_id") for d in docs):
+        ids = [d.metadata["chunk_id"] for d in docs]  # already assigned over the full file(s)
+    else:
+        ids = assign_chunk_ids(docs)
     n = 0
     for i in range(0, len(docs), batch_size):
-        vs.add_documents(docs[i:i+batch_size])
+        vs.add_documents(docs[i:i+batch_size], ids=ids[i:i+batch_size])
         n += len(docs[i:i+batch_size])
+    if n:
+        get_token_index().add_documents(docs)
+        save_token_index()
+        bump_kb_version()
     return n
 
-def delete_by_source_path(abs_path: str, collection_name: str = COLLECTION) -> int:
+def existing_point_ids(collection_name: str = COLLECTION, page_size: int = 1024) -> set[str]:
+    """All point IDs currently in the collection (IDs only, no payload/vectors)."""
+    client = get_qdrant_client()
+    ids: set[str] = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=page_size, offset=offset,
+            with_payload=False, with_vectors=False,
+        )
+        ids.update(str(p.id) for p in points)
+        if offset is None:
+            break
+    return ids
+
+def _discard_tokens(ids: List[str]) -> None:
+    # Keep the lexical sidecar in step with the collection
+    if ids and get_token_index().discard(ids):
+        save_token_index()
+
+def delete_point_ids(ids: List[str], batch_size: int = 512, collection_name: str = COLLECTION) -> int:
+    client = get_qdrant_client()
+    for i in range(0, len(ids), batch_size):
+        client.delete(collection_name=collection_name, points_selector=PointIdsList(points=ids[i:i+batch_size]), wait=True)
+    if ids:
+        _discard_tokens(ids)
+        bump_kb_version()
+    return len(ids)
+
+def sync_documents(docs: List[Document], batch_size: int = 128, collection_name: str = COLLECTION, prune: bool = False) -> Dict[str, int]:
+    """Incremental re-index: embed + upsert only chunks whose ID is not already stored,
+    and (if prune) delete stored points that are no longer in `docs`.
+    `docs` must be the full KB for pruning to be safe.
+    """
+    ids = assign_chunk_ids(docs)
+    have = existing_point_ids(collection_name)
+    new_docs = [d for d, i in zip(docs, ids) if i not in have]
+    added = add_documents(new_docs, batch_size=batch_size, collection_name=collection_name) if new_docs else 0
+    deleted = delete_point_ids(list(have - set(ids)), batch_size=batch_size, collection_name=collection_name) if prune else 0
+    return {"added": added, "unchanged": len(docs) - len(new_docs), "deleted": deleted}
+
+def delete_by_source_path(abs_path: str, collection_name: str = COLLECTION, page_size: int = 1024) -> int:
     """Delete all points where payload.source_path == abs_path.
-    Returns an estimated number of deleted points (count before delete).
+    Returns the number of points matched before the delete.
     """
     client = get_qdrant_client()
-    flt = Filter(must=[FieldCondition(key="source_path", match=MatchValue(value=abs_path))])
-    try:
-        cnt = client.count(collection_name=collection_name, count_filter=flt, exact=True).count or 0
-    except Exception:
-        cnt = 0
+    flt = Filter(must=[FieldCondition(key=SOURCE_PATH_KEY, match=MatchValue(value=abs_path))])
+    # IDs first (no payload/vectors), so the token sidecar can drop the same chunks
+    ids: List[str] = []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, scroll_filter=flt, limit=page_size, offset=offset,
+            with_payload=False, with_vectors=False,
+        )
+        ids.extend(str(p.id) for p in points)
+        if offset is None:
+            break
     selector = FilterSelector(filter=flt)
     client.delete(collection_name=collection_name, points_selector=selector, wait=True)
-    return int(cnt)
+    if ids:
+        _discard_tokens(ids)
+        bump_kb_version()
+    return len(ids)
 
 def delete_by_source_paths(paths: list[str], collection_name: str = COLLECTION) -> int:
     total = 0
@@ -0,0 +1,175 @@
+# rag/reranker.py
+from __future__ import annotations
+import os
+import time
+import queue
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+# Cross-encoder sees at most this much of each chunk
+PAIR_TEXT_CHARS = 2048
+
+
+def _query_key(query: str) -> str:
+    return hashlib.sha256((query or "").encode("utf-8")).hexdigest()[:32]
+
+
+def _chunk_key(doc: Document) -> str:
+    # chunk_id is derived from content, so a changed chunk never reuses a stale score
+    cid = doc.metadata.get("chunk_id")
+    if cid:
+        return str(cid)
+    return hashlib.sha256(doc.page_content[:PAIR_TEXT_CHARS].encode("utf-8")).hexdigest()[:32]
+
+
+class RerankerService:
+    """Shared cross-encoder front end.
+    - Pair scores are cached (LRU) by (query hash, chunk id); only unseen pairs reach the model.
+    - Misses from concurrent callers are collected for up to `window_ms` (or `max_batch` pairs)
+      and scored in one predict() call on a single worker thread.
+    - stats(): cache hit rate and batch size distribution.
+    """
+    def __init__(self, model: Any, model_name: str, window_ms: float = 5.0, max_batch: int = 64, cache_entries: int = 50000):
+        self.model = model
+        self.model_name = model_name
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.cache_entries = cache_entries
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        self._q: "queue.Queue[Tuple[Tuple[str, str], Tuple[str, str], Future]]" = queue.Queue()
+        self.requests = 0
+        self.pairs = 0
+        self.hits = 0
+        self.batches = 0
+        self.batched_pairs = 0
+        self.max_batch_seen = 0
+        self._batch_sizes: Counter = Counter()
+        self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self._worker.start()
+
+    # ---- cache ----
+    def _cache_get(self, key: Tuple[str, str]) -> float | None:
+        score = self._cache.get(key)
+        if score is not None:
+            self._cache.move_to_end(key)
+        return score
+
+    def _cache_put(self, key: Tuple[str, str], score: float) -> None:
+        self._cache[key] = score
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    # ---- batching ----
+    def _run(self) -> None:
+        while True:
+            items = [self._q.get()]
+            end = time.monotonic() + self.window_s
+            # Collect whatever else arrives within the window, up to max_batch pairs
+            while len(items) < self.max_batch:
+                remaining = end - time.monotonic()
+                try:
+                    items.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+                except queue.Empty:
+                    break
+            self._score_batch(items)
+
+    def _score_batch(self, items: List[Tuple[Tuple[str, str], Tuple[str, str], Future]]) -> None:
+        try:
+            scores = self.model.predict([pair for _, pair, _ in items])
+        except Exception as e:
+            with self._lock:
+                for key, _, fut in items:
+                    self._pending.pop(key, None)
+            for _, _, fut in items:
+                fut.set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.batched_pairs += len(items)
+            self.max_batch_seen = max(self.max_batch_seen, len(items))
+            self._batch_sizes[len(items)] += 1
+            for (key, _, _), s in zip(items, scores):
+                self._cache_put(key, float(s))
+                self._pending.pop(key, None)
+        for (_, _, fut), s in zip(items, scores):
+            fut.set_result(float(s))
+
+    # ---- public ----
+    def score(self, query: str, docs: List[Document]) -> Tuple[List[float], int]:
+        """Scores for (query, doc) pairs in doc order, and how many came from the cache.
+        Blocks until the batch holding this request's misses has been scored.
+        """
+        qk = _query_key(query)
+        out: List[float | None] = [None] * len(docs)
+        waits: List[Tuple[int, Future]] = []
+        hits = 0
+        with self._lock:
+            self.requests += 1
+            self.pairs += len(docs)
+            for i, d in enumerate(docs):
+                key = (qk, _chunk_key(d))
+                cached = self._cache_get(key)
+                if cached is not None:
+                    out[i] = cached
+                    hits += 1
+                    continue
+                fut = self._pending.get(key)
+                if fut is None:
+                    # Not cached and not already queued by another request
+                    fut = Future()
+                    self._pending[key] = fut
+                    self._q.put((key, (query, d.page_content[:PAIR_TEXT_CHARS]), fut))
+                waits.append((i, fut))
+            self.hits += hits
+        for i, fut in waits:
+            out[i] = fut.result()
+        return [float(s) for s in out], hits
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "requests": self.requests,
+                "pairs": self.pairs,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.pairs, 4) if self.pairs else 0.0,
+                "entries": len(self._cache),
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched_pairs / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "batch_sizes": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            }
+
+
+@lru_cache(maxsize=1)
+def get_reranker() -> RerankerService | None:
+    """Process-wide reranker service around the cross-encoder (None when rerank is disabled/unavailable).
+    Controlled by env:
+      - RERANK_BATCH_WINDOW_MS (default 5): how long to wait for other requests' pairs
+      - RERANK_MAX_BATCH (default 64): pairs per predict() call
+      - RERANK_CACHE_MAX_ENTRIES (default 50000)
+    """
+    from rag.retrieval import _get_cross_encoder
+    model = _get_cross_encoder()
+    if model is None:
+        return None
+    return RerankerService(
+        model,
+        model_name=os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+        window_ms=float(os.getenv("RERANK_BATCH_WINDOW_MS", "5")),
+        max_batch=int(os.getenv("RERANK_MAX_BATCH", "64")),
+        cache_entries=int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "50000")),
+    )
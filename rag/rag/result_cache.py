@@ -0,0 +1,78 @@
+# rag/result_cache.py
+from __future__ import annotations
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict
+
+
+def make_result_key(**parts: Any) -> str:
+    """Stable hash of the request parts (JSON with sorted keys)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache for final responses.
+    Values are deep-copied in and out so callers can mutate what they get back.
+    """
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (self.ttl_s > 0 and time.monotonic() - item[0] > self.ttl_s):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(item[1])
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_result_cache() -> ResultCache | None:
+    """Process-wide classify response cache, configured by env:
+      - RESULT_CACHE=true|false (default true)
+      - RESULT_CACHE_MAX_ENTRIES (default 1024), RESULT_CACHE_TTL_S (default 3600, 0 = no expiry)
+    """
+    enabled = str(os.getenv("RESULT_CACHE", "true")).lower() in {"1", "true", "yes"}
+    if not enabled:
+        return None
+    return ResultCache(
+        max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024")),
+        ttl_s=float(os.getenv("RESULT_CACHE_TTL_S", "3600")),
+    )
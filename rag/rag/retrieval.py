@@ -1,11 +1,20 @@
 from __future__ import annotations
 from typing import Dict, Any, List
 import os
+import time
+import logging
 from functools import lru_cache
-from langchain_core.vectorstores import VectorStoreRetriever
-from rag.qdrant_store import get_vectorstore
+from langchain_core.retrievers import BaseRetriever
+from rag.qdrant_store import REGION_KEY, get_vectorstore, get_dense_embeddings, get_sparse_embeddings, hybrid_search_batch
 from qdrant_client.http.models import Filter, FieldCondition, MatchAny, MatchValue
 from langchain_core.documents import Document
+from rag.onnx_backend import backend_for, load_onnx_cross_encoder
+from rag.reranker import get_reranker
+from rag.metrics import observe
+from rag.token_index import get_token_index
+from rag.local_index import RRF_K, LocalHybridRetriever, get_local_index, vector_backend
+
+logger = logging.getLogger(__name__)
 
 # Optional cross-encoder reranker (sentence-transformers). Fallback to a simple lexical score.
 try:
@@ -17,19 +26,21 @@ def _build_filter(regions: list[str] | None):
     if not regions:
         return None
     if len(regions) == 1:
-        cond = FieldCondition(key="region", match=MatchValue(value=regions[0]))
+        cond = FieldCondition(key=REGION_KEY, match=MatchValue(value=regions[0]))
     else:
-        cond = FieldCondition(key="region", match=MatchAny(any=regions))
+        cond = FieldCondition(key=REGION_KEY, match=MatchAny(any=regions))
     return Filter(must=[cond])
 
 
-def get_hybrid_retriever(k: int = 5, mmr: bool = False, regions: list[str] | None = None) -> VectorStoreRetriever:
+def get_hybrid_retriever(k: int = 5, mmr: bool = False, regions: list[str] | None = None) -> BaseRetriever:
     """
-    Returns a retriever over Qdrant hybrid store.
+    Returns a retriever over the hybrid store (Qdrant, or the in-process index when VECTOR_BACKEND=local).
     - k: top-k docs
     - mmr: enable Maximal Marginal Relevance (diverse results)
     - regions: optional list of region codes to filter results (e.g., ["US-UT", "US"]).
     """
+    if vector_backend() == "local":
+        return LocalHybridRetriever(index=get_local_index(), k=k, mmr=mmr, regions=regions or None)
     vs = get_vectorstore()
     flt = _build_filter(regions)
     if mmr:
@@ -53,11 +64,17 @@ def _get_cross_encoder():
     Controlled by env:
       - ENABLE_RERANK=true|false (default true)
       - RERANK_MODEL=cross-encoder/ms-marco-MiniLM-L-6-v2 (default)
+      - RERANK_BACKEND=torch|onnx (default torch; onnx falls back to torch if it can't load)
     """
     enabled = str(os.getenv("ENABLE_RERANK", "true")).lower() in {"1", "true", "yes"}
     if not enabled or CrossEncoder is None:
         return None
     model_name = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    if backend_for("rerank") == "onnx":
+        try:
+            return load_onnx_cross_encoder(model_name)
+        except Exception as e:
+            logger.warning("ONNX rerank backend unavailable (%s); falling back to torch", e)
     try:
         return CrossEncoder(model_name)
     except Exception:
@@ -65,21 +82,27 @@ def _get_cross_encoder():
 
 
 def _lexical_scores(query: str, docs: List[Document]) -> List[float]:
-    import re
-    q_tokens = set(re.findall(r"\w+", (query or "").lower()))
-    scores: List[float] = []
-    for d in docs:
-        t = set(re.findall(r"\w+", (d.page_content or "").lower()))
-        inter = len(q_tokens & t)
-        denom = max(1, len(q_tokens) + len(t) - inter)
-        scores.append(inter / denom)
-    return scores
+    """Token-overlap score per doc from the precomputed token index.
+    LEXICAL_SCORER=jaccard (default) | bm25.
+    """
+    method = os.getenv("LEXICAL_SCORER", "jaccard").strip().lower()
+    return get_token_index().scores(query, docs, method=method).tolist()
 
 
 def rerank_with_info(query: str, docs: List[Document], top_k: int | None = None) -> tuple[List[Document], Dict[str, Any]]:
-    """Return reranked docs and an info dict: {method, model?, scores[]}.
+    """Return reranked docs and an info dict: {method, model?, scores[], elapsed_ms}.
     If rerank disabled or unavailable, method is 'disabled' and docs unchanged.
     """
+    t0 = time.perf_counter()
+    ranked, info = _rerank(query, docs, top_k)
+    if info.get("method") != "disabled":
+        elapsed = time.perf_counter() - t0
+        observe("rerank", elapsed)
+        info["elapsed_ms"] = round(elapsed * 1000, 2)
+    return ranked, info
+
+
+def _rerank(query: str, docs: List[Document], top_k: int | None) -> tuple[List[Document], Dict[str, Any]]:
     info: Dict[str, Any] = {"method": "disabled"}
     if not docs:
         return docs, info
@@ -87,16 +110,22 @@ def rerank_with_info(query: str, docs: List[Document], top_k: int | None = None)
     if not enabled:
         return docs, info
     k = top_k or len(docs)
-    ce = _get_cross_encoder()
-    if ce is not None:
-        pairs = [(query, d.page_content[:2048]) for d in docs]
+    reranker = get_reranker()
+    if reranker is not None:
+        # Optional cheap lexical cut before the cross-encoder (RERANK_PREFILTER_K, 0 = off)
+        prefilter = int(os.getenv("RERANK_PREFILTER_K", "0"))
+        if prefilter > 0 and max(prefilter, k) < len(docs):
+            lex = _lexical_scores(query, docs)
+            keep = sorted(range(len(docs)), key=lambda i: lex[i], reverse=True)[:max(prefilter, k)]
+            docs = [docs[i] for i in sorted(keep)]
         try:
-            scores = ce.predict(pairs)
+            scores, cached = reranker.score(query, docs)
             ranked = sorted(zip(docs, scores), key=lambda x: float(x[1]), reverse=True)
             info = {
                 "method": "cross_encoder",
-                "model": os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                "model": reranker.model_name,
                 "scores": [float(s) for _, s in ranked[:k]],
+                "cached_pairs": cached,
             }
             return [d for d, _ in ranked[:k]], info
         except Exception:
@@ -111,3 +140,127 @@ def rerank_with_info(query: str, docs: List[Document], top_k: int | None = None)
 def rerank_docs(query: str, docs: List[Document], top_k: int | None = None) -> List[Document]:
     ranked, _ = rerank_with_info(query, docs, top_k=top_k)
     return ranked
+
+
+# --------- Region-aware retrieval (single pass) ---------
+
+def retrieve_with_fallback(
+    query: str,
+    k: int = 5,
+    mmr: bool = False,
+    regions: list[str] | None = None,
+) -> tuple[List[Document], Dict[str, Any], bool]:
+    """Retrieve + rerank once, region-aware.
+    Returns (docs, rerank_info, filtered_used). The docs are meant to be reused
+    both as LLM context and as provenance so the two never diverge.
+    Non-MMR: one round trip with a search per region plus an unfiltered one (see retrieve_many).
+    MMR: regions filter → each region solo → unfiltered, then a region post-filter on the
+    unfiltered result when possible.
+    """
+    if not mmr:
+        return retrieve_many([query], k=k, mmr=False, regions_list=[regions or None])[0]
+    filtered_used = bool(regions)
+    docs: List[Document] = get_hybrid_retriever(k=k, mmr=mmr, regions=regions or None).invoke(query)
+    # Fallbacks: try each region solo, then drop filter entirely
+    if not docs and regions:
+        for r in regions:
+            docs = get_hybrid_retriever(k=k, mmr=mmr, regions=[r]).invoke(query)
+            if docs:
+                filtered_used = True
+                break
+    if not docs:
+        docs = get_hybrid_retriever(k=k, mmr=mmr, regions=None).invoke(query)
+        if docs:
+            filtered_used = False
+    return _finalize_retrieval(query, docs, k, regions, filtered_used)
+
+
+def _doc_key(d: Document) -> str:
+    m = d.metadata or {}
+    return str(m.get("chunk_id") or m.get("_id") or hash(d.page_content))
+
+
+def _fuse_region_lists(lists: List[List[Document]], k: int) -> List[Document]:
+    """RRF over per-region candidate lists: each matching region's best chunks are
+    interleaved (ties keep region order) instead of one region crowding out the rest.
+    """
+    scores: Dict[str, float] = {}
+    first: Dict[str, Document] = {}
+    for docs in lists:
+        for rank, d in enumerate(docs):
+            key = _doc_key(d)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rank + RRF_K)
+            first.setdefault(key, d)
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [first[key] for key in ranked[:k]]
+
+
+def _finalize_retrieval(
+    query: str,
+    docs: List[Document],
+    k: int,
+    regions: list[str] | None,
+    filtered_used: bool,
+) -> tuple[List[Document], Dict[str, Any], bool]:
+    rerank_info: Dict[str, Any] = {"method": "disabled"}
+    if docs:
+        try:
+            docs, rerank_info = rerank_with_info(query, docs, top_k=k)
+        except Exception:
+            rerank_info = {"method": "error"}
+    # Post-filter safeguard: if we had to drop the store filter,
+    # keep only matching regions from retrieved docs when possible.
+    if docs and regions and not filtered_used:
+        docs_filtered = [d for d in docs if (d.metadata or {}).get("region") in regions]
+        if docs_filtered:
+            docs = docs_filtered[:k]
+            filtered_used = True
+    return docs, rerank_info, filtered_used
+
+
+def retrieve_many(
+    queries: List[str],
+    k: int = 5,
+    mmr: bool = False,
+    regions_list: List[list[str] | None] | None = None,
+) -> List[tuple[List[Document], Dict[str, Any], bool]]:
+    """retrieve_with_fallback for several queries; output order matches input order.
+    Non-MMR path: one batched BGE-M3 encode for all queries, then a single query_batch_points
+    call (or one matmul over the local index) holding, per query, one search per inferred
+    region plus one unfiltered search. Regions with hits are fused (_fuse_region_lists);
+    the unfiltered list is used only when no region matched.
+    """
+    regions_list = regions_list or [None] * len(queries)
+    if mmr or not queries:
+        return [retrieve_with_fallback(q, k=k, mmr=mmr, regions=r) for q, r in zip(queries, regions_list)]
+
+    dense = get_dense_embeddings().embed_queries(queries)
+    sparse_enc = get_sparse_embeddings()
+    sparse = [sparse_enc.embed_query(q) for q in queries]
+
+    def _search(idx: List[int], regions_per: List[list[str] | None]) -> List[List[Document]]:
+        if vector_backend() == "local":
+            return get_local_index().search_batch(dense[idx], [sparse[i] for i in idx], k, regions_per)
+        return hybrid_search_batch(dense[idx], [sparse[i] for i in idx], k, [_build_filter(r) for r in regions_per])
+
+    n = len(queries)
+    plan: List[tuple[int, list[str] | None]] = []
+    for i, regions in enumerate(regions_list):
+        plan.extend((i, [r]) for r in (regions or []))
+        plan.append((i, None))
+    per_region: List[List[List[Document]]] = [[] for _ in range(n)]
+    unfiltered: List[List[Document]] = [[] for _ in range(n)]
+    for (i, regions), docs in zip(plan, _search([i for i, _ in plan], [r for _, r in plan])):
+        if regions is None:
+            unfiltered[i] = docs
+        elif docs:
+            per_region[i].append(docs)
+
+    out = []
+    for i in range(n):
+        if per_region[i]:
+            docs, filtered_used = _fuse_region_lists(per_region[i], k), True
+        else:
+            docs, filtered_used = unfiltered[i], False
+        out.append(_finalize_retrieval(queries[i], docs, k, regions_list[i], filtered_used))
+    return out
@@ -0,0 +1,188 @@
+# rag/token_index.py
+from __future__ import annotations
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Same tokenization the lexical rerank fallback always used
+_TOKEN_RE = re.compile(r"\w+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class TokenIndex:
+    """Per-chunk token-id arrays for lexical scoring without re-tokenizing chunk text.
+    - Each chunk: sorted unique token ids (int32) + their term counts, keyed by chunk_id.
+    - Built at indexing time and saved as a sidecar .npz (CSR layout); chunks missing from it
+      are tokenized once on first sight and kept in memory. Deleted chunks are dropped via discard().
+    - Scores for a candidate set are computed in one vectorized pass (Jaccard or BM25).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.vocab: Dict[str, int] = {}
+        self.rows: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.df = np.zeros(1024, dtype=np.int32)
+        self.total_len = 0
+
+    # ---- build ----
+    def _ids(self, tokens: Iterable[str], grow: bool) -> np.ndarray:
+        out = []
+        for t in tokens:
+            i = self.vocab.get(t)
+            if i is None and grow:
+                i = self.vocab[t] = len(self.vocab)
+            if i is not None:
+                out.append(i)
+        return np.asarray(out, dtype=np.int32)
+
+    def _add_locked(self, key: str, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        old = self.rows.get(key)
+        if old is not None:
+            return old
+        ids, counts = np.unique(self._ids(tokenize(text), grow=True), return_counts=True)
+        row = (ids.astype(np.int32), counts.astype(np.int32))
+        if len(self.vocab) > len(self.df):
+            self.df = np.concatenate([self.df, np.zeros(max(len(self.vocab), 2 * len(self.df)) - len(self.df), dtype=np.int32)])
+        self.df[row[0]] += 1
+        self.total_len += int(row[1].sum())
+        self.rows[key] = row
+        return row
+
+    def add(self, key: str, text: str) -> None:
+        with self._lock:
+            self._add_locked(key, text)
+
+    def add_documents(self, docs: Iterable[Document]) -> int:
+        n = 0
+        with self._lock:
+            for d in docs:
+                key = d.metadata.get("chunk_id")
+                if key:
+                    self._add_locked(str(key), d.page_content)
+                    n += 1
+        return n
+
+    def discard(self, keys: Iterable[str]) -> int:
+        """Drop rows (and their df / length contributions); returns how many were present."""
+        n = 0
+        with self._lock:
+            for key in keys:
+                row = self.rows.pop(str(key), None)
+                if row is None:
+                    continue
+                self.df[row[0]] -= 1
+                self.total_len -= int(row[1].sum())
+                n += 1
+        return n
+
+    # ---- persistence (CSR) ----
+    def save(self, path: str) -> None:
+        with self._lock:
+            keys = list(self.rows.keys())
+            lens = np.fromiter((len(self.rows[k][0]) for k in keys), dtype=np.int64, count=len(keys))
+            indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+            np.cumsum(lens, out=indptr[1:])
+            ids = np.concatenate([self.rows[k][0] for k in keys]) if keys else np.zeros(0, dtype=np.int32)
+            counts = np.concatenate([self.rows[k][1] for k in keys]) if keys else np.zeros(0, dtype=np.int32)
+            vocab = np.array(sorted(self.vocab, key=self.vocab.get), dtype=object)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, keys=np.array(keys, dtype=object), indptr=indptr, ids=ids, counts=counts, vocab=vocab)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TokenIndex":
+        idx = cls()
+        z = np.load(path, allow_pickle=True)
+        idx.vocab = {str(t): i for i, t in enumerate(z["vocab"])}
+        idx.df = np.zeros(max(1024, len(idx.vocab)), dtype=np.int32)
+        indptr, ids, counts = z["indptr"], z["ids"], z["counts"]
+        for j, key in enumerate(z["keys"]):
+            row = (ids[indptr[j]:indptr[j + 1]], counts[indptr[j]:indptr[j + 1]])
+            idx.rows[str(key)] = row
+        if len(ids):
+            idx.df[: len(idx.vocab)] = np.bincount(ids, minlength=len(idx.vocab))
+        idx.total_len = int(counts.sum())
+        return idx
+
+    # ---- scoring ----
+    def _rows_for(self, docs: List[Document]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        with self._lock:
+            rows = []
+            for d in docs:
+                key = d.metadata.get("chunk_id") or f"text:{hash(d.page_content)}"
+                row = self.rows.get(str(key))
+                rows.append(row if row is not None else self._add_locked(str(key), d.page_content))
+            return rows
+
+    def scores(self, query: str, docs: List[Document], method: str = "jaccard") -> np.ndarray:
+        """Lexical score per doc (float32, doc order). method: "jaccard" | "bm25"."""
+        n = len(docs)
+        if not n:
+            return np.zeros(0, dtype=np.float32)
+        rows = self._rows_for(docs)
+        q_tokens = set(tokenize(query))
+        q_ids = np.unique(self._ids(q_tokens, grow=False))
+        lens = np.fromiter((len(r[0]) for r in rows), dtype=np.int64, count=n)
+        ids = np.concatenate([r[0] for r in rows])
+        counts = np.concatenate([r[1] for r in rows])
+        seg = np.repeat(np.arange(n), lens)
+        hit = np.isin(ids, q_ids, assume_unique=False)
+        if method == "bm25":
+            n_docs = max(1, len(self.rows))
+            avgdl = self.total_len / n_docs if self.total_len else 1.0
+            dl = np.bincount(seg, weights=counts, minlength=n)
+            tf = counts[hit].astype(np.float64)
+            df = self.df[ids[hit]].astype(np.float64)
+            idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * dl[seg[hit]] / avgdl)
+            return np.bincount(seg[hit], weights=idf * tf * (BM25_K1 + 1) / (tf + norm), minlength=n).astype(np.float32)
+        # Jaccard over token sets; unknown query tokens still count toward |q|
+        inter = np.bincount(seg[hit], minlength=n)
+        denom = np.maximum(1, len(q_tokens) + lens - inter)
+        return (inter / denom).astype(np.float32)
+
+
+def _index_path() -> str:
+    path = os.getenv("TOKEN_INDEX_PATH", "data/kb_chunks/token_index.npz")
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), path)
+    return path
+
+
+@lru_cache(maxsize=1)
+def get_token_index() -> TokenIndex:
+    """Process-wide index; loads the sidecar at TOKEN_INDEX_PATH (default data/kb_chunks/token_index.npz) if present."""
+    path = _index_path()
+    if os.path.exists(path):
+        try:
+            return TokenIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+    return TokenIndex()
+
+
+def save_token_index() -> str:
+    path = _index_path()
+    get_token_index().save(path)
+    return path
+
+
+def rebuild_token_index(docs: Iterable[Document]) -> Tuple[str, int]:
+    """Replace the sidecar with one built from `docs` (the full KB); returns (path, chunks)."""
+    idx = TokenIndex()
+    n = idx.add_documents(docs)
+    path = _index_path()
+    idx.save(path)
+    get_token_index.cache_clear()
+    return path, n
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""Parity and cost check: torch vs ONNX Runtime (int8 by default) for BGE-M3 dense embeddings and the reranker.
+
+Each backend runs in its own subprocess so memory numbers are not mixed:
+  python scripts/bench_backends.py --chunks data/chunks.jsonl --queries data/test_dataset.csv
+
+Reports per backend: model load time, RSS after load and peak RSS, query/document encode latency,
+rerank latency. Parity (onnx vs torch):
+  dense:  per-text cosine (min / mean) and top-k neighbour agreement over the sample chunks
+  rerank: Spearman rank correlation of scores per query and top-1 agreement
+Exits 1 when dense min cosine < --min_cos or mean rerank Spearman < --min_spearman.
+ONNX settings come from env (ONNX_QUANTIZE, ONNX_QUANT_CONFIG, ONNX_THREADS); see rag/onnx_backend.py.
+"""
+from __future__ import annotations
+import os, sys, csv, json, time, subprocess, tempfile
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("EMBED_CACHE", "false")  # measure real encode cost
+
+import numpy as np
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return 0.0
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def _pct(xs: list[float], q: float) -> float:
+    return round(float(np.percentile(xs, q)), 2) if xs else 0.0
+
+def _load_queries(path: str, n: int) -> list[str]:
+    out = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            text = f"{(r.get('feature_name') or '').strip()}\n\n{(r.get('feature_description') or '').strip()}".strip()
+            if text:
+                out.append(text)
+            if len(out) >= n:
+                break
+    return out
+
+def _load_chunks(path: str, n: int) -> list[str]:
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                out.append(json.loads(line)["text"].strip())
+            if len(out) >= n:
+                break
+    return out
+
+
+# ---------- worker (one backend per process) ----------
+
+def _worker(backend: str, args, out_path: str) -> None:
+    os.environ["EMBED_BACKEND"] = backend
+    os.environ["RERANK_BACKEND"] = backend
+    from rag.embeddings import BGEM3DenseEmbeddings
+    from rag.retrieval import _get_cross_encoder
+
+    queries = _load_queries(args.queries, args.n_queries)
+    chunks = _load_chunks(args.chunks, args.n_chunks)
+    stats = {"backend": backend, "rss_start_mb": round(_rss_mb(), 1)}
+
+    t = time.perf_counter()
+    emb = BGEM3DenseEmbeddings(with_sparse=False, backend=backend)
+    ce = _get_cross_encoder() if args.rerank else None
+    stats["load_s"] = round(time.perf_counter() - t, 2)
+    stats["rss_after_load_mb"] = round(_rss_mb(), 1)
+    emb.embed_queries(["warmup"])
+
+    q_ms = []
+    qv = []
+    for q in queries:
+        t = time.perf_counter()
+        qv.append(emb.embed_queries([q])[0])
+        q_ms.append((time.perf_counter() - t) * 1000)
+    t = time.perf_counter()
+    dv = np.asarray(emb.embed_documents(chunks), dtype=np.float32)
+    doc_s = time.perf_counter() - t
+    stats.update({
+        "query_ms_p50": _pct(q_ms, 50), "query_ms_p95": _pct(q_ms, 95),
+        "docs_per_s": round(len(chunks) / doc_s, 2) if doc_s > 0 else 0.0,
+    })
+
+    scores = np.zeros((0, 0), dtype=np.float32)
+    if ce is not None and chunks:
+        cand = chunks[: args.rerank_k]
+        r_ms, rows = [], []
+        for q in queries:
+            t = time.perf_counter()
+            rows.append(np.asarray(ce.predict([(q, c[:2048]) for c in cand]), dtype=np.float32))
+            r_ms.append((time.perf_counter() - t) * 1000)
+        scores = np.stack(rows) if rows else scores
+        stats.update({"rerank_pairs": len(cand), "rerank_ms_p50": _pct(r_ms, 50), "rerank_ms_p95": _pct(r_ms, 95)})
+
+    stats["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    np.savez(out_path, q=np.asarray(qv, dtype=np.float32), d=dv, r=scores)
+    with open(out_path + ".json", "w", encoding="utf-8") as f:
+        json.dump(stats, f)
+
+
+# ---------- parity ----------
+
+def _cos_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / (np.linalg.norm(a, axis=1, keepdims=True) + 1e-12)
+    b = b / (np.linalg.norm(b, axis=1, keepdims=True) + 1e-12)
+    return (a * b).sum(axis=1)
+
+def _spearman(x: np.ndarray, y: np.ndarray) -> float:
+    rx = np.argsort(np.argsort(x)).astype(np.float64)
+    ry = np.argsort(np.argsort(y)).astype(np.float64)
+    if rx.std() == 0 or ry.std() == 0:
+        return 1.0
+    return float(np.corrcoef(rx, ry)[0, 1])
+
+def _topk_agreement(qa, da, qb, db, k: int) -> float:
+    if not len(qa) or not len(da):
+        return 1.0
+    k = min(k, len(da))
+    ta = np.argsort(-(qa @ da.T), axis=1)[:, :k]
+    tb = np.argsort(-(qb @ db.T), axis=1)[:, :k]
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(ta, tb)]))
+
+def _parity(ref, cand, k: int) -> dict:
+    out = {}
+    vecs = np.concatenate([ref["q"], ref["d"]]) if len(ref["d"]) else ref["q"]
+    vecs_c = np.concatenate([cand["q"], cand["d"]]) if len(cand["d"]) else cand["q"]
+    cos = _cos_rows(vecs, vecs_c)
+    out["dense_cos_min"] = round(float(cos.min()), 5) if len(cos) else None
+    out["dense_cos_mean"] = round(float(cos.mean()), 5) if len(cos) else None
+    out[f"dense_top{k}_agreement"] = round(_topk_agreement(ref["q"], ref["d"], cand["q"], cand["d"], k), 4)
+    if ref["r"].size and cand["r"].size:
+        sp = [_spearman(a, b) for a, b in zip(ref["r"], cand["r"])]
+        out["rerank_spearman_mean"] = round(float(np.mean(sp)), 4)
+        out["rerank_top1_agreement"] = round(float(np.mean(ref["r"].argmax(1) == cand["r"].argmax(1))), 4)
+        out["rerank_max_abs_diff"] = round(float(np.abs(ref["r"] - cand["r"]).max()), 4)
+    return out
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--queries", default="data/test_dataset.csv")
+    ap.add_argument("--chunks", default="data/chunks.jsonl")
+    ap.add_argument("--n_queries", type=int, default=50)
+    ap.add_argument("--n_chunks", type=int, default=256)
+    ap.add_argument("--rerank_k", type=int, default=20, help="Candidates scored per query by the reranker")
+    ap.add_argument("--no_rerank", dest="rerank", action="store_false")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--min_cos", type=float, default=0.98)
+    ap.add_argument("--min_spearman", type=float, default=0.9)
+    ap.add_argument("--worker", choices=["torch", "onnx"], help=argparse.SUPPRESS)
+    ap.add_argument("--out", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        _worker(args.worker, args, args.out)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("torch", "onnx"):
+            out = os.path.join(tmp, f"{backend}.npz")
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker", backend, "--out", out,
+                   "--queries", args.queries, "--chunks", args.chunks, "--n_queries", str(args.n_queries),
+                   "--n_chunks", str(args.n_chunks), "--rerank_k", str(args.rerank_k)]
+            if not args.rerank:
+                cmd.append("--no_rerank")
+            subprocess.run(cmd, check=True, cwd=ROOT)
+            with open(out + ".json", encoding="utf-8") as f:
+                stats = json.load(f)
+            arrays = dict(np.load(out))
+            results[backend] = (stats, arrays)
+
+    parity = _parity(results["torch"][1], results["onnx"][1], args.k)
+    report = {
+        "onnx": {"quantize": os.getenv("ONNX_QUANTIZE", "int8"), "threads": os.getenv("ONNX_THREADS", "0")},
+        "torch": results["torch"][0],
+        "onnx_run": results["onnx"][0],
+        "parity": parity,
+    }
+    print(json.dumps(report, indent=2))
+
+    ok = parity.get("dense_cos_min") is None or parity["dense_cos_min"] >= args.min_cos
+    if "rerank_spearman_mean" in parity:
+        ok = ok and parity["rerank_spearman_mean"] >= args.min_spearman
+    if not ok:
+        print("PARITY FAILED", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
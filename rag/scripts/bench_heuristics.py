@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Micro-benchmark: rule heuristics, per-regex scan vs the single-pass matcher.
+
+The legacy path is what /classify_auto used to do per request: auto_rule_hits() (25 regex
+searches) and then infer_regions() (the same 25 searches again). The new path is one
+match_rules() call, timed both cold (cache cleared every row) and warm (cached per text).
+Also asserts that tags and regions are identical for every row; exits 1 if not.
+
+  python scripts/bench_heuristics.py --csv data/test_dataset.csv --repeat 200
+"""
+from __future__ import annotations
+import os, sys, csv, json, time, argparse
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from rag.heuristics import _COMPILED, _REGION_TAGS, _regions_for, match_rules
+
+
+def _legacy_hits(text: str) -> list[str]:
+    hits = set()
+    for rx, tag in _COMPILED:
+        if rx.search(text or ""):
+            hits.add(tag)
+            if tag in _REGION_TAGS:
+                hits.add("legal_cue")
+    return sorted(hits)
+
+def _legacy(text: str) -> tuple[list[str], list[str]]:
+    return _legacy_hits(text), _regions_for(set(_legacy_hits(text)))
+
+def _load_texts(path: str) -> list[str]:
+    out = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            text = f"{(r.get('feature_name') or '').strip()}\n\n{(r.get('feature_description') or '').strip()}".strip()
+            if text:
+                out.append(text)
+    return out
+
+def _time(fn, texts: list[str], repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for t in texts:
+            fn(t)
+    return (time.perf_counter() - t0) * 1e6 / (repeat * len(texts))
+
+def _cold(text: str):
+    match_rules.cache_clear()
+    return match_rules(text)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", default="data/test_dataset.csv")
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    texts = _load_texts(args.csv)
+    if not texts:
+        print("No rows to benchmark")
+        return
+
+    mismatches = []
+    for t in texts:
+        tags, regions = _legacy(t)
+        m = match_rules(t)
+        if tags != list(m.tags) or regions != list(m.regions):
+            mismatches.append({"text": t[:80], "legacy": [tags, regions], "single_pass": [list(m.tags), list(m.regions)]})
+
+    legacy_us = _time(_legacy, texts, args.repeat)
+    cold_us = _time(_cold, texts, args.repeat)
+    match_rules.cache_clear()
+    warm_us = _time(match_rules, texts, args.repeat)
+    print(json.dumps({
+        "rows": len(texts),
+        "repeat": args.repeat,
+        "legacy_us_per_row": round(legacy_us, 2),
+        "single_pass_cold_us_per_row": round(cold_us, 2),
+        "single_pass_warm_us_per_row": round(warm_us, 2),
+        "speedup_cold": round(legacy_us / cold_us, 2) if cold_us else None,
+        "speedup_warm": round(legacy_us / warm_us, 2) if warm_us else None,
+        "mismatches": mismatches,
+    }, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
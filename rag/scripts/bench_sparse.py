@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Compare hybrid retrieval with dense+BM25 (two models) vs BGE-M3 dense+lexical (one pass).
+
+Prerequisite: the same chunks indexed into two collections, e.g.
+  SPARSE_MODE=bm25   python scripts/create_collection.py --collection laws      && SPARSE_MODE=bm25   QDRANT_COLLECTION=laws    python scripts/index_kb.py --collection laws
+  SPARSE_MODE=bge_m3 python scripts/create_collection.py --collection laws_m3   && SPARSE_MODE=bge_m3 QDRANT_COLLECTION=laws_m3 python scripts/index_kb.py --collection laws_m3
+
+There are no relevance labels, so recall is proxied by region agreement with the heuristics:
+  region_hit@k  = share of queries with >=1 top-k chunk from an inferred region
+  region_prec@k = share of top-k chunks from an inferred region
+plus top-k overlap between the two setups and per-query encode/search latency.
+"""
+from __future__ import annotations
+import os, sys, csv, json, time
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("EMBED_CACHE", "false")  # measure real encode cost
+
+import numpy as np
+from rag.embeddings import BGEM3DenseEmbeddings, BGEM3SparseEmbeddings
+from rag.qdrant_store import CachedFastEmbedSparse, hybrid_search_batch
+from rag.heuristics import infer_regions
+
+
+def _load_queries(path: str) -> list[str]:
+    out = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            text = f"{(r.get('feature_name') or '').strip()}\n\n{(r.get('feature_description') or '').strip()}".strip()
+            if text:
+                out.append(text)
+    return out
+
+def _pct(xs: list[float], q: float) -> float:
+    return round(float(np.percentile(xs, q)), 2) if xs else 0.0
+
+def _summary(enc_ms, search_ms, hits, precs) -> dict:
+    return {
+        "encode_ms_mean": round(float(np.mean(enc_ms)), 2), "encode_ms_p50": _pct(enc_ms, 50), "encode_ms_p95": _pct(enc_ms, 95),
+        "search_ms_mean": round(float(np.mean(search_ms)), 2), "search_ms_p95": _pct(search_ms, 95),
+        "region_hit@k": round(float(np.mean(hits)), 4) if hits else None,
+        "region_prec@k": round(float(np.mean(precs)), 4) if precs else None,
+    }
+
+def _doc_key(d) -> str:
+    return d.metadata.get("chunk_id") or str(d.metadata.get("_id"))
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--queries", default="data/test_dataset.csv")
+    ap.add_argument("--bm25_collection", default="laws")
+    ap.add_argument("--m3_collection", default="laws_m3")
+    ap.add_argument("--k", type=int, default=5)
+    args = ap.parse_args()
+
+    queries = _load_queries(args.queries)
+    dense_a = BGEM3DenseEmbeddings(with_sparse=False)
+    bm25 = CachedFastEmbedSparse(model_name="Qdrant/bm25")
+    dense_b = BGEM3DenseEmbeddings(with_sparse=True)
+    lexical = BGEM3SparseEmbeddings(dense_b)
+    dense_a.embed_queries(["warmup"]); bm25.embed_query("warmup"); lexical.embed_query("warmup")
+
+    res = {"bm25": ([], [], [], []), "bge_m3": ([], [], [], [])}
+    overlaps = []
+    for q in queries:
+        regions = set(infer_regions(q))
+        tops = {}
+        for name, coll in (("bm25", args.bm25_collection), ("bge_m3", args.m3_collection)):
+            t = time.perf_counter()
+            if name == "bm25":
+                dv = dense_a.embed_queries([q]); sv = bm25.embed_query(q)
+            else:
+                dv = dense_b.embed_queries([q]); sv = lexical.embed_query(q)  # sparse is a stash lookup
+            enc = (time.perf_counter() - t) * 1000
+            t = time.perf_counter()
+            docs = hybrid_search_batch(dv, [sv], args.k, [None], collection_name=coll)[0]
+            srch = (time.perf_counter() - t) * 1000
+            enc_ms, search_ms, hits, precs = res[name]
+            enc_ms.append(enc); search_ms.append(srch)
+            if regions:
+                match = [(d.metadata.get("region") in regions) for d in docs]
+                hits.append(float(any(match)))
+                precs.append(sum(match) / max(1, len(match)))
+            tops[name] = {_doc_key(d) for d in docs}
+        union = tops["bm25"] | tops["bge_m3"]
+        overlaps.append(len(tops["bm25"] & tops["bge_m3"]) / len(union) if union else 1.0)
+
+    report = {
+        "queries": len(queries), "k": args.k,
+        "dense+bm25": _summary(*res["bm25"]),
+        "bge_m3 dense+lexical": _summary(*res["bge_m3"]),
+        "topk_jaccard_mean": round(float(np.mean(overlaps)), 4) if overlaps else None,
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,33 @@ if ROOT not in sys.path:
 # ----------------------------------------------------------------
 
 import argparse
+from typing import Iterable, Iterator
+from langchain_core.documents import Document
 from rag.config import get_config
-from rag.chunking import chunk_directory, export_jsonl_and_meta
+from rag.chunking import iter_chunk_directory, export_jsonl_and_meta
+
+def tee_to_index(docs: Iterable[Document], collection: str, batch: int = 128, prune: bool = False) -> Iterator[Document]:
+    """Pass docs through unchanged while upserting new/changed chunks into Qdrant in batches.
+    Chunks already stored (same deterministic ID) are skipped; with prune, vanished ones are deleted at the end.
+    """
+    from rag.qdrant_store import add_documents, existing_point_ids, delete_point_ids
+    have = existing_point_ids(collection)
+    seen: set[str] = set()
+    pending: list[Document] = []
+    added = 0
+    for d in docs:
+        cid = d.metadata["chunk_id"]
+        seen.add(cid)
+        if cid not in have:
+            pending.append(d)
+            if len(pending) >= batch:
+                added += add_documents(pending, batch_size=batch, collection_name=collection)
+                pending = []
+        yield d
+    if pending:
+        added += add_documents(pending, batch_size=batch, collection_name=collection)
+    deleted = delete_point_ids(list(have - seen), collection_name=collection) if prune else 0
+    print(f"   Indexed -> '{collection}': added {added}, unchanged {len(seen) - added}, deleted {deleted}")
 
 def main():
     cfg = get_config()
@@ -23,9 +48,14 @@ def main():
     parser.add_argument("--chunk_chars", type=int, default=cfg.recursive_chunk_chars)
     parser.add_argument("--overlap_chars", type=int, default=cfg.recursive_overlap_chars)
     parser.add_argument("--no_skip_references", action="store_true", help="Include 'References' sections if set")
+    parser.add_argument("--workers", type=int, default=None, help="Chunking processes (default: CHUNK_WORKERS or CPU count)")
+    parser.add_argument("--index", action="store_true", help="Also stream chunks straight into Qdrant (incremental)")
+    parser.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION", "laws"))
+    parser.add_argument("--batch", type=int, default=128)
+    parser.add_argument("--prune", action="store_true", help="With --index, delete points whose chunk no longer exists under raw_dir")
     args = parser.parse_args()
 
-    docs = chunk_directory(
+    docs = iter_chunk_directory(
         raw_dir=args.raw_dir,
         headers=[("#","h1"),("##","h2"),("###","h3")],
         max_header_chunk_chars=args.max_header_chars,
@@ -33,9 +63,12 @@ def main():
         recursive_overlap_chars=args.overlap_chars,
         manifest_csv=args.manifest,
         skip_reference_sections=not args.no_skip_references,
+        workers=args.workers,
     )
-    export_jsonl_and_meta(docs, out_jsonl=args.out_jsonl, out_meta_csv=args.out_meta_csv)
-    print(f"✅ Done. Wrote {len(docs)} chunks -> {args.out_jsonl}")
+    if args.index:
+        docs = tee_to_index(docs, collection=args.collection, batch=args.batch, prune=args.prune)
+    n = export_jsonl_and_meta(docs, out_jsonl=args.out_jsonl, out_meta_csv=args.out_meta_csv)
+    print(f"✅ Done. Wrote {n} chunks -> {args.out_jsonl}")
     print(f"   Meta CSV -> {args.out_meta_csv}")
 
 if __name__ == "__main__":
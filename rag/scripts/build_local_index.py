@@ -0,0 +1,28 @@
+from __future__ import annotations
+import os, sys
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import argparse, json
+from pathlib import Path
+
+from rag.indexer import iter_chunks
+from rag.local_index import build_local_index
+
+def main():
+    ap = argparse.ArgumentParser(description="Build the in-process hybrid index (VECTOR_BACKEND=local) from chunks.jsonl")
+    ap.add_argument("--jsonl", default="data/kb_chunks/chunks.jsonl")
+    ap.add_argument("--out", default=None, help="Output directory (default: LOCAL_INDEX_DIR or data/kb_chunks/local_index)")
+    ap.add_argument("--batch", type=int, default=128)
+    args = ap.parse_args()
+
+    p = Path(args.jsonl)
+    assert p.exists(), f"File not found: {p}"
+    print(f"Building local index from {p} ...")
+    stats = build_local_index(iter_chunks(str(p)), out_dir=args.out, batch_size=args.batch)
+    print(f"✅ Done. Indexed {stats['rows']} chunks.")
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
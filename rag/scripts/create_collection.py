@@ -6,7 +6,7 @@ if ROOT not in sys.path: sys.path.insert(0, ROOT)
 
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, SparseVectorParams
+from qdrant_client.http.models import VectorParams, Distance, SparseVectorParams, PayloadSchemaType
 
 load_dotenv()
 
@@ -15,17 +15,32 @@ QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or None
 COLLECTION = os.getenv("QDRANT_COLLECTION", "laws")
 
 BGE_M3_DIM = 1024  # bge-m3 dense size
+# Filtered fields (chunk metadata sits under the "metadata" payload key); keyword indexes keep
+# per-region searches and delete-by-file cheap
+KEYWORD_INDEXES = ("metadata.region", "metadata.source_path")
+
+def ensure_payload_indexes(client: QdrantClient, collection: str) -> None:
+    for field in KEYWORD_INDEXES:
+        client.create_payload_index(collection_name=collection, field_name=field, field_schema=PayloadSchemaType.KEYWORD)
 
 def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Create the hybrid (dense + sparse) Qdrant collection")
+    ap.add_argument("--collection", default=COLLECTION)
+    args = ap.parse_args()
     client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
 
-    if client.collection_exists(COLLECTION):
-        print(f"Collection '{COLLECTION}' already exists. Skipping creation.")
+    if client.collection_exists(args.collection):
+        print(f"Collection '{args.collection}' already exists. Skipping creation.")
+        ensure_payload_indexes(client, args.collection)  # idempotent; upgrades older collections
+        print(f"Payload indexes: {', '.join(KEYWORD_INDEXES)}")
         return
 
-    print(f"Creating collection '{COLLECTION}' (dense={BGE_M3_DIM}, sparse enabled) ...")
+    # The schema is the same for every SPARSE_MODE (bm25: FastEmbed term weights; bge_m3: learned
+    # lexical weights over the XLM-R vocab, no IDF modifier either way); index and query with the same mode
+    print(f"Creating collection '{args.collection}' (dense={BGE_M3_DIM}, sparse enabled) ...")
     client.create_collection(
-        collection_name=COLLECTION,
+        collection_name=args.collection,
         vectors_config={
             # name your dense vector
             "dense": VectorParams(size=BGE_M3_DIM, distance=Distance.COSINE)
@@ -36,6 +51,7 @@ def main():
         },
         # optional: on-disk payload, optimizers, etc.
     )
+    ensure_payload_indexes(client, args.collection)
     print("✅ Created.")
 
 if __name__ == "__main__":
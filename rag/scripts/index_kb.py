@@ -9,32 +9,67 @@ from pathlib import Path
 from typing import List
 
 from langchain_core.documents import Document
-from rag.qdrant_store import add_documents
+from rag.qdrant_store import existing_point_ids, delete_point_ids
+from rag.indexer import iter_chunks, index_stream, load_checkpoint, file_signature
+from rag.token_index import rebuild_token_index
 
 def load_chunks(jsonl_path: str) -> List[Document]:
-    docs: List[Document] = []
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for line in f:
-            rec = json.loads(line)
-            text = rec["text"].strip()
-            meta = rec.get("metadata", {})
-            docs.append(Document(page_content=text, metadata=meta))
-    return docs
+    return list(iter_chunks(jsonl_path))
 
 def main():
     ap = argparse.ArgumentParser(description="Index chunks.jsonl into Qdrant (hybrid)")
     ap.add_argument("--jsonl", default="data/kb_chunks/chunks.jsonl")
     ap.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION", "laws"))
     ap.add_argument("--batch", type=int, default=128)
+    ap.add_argument("--queue", type=int, default=4, help="Embedded batches buffered ahead of the upsert stage")
+    ap.add_argument("--full", action="store_true", help="Re-embed and upsert every chunk (no diff against the collection)")
+    ap.add_argument("--prune", action="store_true",
+                    help="Also delete points whose chunk is not in the JSONL (only when it covers the whole KB, uploads included)")
+    ap.add_argument("--checkpoint", default=None, help="Checkpoint file for --full runs (default: <jsonl>.index_ckpt.json)")
+    ap.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
     args = ap.parse_args()
 
     p = Path(args.jsonl)
     assert p.exists(), f"File not found: {p}"
 
-    docs = load_chunks(str(p))
-    print(f"Indexing {len(docs)} chunks → collection='{args.collection}' ...")
-    n = add_documents(docs, batch_size=args.batch, collection_name=args.collection)
-    print(f"✅ Done. Upserted {n} docs into Qdrant.")
+    if args.full:
+        # Resume by record offset: the checkpoint is only trusted for the same file + collection
+        ck_path = args.checkpoint or f"{p}.index_ckpt.json"
+        start = 0 if args.restart else load_checkpoint(ck_path, str(p), args.collection)
+        if start:
+            print(f"Resuming from checkpoint: {start} chunks already upserted")
+        print(f"Indexing {p} → collection='{args.collection}' ...")
+        stats = index_stream(
+            iter_chunks(str(p), skip=start),
+            collection_name=args.collection,
+            batch_size=args.batch,
+            queue_size=args.queue,
+            checkpoint={"path": ck_path, "source": file_signature(str(p)), "collection": args.collection},
+            start=start,
+        )
+    else:
+        # Incremental: deterministic IDs → embed only new/changed chunks (and with --prune, drop vanished ones).
+        # Resume is implicit: chunks upserted before a failure are already in the collection.
+        have = existing_point_ids(args.collection)
+        seen: set[str] = set()
+
+        def _new_chunks():
+            for d in iter_chunks(str(p)):
+                seen.add(d.metadata["chunk_id"])
+                if d.metadata["chunk_id"] not in have:
+                    yield d
+
+        print(f"Indexing {p} → collection='{args.collection}' (incremental, {len(have)} points stored) ...")
+        stats = index_stream(_new_chunks(), collection_name=args.collection, batch_size=args.batch, queue_size=args.queue)
+        stats["unchanged"] = len(seen) - stats["chunks"]
+        stats["deleted"] = delete_point_ids(list(have - seen), collection_name=args.collection) if args.prune else 0
+
+    # Token sidecar for the lexical rerank fallback / pre-filter, rebuilt from the current JSONL only:
+    # keys of chunks that are gone are dropped (stored chunks outside the JSONL are re-tokenized on first sight)
+    stats["token_index"], stats["token_index_chunks"] = rebuild_token_index(iter_chunks(str(p)))
+
+    print(f"✅ Done. Upserted {stats['chunks']} chunks.")
+    print(json.dumps(stats, indent=2))
 
 if __name__ == "__main__":
     main()
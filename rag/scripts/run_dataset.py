@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from __future__ import annotations
-import os, sys, csv, json
+import os, sys, csv, json, time, hashlib
 from pathlib import Path
 from typing import List, Dict, Any
 
@@ -8,8 +8,11 @@ ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from rag.chains import make_classify_chain
-from rag.heuristics import auto_rule_hits, infer_regions
+import numpy as np
+from rag.batch import classify_stream
+from rag.heuristics import auto_rule_hits
+
+STAGES = ["heuristics", "retrieval", "rerank", "rate_wait", "llm", "parse"]
 
 
 def law_str(l: Dict[str, Any]) -> str:
@@ -17,7 +20,84 @@ def law_str(l: Dict[str, Any]) -> str:
     return " | ".join([p for p in parts if p])
 
 
-def run_dataset(in_csv: str, out_csv: str, out_jsonl: str, k: int = 5, mmr: bool = False, auto_rules: bool = True) -> None:
+def row_hash(item: Dict[str, Any], k: int, mmr: bool) -> str:
+    # Same row + same run settings → same key; changing k/mmr/model re-runs the row
+    key = json.dumps([item["feature_text"], item["rule_hits"], k, mmr, os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def load_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    done: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            done[rec["row_hash"]] = rec["record"]
+    return done
+
+
+def _drop_torn_tail(path: str) -> None:
+    """Truncate a checkpoint back to its last complete line, so the next append starts on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:  # scan back from the end for the last newline
+            step = min(4096, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            i = block.rfind(b"\n")
+            if i >= 0:
+                pos = pos - step + i + 1
+                break
+            pos -= step
+        if pos != end:
+            f.truncate(pos)
+
+
+def _summary(timings: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    out = {}
+    for stage in STAGES:
+        xs = timings.get(stage) or []
+        if not xs:
+            continue
+        out[stage] = {
+            "n": len(xs),
+            "mean_ms": round(float(np.mean(xs)), 2),
+            "p50_ms": round(float(np.percentile(xs, 50)), 2),
+            "p95_ms": round(float(np.percentile(xs, 95)), 2),
+            "total_s": round(float(np.sum(xs)) / 1000, 2),
+        }
+    return out
+
+
+def run_dataset(
+    in_csv: str,
+    out_csv: str,
+    out_jsonl: str,
+    k: int = 5,
+    mmr: bool = False,
+    auto_rules: bool = True,
+    workers: int | None = None,
+    checkpoint: str | None = None,
+    max_retries: int | None = None,
+) -> Dict[str, Any]:
+    """Classify every row of in_csv, checkpointing each finished row so an interrupted run resumes.
+    - checkpoint (default: <out_jsonl>.ckpt): one JSON line per finished row keyed by row_hash;
+      rows already in it are skipped, failed rows are not recorded and are retried on the next run.
+    - Rate limits (429) are retried with exponential backoff (max_retries, default GROQ_MAX_RETRIES).
+    - Outputs are rewritten at the end, in input order, from the checkpoint.
+    """
+    if max_retries is not None:
+        os.environ["GROQ_MAX_RETRIES"] = str(max_retries)
+    checkpoint = checkpoint or f"{out_jsonl}.ckpt"
+    timings: Dict[str, List[float]] = {s: [] for s in STAGES}
+
     rows: List[Dict[str, Any]] = []
     with open(in_csv, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
@@ -27,59 +107,112 @@ def run_dataset(in_csv: str, out_csv: str, out_jsonl: str, k: int = 5, mmr: bool
             if not (name or desc):
                 continue
             feature_text = f"{name}\n\n{desc}".strip()
+            t0 = time.perf_counter()
             rules = auto_rule_hits(feature_text) if auto_rules else []
-            rows.append({"feature_text": feature_text, "rule_hits": rules})
+            timings["heuristics"].append((time.perf_counter() - t0) * 1000)
+            item = {"feature_text": feature_text, "rule_hits": rules}
+            item["row_hash"] = row_hash(item, k, mmr)
+            rows.append(item)
+
+    done = load_checkpoint(checkpoint)
+    _drop_torn_tail(checkpoint)
+    todo = [(i, item) for i, item in enumerate(rows) if item["row_hash"] not in done]
+    print(f"{len(rows)} rows: {len(rows) - len(todo)} already in {checkpoint}, {len(todo)} to run")
 
     # Ensure out dir
     Path(out_csv).parent.mkdir(parents=True, exist_ok=True)
     Path(out_jsonl).parent.mkdir(parents=True, exist_ok=True)
+    Path(checkpoint).parent.mkdir(parents=True, exist_ok=True)
 
-    with open(out_csv, "w", newline="", encoding="utf-8") as cf, open(out_jsonl, "w", encoding="utf-8") as jf:
-        w = csv.writer(cf)
-        w.writerow(["feature_text", "needs_geo_logic", "reasoning", "laws", "confidence", "rule_hits"]) 
-        for item in rows:
-            # Region-aware chain per row
-            regs = infer_regions(item["feature_text"]) if auto_rules else None
-            chain = make_classify_chain(k=k, mmr=mmr, regions=regs)
-            out: Dict[str, Any] = chain.invoke({"feature_text": item["feature_text"], "rule_hits": item["rule_hits"]})
+    failed: List[Dict[str, Any]] = []
+    t_run = time.perf_counter()
+    with open(checkpoint, "a", encoding="utf-8") as ck:
+        # Region-aware, concurrent classification; rows are checkpointed as they finish
+        for n, (i, item, res) in enumerate(classify_stream(todo, k=k, mmr=mmr, infer=auto_rules, max_workers=workers, ordered=False), 1):
+            if res.get("error"):
+                failed.append({"row": i, "error": res["error"]})
+                print(f"[{n}/{len(todo)}] row {i} failed: {res['error']}")
+                continue
+            out: Dict[str, Any] = res["out"]
             # JSONL dump for audit
             rec = {
                 "feature_text": item["feature_text"],
                 "rule_hits": item["rule_hits"],
                 **out,
             }
-            jf.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            ck.write(json.dumps({"row_hash": item["row_hash"], "row": i, "record": rec, "timings": res["timings"]}, ensure_ascii=False) + "\n")
+            ck.flush()
+            done[item["row_hash"]] = rec
+            for stage in STAGES[1:]:
+                if f"{stage}_ms" in res["timings"]:
+                    timings[stage].append(res["timings"][f"{stage}_ms"])
+            if n % 10 == 0 or n == len(todo):
+                print(f"[{n}/{len(todo)}] {time.perf_counter() - t_run:.1f}s")
 
+    written = 0
+    with open(out_csv, "w", newline="", encoding="utf-8") as cf, open(out_jsonl, "w", encoding="utf-8") as jf:
+        w = csv.writer(cf)
+        w.writerow(["feature_text", "needs_geo_logic", "reasoning", "laws", "confidence", "rule_hits"])
+        for item in rows:
+            rec = done.get(item["row_hash"])
+            if rec is None:
+                continue
+            jf.write(json.dumps(rec, ensure_ascii=False) + "\n")
             # CSV row (flatten laws)
-            laws_flat = "; ".join(law_str(l) for l in out.get("laws", []))
+            laws_flat = "; ".join(law_str(l) for l in rec.get("laws", []))
             w.writerow([
-                item["feature_text"],
-                out.get("needs_geo_logic"),
-                out.get("reasoning",""),
+                rec["feature_text"],
+                rec.get("needs_geo_logic"),
+                rec.get("reasoning",""),
                 laws_flat,
-                out.get("confidence", 0.0),
-                ";".join(item.get("rule_hits", [])),
+                rec.get("confidence", 0.0),
+                ";".join(rec.get("rule_hits", [])),
             ])
+            written += 1
 
-    print(f"✅ Wrote {out_csv} and {out_jsonl}")
+    summary = {
+        "rows": len(rows),
+        "skipped_from_checkpoint": len(rows) - len(todo),
+        "classified": len(todo) - len(failed),
+        "failed": failed,
+        "written": written,
+        "wall_s": round(time.perf_counter() - t_run, 2),
+        "stages": _summary(timings),
+    }
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if failed:
+        print(f"⚠️ {len(failed)} rows failed; re-run the same command to retry only those")
+    print(f"✅ Wrote {out_csv} and {out_jsonl} ({written}/{len(rows)} rows)")
+    return summary
 
 
 if __name__ == "__main__":
     import argparse
-    ap = argparse.ArgumentParser(description="Run dataset CSV through classifier → outputs.csv + outputs.jsonl")
+    ap = argparse.ArgumentParser(description="Run dataset CSV through classifier → outputs.csv + outputs.jsonl (resumable)")
     ap.add_argument("--in", dest="inp", default="data/test_dataset.csv")
     ap.add_argument("--out_csv", default="data/outputs.csv")
     ap.add_argument("--out_jsonl", default="data/outputs.jsonl")
     ap.add_argument("--k", type=int, default=5)
     ap.add_argument("--mmr", action="store_true")
     ap.add_argument("--no_auto_rules", action="store_true", help="Disable heuristics and send no rule hits")
+    ap.add_argument("--workers", type=int, default=None, help="Concurrent LLM calls (default: BATCH_WORKERS or 4)")
+    ap.add_argument("--checkpoint", default=None, help="Finished-row log used to resume (default: <out_jsonl>.ckpt)")
+    ap.add_argument("--fresh", action="store_true", help="Ignore and replace an existing checkpoint")
+    ap.add_argument("--max_retries", type=int, default=None, help="Retries per row on rate limits (default: GROQ_MAX_RETRIES or 5)")
     args = ap.parse_args()
 
-    run_dataset(
+    ckpt = args.checkpoint or f"{args.out_jsonl}.ckpt"
+    if args.fresh and os.path.exists(ckpt):
+        os.remove(ckpt)
+    summary = run_dataset(
         in_csv=args.inp,
         out_csv=args.out_csv,
         out_jsonl=args.out_jsonl,
         k=args.k,
         mmr=args.mmr,
         auto_rules=not args.no_auto_rules,
+        workers=args.workers,
+        checkpoint=ckpt,
+        max_retries=args.max_retries,
     )
+    sys.exit(1 if summary["failed"] else 0)
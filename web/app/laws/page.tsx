@@ -60,8 +60,17 @@ export default function Page() {
                   fd.append("article_or_section", article);
                   const r = await fetch(`${API}/laws/upload`, { method: "POST", body: fd });
                   if (!r.ok) throw new Error(await r.text());
-                  const j = await r.json();
-                  setMsg(`Uploaded: ${j.txt_file}, indexed chunks: ${j.indexed_chunks}`);
+                  const { job_id } = await r.json();
+                  // Ingestion runs in the background; poll the job until it finishes
+                  let job: any = null;
+                  while (true) {
+                    job = await fetch(`${API}/laws/jobs/${job_id}`).then(res => res.json());
+                    if (job.status === "done" || job.status === "error") break;
+                    setMsg(`Processing (${job.stage})...`);
+                    await new Promise(res => setTimeout(res, 1000));
+                  }
+                  if (job.status === "error") throw new Error(job.error || "Ingestion failed");
+                  setMsg(`Uploaded: ${job.result?.txt_file}, indexed chunks: ${job.result?.indexed_chunks}`);
                   const list = await fetch(`${API}/laws`).then(res => res.json());
                   setLaws(list.laws || []);
                   setFile(null); setLawName(""); setLawRegion(""); setSource(""); setArticle("");
@@ -1,6 +1,6 @@
 "use client";
 import { useMemo, useState } from "react";
-import { postJSON } from "./api";
+import { postStream } from "./api";
 import DecisionSummary from "./DecisionSummary";
 import { Badge } from "./Ui";
 import clsx from "clsx";
@@ -20,6 +20,8 @@ export default function AnalyzeBox() {
 	const [res, setRes] = useState<any>(null);
 	const [error, setError] = useState<string | null>(null);
 	const [assume, setAssume] = useState<string | null>(null);
+	const [sources, setSources] = useState<any[] | null>(null);
+	const [partial, setPartial] = useState("");
 
 	const payloadText = useMemo(() => {
 		if (!assume) return text;
@@ -30,13 +32,19 @@ export default function AnalyzeBox() {
 		setError(null);
 		setLoading(true);
 		setRes(null);
+		setSources(null);
+		setPartial("");
 		try {
-			const path = rules.length ? "/classify" : "/classify_auto";
+			const path = rules.length ? "/classify/stream" : "/classify_auto/stream";
 			const regions = mapAssumeToCodes(assume);
 			const body = rules.length
 				? { feature_text: payloadText, rule_hits: rules, regions }
 				: { feature_text: payloadText, regions };
-			const out = await postJSON<any>(path, body);
+			// Sources arrive before the LLM call, then the verdict JSON streams in token by token
+			const out = await postStream<any>(path, body, {
+				onSources: setSources,
+				onToken: (t) => setPartial((prev) => prev + t),
+			});
 			setRes(out);
 		} catch (e: any) {
 			setError(e.message || String(e));
@@ -167,6 +175,19 @@ export default function AnalyzeBox() {
 			</div>
 
 			{error && <div className="text-sm text-red-600">{error}</div>}
+			{loading && sources && (
+				<div className="card p-3 space-y-2">
+					<div className="text-xs text-slate-300">Retrieved {sources.length} law chunks</div>
+					<div className="flex flex-wrap gap-2 text-xs">
+						{sources.map((s, i) => (
+							<span key={i} className="chip chip-muted">
+								{[s.region, s.law_name].filter(Boolean).join(" · ") || "Untitled"}
+							</span>
+						))}
+					</div>
+					{partial && <pre className="text-xs whitespace-pre-wrap text-slate-200">{partial}</pre>}
+				</div>
+			)}
 			{res && <DecisionSummary res={res} />}
 		</div>
 	);
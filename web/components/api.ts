@@ -9,3 +9,46 @@ export async function postJSON<T>(path: string, body: any): Promise<T> {
 	if (!r.ok) throw new Error(await r.text());
 	return r.json();
 }
+
+export type StreamHandlers = {
+	onSources?: (sources: any[]) => void;
+	onToken?: (text: string) => void;
+};
+
+// POST to one of the /…/stream endpoints (SSE) and resolve with the `final` event's data.
+export async function postStream<T>(path: string, body: any, handlers: StreamHandlers = {}): Promise<T> {
+	const r = await fetch(`${API}${path}`, {
+		method: "POST",
+		headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+		body: JSON.stringify(body),
+	});
+	if (!r.ok || !r.body) throw new Error(await r.text());
+	const reader = r.body.getReader();
+	const decoder = new TextDecoder();
+	let buf = "";
+	let final: T | undefined;
+	for (;;) {
+		const { value, done } = await reader.read();
+		if (done) break;
+		buf += decoder.decode(value, { stream: true });
+		let sep;
+		while ((sep = buf.indexOf("\n\n")) >= 0) {
+			const frame = buf.slice(0, sep);
+			buf = buf.slice(sep + 2);
+			let event = "message";
+			const data: string[] = [];
+			for (const line of frame.split("\n")) {
+				if (line.startsWith("event:")) event = line.slice(6).trim();
+				else if (line.startsWith("data:")) data.push(line.slice(5).trimStart());
+			}
+			if (!data.length) continue;
+			const payload = JSON.parse(data.join("\n"));
+			if (event === "sources") handlers.onSources?.(payload);
+			else if (event === "token") handlers.onToken?.(payload.text);
+			else if (event === "final") final = payload;
+			else if (event === "error") throw new Error(payload.detail);
+		}
+	}
+	if (final === undefined) throw new Error("Stream ended without a result");
+	return final;
+}